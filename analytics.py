@@ -0,0 +1,194 @@
+"""Category and time breakdowns over a user's expenses.
+
+The inputs are compact columns (day ordinals, integer cents, category codes
+and description codes) such as ExpenseCache keeps in memory. With NumPy
+installed every breakdown is a handful of vectorized passes (add.at,
+cumsum, percentile) over zero-copy views of those columns; without it the
+same results are computed with plain Python loops, which is fine for small
+ledgers.
+"""
+from array import array
+from datetime import date
+
+from dates import format_day, parse_day
+from money import divide
+from validation import CATEGORIES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# date(1970, 1, 1).toordinal(), the epoch of numpy's datetime64
+_EPOCH_ORDINAL = 719163
+
+PERCENTILES = (50, 90, 99)
+
+
+class ExpenseColumns:
+    """Column-oriented expenses: parallel arrays plus the description vocabulary"""
+
+    def __init__(self, days, cents, codes, descriptions, vocabulary):
+        self.days = days
+        self.cents = cents
+        self.codes = codes
+        self.descriptions = descriptions
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_expenses(cls, expenses):
+        """Build columns from expense dicts, e.g. Database.iter_expenses"""
+        category_codes = {category: code for code, category in enumerate(CATEGORIES)}
+        days, cents, codes, descriptions = array('l'), array('q'), array('B'), array('l')
+        vocabulary, words = {}, []
+        for expense in expenses:
+            days.append(parse_day(expense['date']))
+            cents.append(expense['amount'])
+            codes.append(category_codes[expense['category']])
+            code = vocabulary.get(expense['description'])
+            if code is None:
+                code = vocabulary[expense['description']] = len(words)
+                words.append(expense['description'])
+            descriptions.append(code)
+        return cls(days, cents, codes, descriptions, words)
+
+
+def _month_label(ordinal):
+    day = date.fromordinal(ordinal)
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+def _percentile(sorted_values, q):
+    """Linear-interpolation percentile, matching numpy's default method"""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _group_sums(keys, cents, length=0):
+    """Exact int64 totals of cents per key; bincount's float weights round above 2**53"""
+    totals = np.zeros(max(length, int(keys.max()) + 1), dtype=np.int64)
+    np.add.at(totals, keys, cents)
+    return totals
+
+
+def _divide(totals, count):
+    """Vectorized money.divide: totals / count rounded to the nearest cent, ties to even"""
+    quotient, remainder = np.divmod(totals, count)
+    return quotient + ((2 * remainder > count) | ((2 * remainder == count) & (quotient % 2 == 1)))
+
+
+def _analyze_numpy(columns, top_n, rolling_days):
+    days = np.frombuffer(columns.days, dtype=f'i{columns.days.itemsize}').astype(np.int64)
+    cents = np.frombuffer(columns.cents, dtype=np.int64)
+    codes = np.frombuffer(columns.codes, dtype=np.uint8)
+    descriptions = np.frombuffer(columns.descriptions,
+                                 dtype=f'i{columns.descriptions.itemsize}')
+
+    category_totals = _group_sums(codes, cents, len(CATEGORIES))
+    by_category = {CATEGORIES[code]: int(total)
+                   for code, total in enumerate(category_totals) if total}
+
+    months = (days - _EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    first_month = int(months.min())
+    month_totals = _group_sums(months - first_month, cents)
+    monthly = [(str(np.datetime64(first_month + index, 'M')), int(total))
+               for index, total in enumerate(month_totals)]
+
+    first_day = int(days.min())
+    daily = _group_sums(days - first_day, cents)
+    running = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(daily)))
+    window = min(rolling_days, len(daily))
+    rolling = _divide(running[window:] - running[:-window], window)
+    rolling_average = [(format_day(first_day + window - 1 + index), int(value))
+                       for index, value in enumerate(rolling)]
+
+    percentiles = {q: int(round(value))
+                   for q, value in zip(PERCENTILES, np.percentile(cents, PERCENTILES))}
+
+    description_totals = _group_sums(descriptions, cents)
+    description_counts = np.bincount(descriptions)
+    order = np.argsort(-description_totals, kind='stable')[:top_n]
+    top_descriptions = [(columns.vocabulary[code], int(description_totals[code]),
+                         int(description_counts[code]))
+                        for code in order if description_counts[code]]
+
+    return by_category, monthly, rolling_average, percentiles, top_descriptions
+
+
+def _analyze_python(columns, top_n, rolling_days):
+    by_category = {}
+    month_totals = {}
+    daily = {}
+    description_totals = {}
+    for day, cents, code, description in zip(columns.days, columns.cents, columns.codes,
+                                             columns.descriptions):
+        category = CATEGORIES[code]
+        by_category[category] = by_category.get(category, 0) + cents
+        daily[day] = daily.get(day, 0) + cents
+        total, count = description_totals.get(description, (0, 0))
+        description_totals[description] = (total + cents, count + 1)
+
+    for day, cents in daily.items():
+        month = _month_label(day)
+        month_totals[month] = month_totals.get(month, 0) + cents
+    first_day, last_day = min(daily), max(daily)
+    monthly = []
+    month = _month_label(first_day)
+    last_month = _month_label(last_day)
+    while month <= last_month:
+        monthly.append((month, month_totals.get(month, 0)))
+        index = int(month[:4]) * 12 + int(month[5:7])
+        month = f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+    span = last_day - first_day + 1
+    window = min(rolling_days, span)
+    rolling_average = []
+    window_total = sum(daily.get(first_day + offset, 0) for offset in range(window))
+    for day in range(first_day + window - 1, last_day + 1):
+        if day > first_day + window - 1:
+            window_total += daily.get(day, 0) - daily.get(day - window, 0)
+        rolling_average.append((format_day(day), divide(window_total, window)))
+
+    ordered = sorted(columns.cents)
+    percentiles = {q: int(round(_percentile(ordered, q))) for q in PERCENTILES}
+
+    ranked = sorted(description_totals.items(), key=lambda item: (-item[1][0], item[0]))[:top_n]
+    top_descriptions = [(columns.vocabulary[code], total, count) for code, (total, count) in ranked]
+
+    return by_category, monthly, rolling_average, percentiles, top_descriptions
+
+
+def analyze(columns, top_n=5, rolling_days=30):
+    """Breakdowns of a set of expenses. All money values are integer cents.
+
+    Returns a dict with:
+      by_category       {category: total}
+      monthly           [(YYYY-MM, total)] for every month in the span, oldest first
+      month_over_month  change of the last month against the one before, as a
+                        fraction (0.25 is +25%), or None without two months
+      rolling_average   [(YYYY-MM-DD, average daily spend over the trailing
+                        rolling_days days)], from the first full window on
+      percentiles       {50: ..., 90: ..., 99: ...} of individual expenses
+      top_descriptions  [(description, total, count)] for the top_n
+                        descriptions by amount spent
+    """
+    if not len(columns):
+        return {'by_category': {}, 'monthly': [], 'month_over_month': None,
+                'rolling_average': [], 'percentiles': {}, 'top_descriptions': []}
+
+    analyze_impl = _analyze_numpy if np is not None else _analyze_python
+    by_category, monthly, rolling_average, percentiles, top_descriptions = analyze_impl(
+        columns, top_n, rolling_days)
+
+    month_over_month = None
+    if len(monthly) >= 2 and monthly[-2][1]:
+        month_over_month = (monthly[-1][1] - monthly[-2][1]) / monthly[-2][1]
+
+    return {'by_category': by_category, 'monthly': monthly,
+            'month_over_month': month_over_month, 'rolling_average': rolling_average,
+            'percentiles': percentiles, 'top_descriptions': top_descriptions}
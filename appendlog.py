@@ -0,0 +1,207 @@
+"""Durable append-only log of records, written by one thread in group commits.
+
+Writers hand records to append() and then wait(); a committer thread gathers
+whatever has queued, waiting up to commit_interval seconds for more unless
+commit_records are in hand, and writes them to the current segment file with
+a single fsync. Many writers thus share one disk sync instead of paying one
+each. The default interval of 0 waits for nothing: records that arrive while
+one fsync runs make up the next commit, so a lone writer is not held back.
+
+max_unsynced bounds what a crash may lose: wait() returns once no more than
+that many of the records appended so far are still waiting for their fsync.
+With the default of 0 a record is on disk before wait() returns.
+
+Each line is a CRC32 of its JSON payload followed by the payload, so a line
+torn by a crash is recognised and replay stops there. rotate() starts a new
+segment and returns the ones before it, which their owner deletes once it
+has stored their records elsewhere (see database.LoggedDatabase).
+"""
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+SEGMENT_FILE = '{:08d}.log'
+DEFAULT_COMMIT_INTERVAL = 0.0
+DEFAULT_COMMIT_RECORDS = 1024
+
+_STOP = object()
+
+
+def _encode(seq, record):
+    payload = json.dumps(dict(record, seq=seq), separators=(',', ':'))
+    return f'{zlib.crc32(payload.encode()):08x} {payload}\n'
+
+
+def _decode(line):
+    """(seq, record) of a log line, or None if the line is torn or corrupt"""
+    checksum, _, payload = line.rstrip('\n').partition(' ')
+    try:
+        if int(checksum, 16) != zlib.crc32(payload.encode()):
+            return None
+        record = json.loads(payload)
+    except ValueError:
+        return None
+    return record.pop('seq'), record
+
+
+class AppendLog:
+    """Group-committed log of JSON records in a directory of segment files.
+
+    Records carry a sequence number chosen by the caller, which must hand
+    them to append() in increasing order.
+    """
+
+    def __init__(self, directory, commit_interval=DEFAULT_COMMIT_INTERVAL,
+                 commit_records=DEFAULT_COMMIT_RECORDS, max_unsynced=0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.commit_records = commit_records
+        self.max_unsynced = max_unsynced
+        self._queue = queue.SimpleQueue()
+        # Held by the committer while writing and by rotate() while switching files
+        self._file_lock = threading.Lock()
+        self._file = None
+        self._synced = threading.Condition()
+        self._appended_seq = self._synced_seq = self._written_seq = 0
+        self._error = None
+        self._stats = {'commits': 0, 'records': 0, 'largest_commit': 0, 'sync_seconds': 0.0}
+        segments = self._segments()
+        self._next_segment = segments[-1][0] + 1 if segments else 1
+        self._thread = threading.Thread(target=self._commit_loop, name='append-log',
+                                         daemon=True)
+        self._thread.start()
+
+    def _segments(self):
+        """(index, path) of every segment file, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            stem, dot, extension = name.partition('.')
+            if dot and extension == 'log' and stem.isdigit():
+                found.append((int(stem), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def replay(self, after_seq=0):
+        """Yield the (seq, record) pairs on disk with seq above after_seq, oldest first.
+
+        Stops at the first torn or corrupt line, since nothing after it was
+        acknowledged as written in order.
+        """
+        for _, path in self._segments():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    entry = _decode(line)
+                    if entry is None:
+                        return
+                    if entry[0] > after_seq:
+                        yield entry
+
+    def append(self, seq, record):
+        """Queue a record for the next commit. Callers serialize their appends to keep seq order"""
+        with self._synced:
+            if self._error is not None:
+                raise OSError(f"The append log failed: {self._error}")
+            self._appended_seq = seq
+            self._queue.put((seq, _encode(seq, record)))
+
+    def wait(self, seq):
+        """Block until record seq is on disk or no more than max_unsynced records are not.
+
+        Raises OSError if the committer could not write the log.
+        """
+        with self._synced:
+            while (self._error is None and seq > self._synced_seq
+                   and self._appended_seq - self._synced_seq > self.max_unsynced):
+                self._synced.wait()
+            if self._error is not None and seq > self._synced_seq:
+                raise OSError(f"The append log failed: {self._error}")
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, SEGMENT_FILE.format(self._next_segment))
+        self._next_segment += 1
+        self._file = open(path, 'a', encoding='utf-8')
+        # Make the new file's directory entry durable along with its first records
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _commit_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.commit_interval
+            stop = False
+            while len(batch) < self.commit_records:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except OSError as e:
+                with self._synced:
+                    self._error = e
+                    self._synced.notify_all()
+                return
+            if stop:
+                return
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        with self._file_lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(''.join(line for _, line in batch))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._written_seq = batch[-1][0]
+        with self._synced:
+            self._synced_seq = batch[-1][0]
+            self._stats['commits'] += 1
+            self._stats['records'] += len(batch)
+            self._stats['largest_commit'] = max(self._stats['largest_commit'], len(batch))
+            self._stats['sync_seconds'] += time.perf_counter() - started
+            self._synced.notify_all()
+
+    def rotate(self):
+        """Close the current segment. Returns (last seq written, paths of every closed segment).
+
+        Every record up to that seq is in the returned segments; later ones
+        go to a new segment.
+        """
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            return self._written_seq, [path for _, path in self._segments()]
+
+    def remove(self, paths):
+        """Delete segments returned by rotate() once their records are stored elsewhere"""
+        for path in paths:
+            os.remove(path)
+
+    def close(self):
+        """Write out everything queued and stop the committer"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """Commits, records, the largest commit and seconds spent writing and syncing"""
+        with self._synced:
+            return dict(self._stats, unsynced=self._appended_seq - self._synced_seq)
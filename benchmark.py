@@ -0,0 +1,497 @@
+"""Benchmarks of the Database hot paths over seeded synthetic ledgers.
+
+Usage: python benchmark.py [--sizes 1k,100k,1M] [--seed 1] [--output FILE]
+                           [--baseline FILE] [--threshold 0.25] [--only TEXT]
+                           [--shards 1,2,4] [--log]
+
+For every size a user with that many expenses is generated from the seed, so
+the same arguments always benchmark the same data. Generated databases are
+kept in --data-dir and reused, because building a 10M row ledger takes
+minutes. Benchmarks that write (add_expense, add_expenses) remove their rows
+again afterwards, so a kept database stays the same from run to run.
+
+With --shards, write throughput is also measured on sharded stores with each
+of the given shard counts (see sharding.py): SHARD_WRITERS threads, each
+writing its own user's ledger, spread evenly over the shards, with every
+shard served by a worker process. Compare the rows/s of the counts.
+
+With --log, add_expense throughput of the per-row transaction path is
+compared with LoggedDatabase's append log, waiting for every fsync and with
+LOG_MAX_UNSYNCED adds allowed in flight, for 1 and SHARD_WRITERS writers.
+
+Results go to stdout as a table and, with --output, to a JSON file; a
+results file serves as the baseline of later runs. With --baseline each
+median is compared against the stored one, and the exit status is 1 if any
+got slower by more than --threshold.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from cache import ExpenseCache, QueryCache
+from database import Database, LoggedDatabase
+from dates import format_day
+from money import MAX_CENTS, format_cents
+from service import ExpenseService, PAGE_SIZE, average, normalize_filters, sort_key
+from sharding import ShardedDatabase, shard_for
+from validation import CATEGORIES
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'benchmark'
+
+# Share of all expenses, median amount in cents and log-normal spread of each
+# category, roughly what a household ledger looks like
+CATEGORY_PROFILES = {
+    'Food': (0.30, 1500, 0.8),
+    'Transport': (0.15, 2000, 0.9),
+    'Shopping': (0.15, 4500, 1.1),
+    'Bills': (0.10, 9000, 0.7),
+    'Entertainment': (0.10, 3000, 0.9),
+    'Healthcare': (0.06, 6000, 1.0),
+    'Education': (0.04, 8000, 1.0),
+    'Other': (0.10, 2500, 1.2),
+}
+
+DESCRIPTION_WORDS = {
+    'Food': ['Groceries', 'Lunch', 'Coffee', 'Dinner', 'Bakery', 'Takeaway'],
+    'Transport': ['Fuel', 'Train ticket', 'Bus pass', 'Taxi', 'Parking', 'Car wash'],
+    'Shopping': ['Clothes', 'Shoes', 'Electronics', 'Books', 'Gifts', 'Furniture'],
+    'Bills': ['Electricity', 'Water', 'Internet', 'Phone', 'Rent', 'Insurance'],
+    'Entertainment': ['Cinema', 'Concert', 'Streaming', 'Games', 'Museum', 'Bowling'],
+    'Healthcare': ['Pharmacy', 'Dentist', 'Doctor', 'Optician', 'Physio', 'Vitamins'],
+    'Education': ['Course', 'Textbooks', 'Tuition', 'Workshop', 'Stationery', 'Exam fee'],
+    'Other': ['Donation', 'Haircut', 'Laundry', 'Repairs', 'Postage', 'Pet supplies'],
+}
+
+PLACES = ['downtown', 'at the mall', 'online', 'near work', 'with friends', 'weekly',
+          'Corner Store', 'Central Station', 'Main Street', 'Riverside', 'airport', 'market']
+
+# Expenses are spread over the ten years before this day
+LAST_DAY = date(2024, 12, 31).toordinal()
+SPAN_DAYS = 3653
+
+# Filter combinations every read benchmark runs under:
+# (category, start date, end date, search) as the filter form would submit them
+FILTERS = {
+    'all': (None, None, None, None),
+    'range': (None, '2023-01-01', '2023-12-31', None),
+    'category': ('Food', None, None, None),
+    'category+range': ('Food', '2023-01-01', '2023-12-31', None),
+    'search': (None, None, None, 'coffee'),
+    'search+range': (None, '2023-01-01', '2023-12-31', 'train'),
+}
+
+# Rows per build transaction and per bulk add benchmark
+BUILD_CHUNK = 50000
+BULK_ROWS = 10000
+# Concurrent writers in the sharded write benchmarks, and rows each adds per run
+SHARD_WRITERS = 8
+SHARD_SINGLE_ROWS = 200
+# Adds per writer in the append log benchmarks, and the looser durability bound measured
+LOG_ROWS = 400
+LOG_MAX_UNSYNCED = 1000
+
+
+def generate_expenses(count, seed):
+    """Yield count (amount, category, description, date) tuples, the same for the same seed"""
+    rng = random.Random(seed)
+    weights = [CATEGORY_PROFILES[category][0] for category in CATEGORIES]
+    first_day = LAST_DAY - SPAN_DAYS + 1
+    produced = 0
+    while produced < count:
+        batch = min(count - produced, 10000)
+        for category in rng.choices(CATEGORIES, weights, k=batch):
+            _, median, spread = CATEGORY_PROFILES[category]
+            cents = int(rng.lognormvariate(math.log(median), spread))
+            description = f"{rng.choice(DESCRIPTION_WORDS[category])} {rng.choice(PLACES)}"
+            yield (min(max(cents, 1), MAX_CENTS), category, description,
+                   format_day(first_day + rng.randrange(SPAN_DAYS)))
+        produced += batch
+
+
+def parse_size(text):
+    """Ledger size from '5000', '10k' or '10M'"""
+    match = re.fullmatch(r'(\d+)([kKmM]?)', text.strip())
+    if match is None:
+        raise ValueError(f"Not a ledger size: {text!r}")
+    number, suffix = match.groups()
+    return int(number) * {'': 1, 'k': 1000, 'm': 1000000}[suffix.lower()]
+
+
+def build_database(path, size, seed, on_progress=None):
+    """Create a database holding one BENCH_USER with size generated expenses.
+
+    The file is built under a temporary name and renamed when complete, so
+    an interrupted build is never mistaken for a finished one.
+    """
+    partial = path + '.partial'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    db = Database(partial)
+    db.register_user(BENCH_USER, BENCH_PASSWORD)
+    user_id = db.get_user_id(BENCH_USER)
+    chunk = []
+    for expense in generate_expenses(size, seed):
+        chunk.append(expense)
+        if len(chunk) >= BUILD_CHUNK:
+            db.add_expenses(user_id, chunk)
+            chunk = []
+            if on_progress:
+                on_progress(db.count_expenses(user_id), size)
+    if chunk:
+        db.add_expenses(user_id, chunk)
+    with db.pool.connection() as conn:
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.commit()
+    db.close()
+    os.replace(partial, path)
+
+
+class Timer:
+    """Runs benchmark functions and keeps their timing statistics.
+
+    Each function is run repeat times, but no more once budget seconds have
+    been spent on it, and at least min_runs times.
+    """
+
+    def __init__(self, repeat=20, min_runs=3, budget=2.0, only=None):
+        self.repeat = repeat
+        self.min_runs = min_runs
+        self.budget = budget
+        self.only = only
+        self.results = {}
+
+    def wanted(self, name):
+        return self.only is None or self.only in name
+
+    def measure(self, name, func, repeat=None, warmup=1, rows=None):
+        """Time func(); rows, if given, is the number of rows one call handles"""
+        if not self.wanted(name):
+            return
+        for _ in range(warmup):
+            func()
+        samples = []
+        spent = 0.0
+        for _ in range(repeat or self.repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            samples.append(elapsed)
+            spent += elapsed
+            if spent > self.budget and len(samples) >= self.min_runs:
+                break
+        self.record(name, samples, rows)
+
+    def record(self, name, samples, rows=None):
+        """Store statistics of timings (in seconds) taken by the caller"""
+        if not self.wanted(name) or not samples:
+            return
+        ordered = sorted(samples)
+        result = {'runs': len(ordered),
+                  'min_ms': ordered[0] * 1000,
+                  'median_ms': statistics.median(ordered) * 1000,
+                  'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                  'mean_ms': statistics.fmean(ordered) * 1000}
+        if rows:
+            result['rows_per_second'] = rows / statistics.median(ordered)
+        self.results[name] = result
+
+
+def simulate_refresh(service, user_id, raw_filters):
+    """Everything ModernExpenseTracker.refresh_data does for a page, minus Tk.
+
+    Validates the filter form, loads the page and its summary, formats the
+    rows and cards the way the table shows them and computes the analytics
+    cards.
+    """
+    category, start_date, end_date, search = raw_filters
+    filters = normalize_filters(category, start_date, end_date, search)
+    page = service.load_page(user_id, filters, 0, PAGE_SIZE)
+    rows = [(expense['date'], expense['category'], expense['description'],
+             format_cents(expense['amount'], '$')) for expense in page['expenses']]
+    summary = page['summary']
+    cards = (format_cents(summary['total'], '$'), str(summary['count']),
+             format_cents(average(summary['total'], summary['count']), '$'))
+    analytics = service.analytics(user_id, filters)
+    return rows, cards, analytics
+
+
+def run_size(timer, path, size, seed):
+    """Run every benchmark against the ledger database at path"""
+    prefix = f'{size}/'
+    db = Database(path)
+    user_id = db.get_user_id(BENCH_USER)
+
+    timer.measure(prefix + 'authenticate_user',
+                  lambda: db.authenticate_user(BENCH_USER, BENCH_PASSWORD), repeat=5)
+
+    for name, (category, start_date, end_date, search) in FILTERS.items():
+        filters = normalize_filters(category, start_date, end_date, search)
+        start_date, end_date, category, search = filters
+        timer.measure(f'{prefix}get_expenses/{name}',
+                      lambda: db.get_expenses(user_id, start_date, end_date, category,
+                                              limit=PAGE_SIZE, search=search))
+        page = db.get_expenses(user_id, start_date, end_date, category, limit=PAGE_SIZE,
+                               search=search, sort=('amount', True))
+        if page:
+            after = sort_key(page[-1], 'amount')
+            timer.measure(f'{prefix}get_expenses/{name}/by_amount_next_page',
+                          lambda: db.get_expenses(user_id, start_date, end_date, category,
+                                                  limit=PAGE_SIZE, search=search,
+                                                  sort=('amount', True), after=after))
+        timer.measure(f'{prefix}get_expense_summary/{name}',
+                      lambda: db.get_expense_summary(user_id, start_date, end_date, category,
+                                                     search))
+
+    if timer.wanted(prefix + 'add_expense') or timer.wanted(prefix + 'delete_expense'):
+        _time_single_writes(timer, prefix, db, user_id, seed)
+    if timer.wanted(prefix + 'add_expenses') or timer.wanted(prefix + 'delete_expenses'):
+        _time_bulk_writes(timer, prefix, db, user_id, seed)
+
+    # refresh_data through the app's cache stack: cold is the first refresh
+    # after login, warm a repeat of one already seen
+    for name in ('all', 'category+range', 'search'):
+        if not timer.wanted(f'{prefix}refresh_data/{name}/'):
+            continue
+        raw_filters = FILTERS[name]
+        samples = []
+        for _ in range(min(3, timer.repeat)):
+            service = ExpenseService(QueryCache(ExpenseCache(db)))
+            started = time.perf_counter()
+            simulate_refresh(service, user_id, raw_filters)
+            samples.append(time.perf_counter() - started)
+        timer.record(f'{prefix}refresh_data/{name}/cold', samples)
+        timer.measure(f'{prefix}refresh_data/{name}/warm',
+                      lambda: simulate_refresh(service, user_id, raw_filters))
+
+    # Make sure the write benchmarks really left the ledger as it was built
+    if db.count_expenses(user_id) != size:
+        raise RuntimeError(f"benchmark ledger {path} no longer has {size} expenses")
+    db.close()
+
+
+def _time_single_writes(timer, prefix, db, user_id, seed):
+    """Add rows one at a time, then delete the same rows"""
+    added = []
+    samples = []
+    for expense in generate_expenses(timer.repeat * 5, seed + 2):
+        started = time.perf_counter()
+        added.append(db.add_expense(user_id, *expense))
+        samples.append(time.perf_counter() - started)
+    timer.record(prefix + 'add_expense', samples)
+    samples = []
+    for expense_id in added:
+        started = time.perf_counter()
+        db.delete_expense(expense_id, user_id)
+        samples.append(time.perf_counter() - started)
+    timer.record(prefix + 'delete_expense', samples)
+
+
+def _time_bulk_writes(timer, prefix, db, user_id, seed):
+    """Add batches with add_expenses, removing each again with delete_expenses"""
+    add_samples, delete_samples = [], []
+    for run in range(3):
+        batch = list(generate_expenses(BULK_ROWS, seed + 3 + run))
+        started = time.perf_counter()
+        db.add_expenses(user_id, batch)
+        add_samples.append(time.perf_counter() - started)
+        with db.pool.connection() as conn:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM expenses WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, BULK_ROWS))]
+        started = time.perf_counter()
+        db.delete_expenses(ids, user_id)
+        delete_samples.append(time.perf_counter() - started)
+    timer.record(f'{prefix}add_expenses/{BULK_ROWS}', add_samples, rows=BULK_ROWS)
+    timer.record(f'{prefix}delete_expenses/{BULK_ROWS}', delete_samples, rows=BULK_ROWS)
+
+
+def balanced_users(shards, count):
+    """count user ids spread as evenly as possible over the shards"""
+    users = []
+    placed = [0] * shards
+    user_id = 0
+    while len(users) < count:
+        user_id += 1
+        shard = shard_for(user_id, shards)
+        if placed[shard] < -(-count // shards):
+            placed[shard] += 1
+            users.append(user_id)
+    return users
+
+
+def run_shards(timer, shards, seed):
+    """Time concurrent writers on a new sharded store with this many shards"""
+    prefix = f'shards/{shards}/'
+    single, bulk = prefix + 'add_expense', f'{prefix}add_expenses/{BULK_ROWS}'
+    if not (timer.wanted(single) or timer.wanted(bulk)):
+        return
+    users = balanced_users(shards, SHARD_WRITERS)
+    with tempfile.TemporaryDirectory(prefix='expense-bench-shards-') as directory, \
+            ThreadPoolExecutor(max_workers=SHARD_WRITERS) as writers:
+        db = ShardedDatabase(directory, shards, processes=1)
+        try:
+            # Start every worker process before timing anything
+            for user_id in users:
+                db.count_expenses(user_id)
+
+            def write_all(write):
+                started = time.perf_counter()
+                for future in [writers.submit(write, user_id) for user_id in users]:
+                    future.result()
+                return time.perf_counter() - started
+
+            if timer.wanted(single):
+                rows = list(generate_expenses(SHARD_SINGLE_ROWS, seed + 4))
+
+                def add_singly(user_id):
+                    for expense in rows:
+                        db.add_expense(user_id, *expense)
+                samples = [write_all(add_singly) for _ in range(3)]
+                timer.record(single, samples, rows=SHARD_SINGLE_ROWS * SHARD_WRITERS)
+            if timer.wanted(bulk):
+                batch = list(generate_expenses(BULK_ROWS // SHARD_WRITERS, seed + 5))
+                samples = [write_all(lambda user_id: db.add_expenses(user_id, batch))
+                           for _ in range(3)]
+                timer.record(bulk, samples, rows=len(batch) * SHARD_WRITERS)
+        finally:
+            db.close()
+
+
+def run_log(timer, seed):
+    """Time concurrent add_expense calls on the per-row path and through the append log"""
+    paths = {'per_row': lambda path: Database(path),
+             'log': lambda path: LoggedDatabase(path),
+             f'log_unsynced_{LOG_MAX_UNSYNCED}':
+                 lambda path: LoggedDatabase(path, max_unsynced=LOG_MAX_UNSYNCED)}
+    rows = list(generate_expenses(LOG_ROWS, seed + 6))
+    for writers in (1, SHARD_WRITERS):
+        for name, open_db in paths.items():
+            full_name = f'log/{writers}w/{name}/add_expense'
+            if not timer.wanted(full_name):
+                continue
+            samples = []
+            for _ in range(3):
+                with tempfile.TemporaryDirectory(prefix='expense-bench-log-') as directory, \
+                        ThreadPoolExecutor(max_workers=writers) as pool:
+                    db = open_db(os.path.join(directory, 'log.db'))
+
+                    def add_all(user_id):
+                        for expense in rows:
+                            db.add_expense(user_id, *expense)
+                    started = time.perf_counter()
+                    for future in [pool.submit(add_all, user_id)
+                                   for user_id in range(1, writers + 1)]:
+                        future.result()
+                    samples.append(time.perf_counter() - started)
+                    db.close()
+            timer.record(full_name, samples, rows=LOG_ROWS * writers)
+
+
+def environment():
+    """Details of the machine and versions a result was measured with"""
+    return {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'time': datetime.now().isoformat(timespec='seconds')}
+
+
+def compare(results, baseline, threshold, floor_ms=0.1):
+    """Compare medians against a baseline.
+
+    Returns (name, baseline_ms, current_ms) for every benchmark more than
+    threshold (0.25 is 25%) slower than its baseline; differences below
+    floor_ms are timer noise and never count.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        was, now = before['median_ms'], result['median_ms']
+        if now > was * (1 + threshold) and now - was > floor_ms:
+            regressions.append((name, was, now))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    for name, result in results.items():
+        line = f"{name:<55} {result['median_ms']:10.3f} ms  (p95 {result['p95_ms']:.3f})"
+        if 'rows_per_second' in result:
+            line += f"  {result['rows_per_second']:,.0f} rows/s"
+        before = (baseline or {}).get(name)
+        if before:
+            line += f"  {result['median_ms'] / before['median_ms'] - 1:+.0%} vs baseline"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the expense tracker's database paths")
+    parser.add_argument('--sizes', default='1k,10k,100k',
+                        help="comma-separated ledger sizes, e.g. 1k,100k,10M (default: 1k,10k,100k)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20, help="runs per benchmark (default: 20)")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'expense-bench'),
+                        help="where generated ledgers are kept between runs")
+    parser.add_argument('--only', help="run only benchmarks whose name contains this text")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="slowdown of a median that counts as a regression (default: 0.25)")
+    parser.add_argument('--shards',
+                        help="comma-separated shard counts to measure write throughput on, e.g. 1,2,4")
+    parser.add_argument('--log', action='store_true',
+                        help="compare add_expense throughput with and without the append log")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    os.makedirs(args.data_dir, exist_ok=True)
+    timer = Timer(repeat=args.repeat, only=args.only)
+    for size in sizes:
+        path = os.path.join(args.data_dir, f'ledger-{args.seed}-{size}.db')
+        if not os.path.exists(path):
+            print(f"Generating {size:,} expenses in {path}", file=sys.stderr)
+            build_database(path, size, args.seed,
+                           on_progress=lambda done, total: print(f"\r{done:,}/{total:,}", end='',
+                                                                 file=sys.stderr, flush=True))
+            print(file=sys.stderr)
+        run_size(timer, path, size, args.seed)
+    for shards in args.shards.split(',') if args.shards else []:
+        run_shards(timer, int(shards), args.seed)
+    if args.log:
+        run_log(timer, args.seed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(timer.results, baseline)
+
+    if args.output:
+        document = {'environment': environment(), 'seed': args.seed, 'sizes': sizes,
+                    'results': timer.results}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(timer.results, baseline, args.threshold)
+        for name, was, now in regressions:
+            print(f"REGRESSION {name}: {was:.3f} ms -> {now:.3f} ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,665 @@
+"""In-memory caches in front of Database.
+
+ExpenseCache keeps whole user ledgers in memory as columns; QueryCache
+memoizes individual filter results on top of either.
+
+Each ExpenseCache ledger is held as parallel arrays sorted by (day, id):
+dates as day ordinals, amounts as integer cents, categories as small-int
+codes and descriptions as codes into a per-user vocabulary, plus a running
+prefix sum of the cents. A date range is two binary searches and its total
+is one subtraction, so filtering, paging and summaries never touch storage
+once a user is loaded. A write cuts the prefix sums off at the row it
+touched and the next read re-extends them as far as it needs.
+
+Writes made through either cache are applied to storage first and then to
+the cached data. Writes made by anything else (another process, the CLI)
+are not seen until the data is evicted or invalidate() is called.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import accumulate
+
+from analytics import ExpenseColumns
+from database import DEFAULT_SORT
+from dates import format_day, parse_day
+from search import matches
+from money import divide
+from validation import CATEGORIES
+
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)}
+
+# Batches larger than this are dropped from a cache and re-read on demand
+# rather than applied row by row; each row costs a shift of the columns
+MAX_BATCH_UPDATE = 32
+
+
+class _Vocabulary:
+    """Dictionary encoding of description strings"""
+
+    def __init__(self):
+        self.codes = {}
+        self.words = []
+
+    def encode(self, word):
+        code = self.codes.get(word)
+        if code is None:
+            code = self.codes[word] = len(self.words)
+            self.words.append(word)
+        return code
+
+
+class _Columns:
+    """Parallel arrays of expenses sorted ascending by (day, id)"""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self.days = array('l')
+        self.ids = array('q')
+        self.cents = array('q')
+        self.codes = array('B')
+        self.descriptions = array('l')
+        # prefix[i] is the sum of cents[:i], for the rows up to the first one
+        # changed since it was last extended (see _extend_prefix)
+        self.prefix = array('q', [0])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, day, expense_id, cents, code, description):
+        """Add a row known to sort after every existing row"""
+        self.days.append(day)
+        self.ids.append(expense_id)
+        self.cents.append(cents)
+        self.codes.append(code)
+        self.descriptions.append(description)
+        if len(self.prefix) == len(self.cents):
+            self.prefix.append(self.prefix[-1] + cents)
+
+    def position(self, day, expense_id):
+        """Index at which (day, expense_id) is or would be stored"""
+        lo = bisect_left(self.days, day)
+        hi = bisect_right(self.days, day, lo)
+        return bisect_left(self.ids, expense_id, lo, hi)
+
+    def find(self, day, expense_id):
+        """Index of the row (day, expense_id), or None if there is none"""
+        pos = self.position(day, expense_id)
+        if pos < len(self.ids) and self.ids[pos] == expense_id and self.days[pos] == day:
+            return pos
+        return None
+
+    def insert(self, day, expense_id, cents, code, description):
+        pos = self.position(day, expense_id)
+        self.days.insert(pos, day)
+        self.ids.insert(pos, expense_id)
+        self.cents.insert(pos, cents)
+        self.codes.insert(pos, code)
+        self.descriptions.insert(pos, description)
+        # New expenses are usually recent, so the sums to redo are few
+        del self.prefix[pos + 1:]
+
+    def remove_at(self, pos):
+        del self.days[pos], self.ids[pos], self.cents[pos], self.codes[pos], self.descriptions[pos]
+        del self.prefix[pos + 1:]
+
+    def _extend_prefix(self, hi):
+        """Make prefix cover rows[:hi] again after writes cut it short"""
+        done = len(self.prefix) - 1
+        if hi > done:
+            sums = accumulate(self.cents[done:hi], initial=self.prefix[-1])
+            next(sums)
+            self.prefix.extend(sums)
+
+    def range(self, start_day, end_day):
+        """Half-open index range of rows with start_day <= day <= end_day"""
+        lo = 0 if start_day is None else bisect_left(self.days, start_day)
+        hi = len(self.days) if end_day is None else bisect_right(self.days, end_day)
+        return lo, max(lo, hi)
+
+    def total(self, lo, hi):
+        self._extend_prefix(hi)
+        return self.prefix[hi] - self.prefix[lo]
+
+    def row(self, pos):
+        return {'id': self.ids[pos],
+                'amount': self.cents[pos],
+                'category': CATEGORIES[self.codes[pos]],
+                'description': self.vocabulary.words[self.descriptions[pos]],
+                'date': format_day(self.days[pos])}
+
+
+class UserLedger:
+    """One user's expenses: all rows, plus one column set per category"""
+
+    def __init__(self):
+        self.vocabulary = _Vocabulary()
+        self.all = _Columns(self.vocabulary)
+        self.by_category = {}
+
+    def __len__(self):
+        return len(self.all)
+
+    def _category(self, code):
+        columns = self.by_category.get(code)
+        if columns is None:
+            columns = self.by_category[code] = _Columns(self.vocabulary)
+        return columns
+
+    def load(self, expenses):
+        """Fill the ledger from rows sorted newest first"""
+        encode = self.vocabulary.encode
+        rows = []
+        for expense in expenses:
+            rows.append((parse_day(expense['date']), expense['id'],
+                         expense['amount'], CATEGORY_CODES[expense['category']],
+                         encode(expense['description'])))
+        rows.reverse()
+        for row in rows:
+            self.all.append(*row)
+            self._category(row[3]).append(*row)
+
+    def add(self, expense):
+        row = (parse_day(expense['date']), expense['id'],
+               expense['amount'], CATEGORY_CODES[expense['category']],
+               self.vocabulary.encode(expense['description']))
+        self.all.insert(*row)
+        self._category(row[3]).insert(*row)
+
+    def remove(self, expense):
+        """Drop an expense, found by its date and id. Returns False if it isn't in the ledger"""
+        day = parse_day(expense['date'])
+        pos = self.all.find(day, expense['id'])
+        if pos is None:
+            return False
+        columns = self.by_category[self.all.codes[pos]]
+        self.all.remove_at(pos)
+        columns.remove_at(columns.find(day, expense['id']))
+        return True
+
+    def _view(self, category):
+        if category:
+            return self.by_category.get(CATEGORY_CODES[category], _Columns(self.vocabulary))
+        return self.all
+
+    def snapshot(self, start_day, end_day, category):
+        """Copy the columns of the rows matching a filter, for analytics"""
+        columns = self._view(category)
+        lo, hi = columns.range(start_day, end_day)
+        return ExpenseColumns(columns.days[lo:hi], columns.cents[lo:hi], columns.codes[lo:hi],
+                              columns.descriptions[lo:hi], list(self.vocabulary.words))
+
+    def query(self, start_day, end_day, category, limit=None, offset=0, descending=True,
+              after=None, before=None):
+        """Page of rows by date plus the aggregates of every match.
+
+        after and before are (day, id) keys as in Database.get_expenses.
+        """
+        by_category = {}
+        for code, columns in self.by_category.items():
+            name = CATEGORIES[code]
+            if category and name != category:
+                continue
+            lo, hi = columns.range(start_day, end_day)
+            if hi > lo:
+                by_category[name] = {'total': columns.total(lo, hi), 'count': hi - lo}
+
+        columns = self._view(category)
+        lo, hi = columns.range(start_day, end_day)
+        backwards = before is not None
+        # Read from the top of the ascending columns down, or from the bottom up
+        downwards = descending != backwards
+        key = before if backwards else after
+        if key is not None:
+            day, expense_id = key
+            if downwards:
+                hi = max(lo, min(hi, columns.position(day, expense_id)))
+            else:
+                lo = min(hi, max(lo, columns.position(day, expense_id + 1)))
+        if downwards:
+            positions = range(hi - 1 - offset, lo - 1, -1)
+        else:
+            positions = range(lo + offset, hi)
+        if limit is not None:
+            positions = positions[:limit]
+        expenses = [columns.row(pos) for pos in positions]
+        if backwards:
+            expenses.reverse()
+
+        total = sum(group['total'] for group in by_category.values())
+        count = sum(group['count'] for group in by_category.values())
+        return {'expenses': expenses, 'total': total, 'count': count,
+                'average': divide(total, count), 'by_category': by_category}
+
+
+class ExpenseCache:
+    """Read-through, write-through cache of whole user ledgers in front of a Database.
+
+    Supports the Database methods the app uses and forwards everything else.
+    At most max_users ledgers are kept, evicting the least recently used;
+    users with more than max_rows expenses are never cached. Ledgers are
+    loaded outside the cache-wide lock, one load per user at a time.
+    """
+
+    def __init__(self, db, max_users=8, max_rows=2000000):
+        self.db = db
+        self.max_users = max_users
+        self.max_rows = max_rows
+        self._ledgers = OrderedDict()
+        self._lock = threading.RLock()
+        # Per-user locks held while a ledger loads, so one miss loads it for all
+        self._loading = {}
+        # Writes in flight and writes done per user (the epoch on a full
+        # invalidation), so a load that overlapped a write is not kept
+        self._writers = {}
+        self._generations = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def _cached(self, user_id):
+        """The user's ledger if it is cached, counting the hit. Call with _lock held"""
+        ledger = self._ledgers.get(user_id)
+        if ledger is not None:
+            self._ledgers.move_to_end(user_id)
+            self.hits += 1
+        return ledger
+
+    def _load(self, user_id):
+        """A user's ledger read from the database, or None if it can't be cached"""
+        if self.db.count_expenses(user_id) > self.max_rows:
+            return None
+        ledger = UserLedger()
+        try:
+            ledger.load(self.db.iter_expenses(user_id, batch_size=10000))
+        except (KeyError, ValueError):
+            # Rows with a category or date the cache can't encode
+            return None
+        return ledger
+
+    def _ledger(self, user_id):
+        """Cached ledger for a user, loading it on a miss; None if it can't be cached.
+
+        The database is read without holding _lock, so reads of other users
+        and writes go on meanwhile. Concurrent misses for one user wait on
+        its loading lock and then share the loaded ledger. A load that
+        overlapped a write for the user may have missed that write or would
+        apply it twice, so it is dropped and the caller reads the database.
+        """
+        with self._lock:
+            ledger = self._cached(user_id)
+            if ledger is not None:
+                return ledger
+            loading = self._loading.setdefault(user_id, threading.Lock())
+        with loading:
+            with self._lock:
+                ledger = self._cached(user_id)
+                if ledger is not None:
+                    return ledger
+                self.misses += 1
+                generation = (self._epoch, self._generations.get(user_id, 0))
+            ledger = self._load(user_id)
+            with self._lock:
+                if self._loading.get(user_id) is loading:
+                    del self._loading[user_id]
+                if (ledger is None or self._writers.get(user_id)
+                        or (self._epoch, self._generations.get(user_id, 0)) != generation):
+                    return None
+                self._ledgers[user_id] = ledger
+                while len(self._ledgers) > self.max_users:
+                    self._ledgers.popitem(last=False)
+                    self.evictions += 1
+                return ledger
+
+    @contextmanager
+    def _writing(self, user_id):
+        """Mark a write for a user as in flight, for _ledger to detect overlapping loads"""
+        with self._lock:
+            self._writers[user_id] = self._writers.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                writers = self._writers.pop(user_id) - 1
+                if writers:
+                    self._writers[user_id] = writers
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def _bounds(self, start_date, end_date, category):
+        """Day ordinals for the filter, or None if the cache can't answer it"""
+        if category and category not in CATEGORY_CODES:
+            return None
+        try:
+            return (parse_day(start_date) if start_date else None,
+                    parse_day(end_date) if end_date else None)
+        except ValueError:
+            return None
+
+    def get_expenses_with_summary(self, user_id, start_date=None, end_date=None, category=None,
+                                  limit=None, offset=0, search=None, sort=DEFAULT_SORT,
+                                  after=None, before=None):
+        # Searches go to the database's full-text index, and orders other than
+        # by date to its sort indexes
+        bounds = None
+        if not search and sort[0] == 'date':
+            bounds = self._bounds(start_date, end_date, category)
+        if bounds is not None:
+            ledger = self._ledger(user_id)
+            with self._lock:
+                # Unless a write dropped it since
+                if ledger is not None and self._ledgers.get(user_id) is ledger:
+                    return ledger.query(bounds[0], bounds[1], category, limit, offset, sort[1],
+                                        after, before)
+        return self.db.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                                 limit, offset, search, sort, after, before)
+
+    def get_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                     limit=None, offset=0, search=None, sort=DEFAULT_SORT, after=None,
+                     before=None):
+        return self.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                              limit, offset, search, sort, after,
+                                              before)['expenses']
+
+    def get_expense_summary(self, user_id, start_date=None, end_date=None, category=None,
+                            search=None):
+        result = self.get_expenses_with_summary(user_id, start_date, end_date, category, limit=0,
+                                                search=search)
+        return {'total': result['total'], 'count': result['count']}
+
+    def count_expenses(self, user_id, start_date=None, end_date=None, category=None, search=None):
+        return self.get_expense_summary(user_id, start_date, end_date, category, search)['count']
+
+    def add_expense(self, user_id, amount, category, description, date):
+        with self._writing(user_id):
+            expense_id = self.db.add_expense(user_id, amount, category, description, date)
+            if expense_id:
+                with self._lock:
+                    ledger = self._ledgers.get(user_id)
+                    if ledger is not None:
+                        try:
+                            ledger.add({'id': expense_id, 'amount': amount,
+                                        'category': category, 'description': description,
+                                        'date': date})
+                        except (KeyError, ValueError):
+                            self._ledgers.pop(user_id, None)
+        return expense_id
+
+    def add_expenses(self, user_id, expenses):
+        # A bulk load is cheaper to re-read on demand than to merge row by row
+        with self._writing(user_id):
+            try:
+                return self.db.add_expenses(user_id, expenses)
+            finally:
+                self.invalidate(user_id)
+
+    def delete_expense(self, expense_id, user_id):
+        with self._writing(user_id):
+            with self._lock:
+                cached = user_id in self._ledgers
+            # The ledger finds rows by (date, id), so read the date while it exists
+            expense = self.db.get_expense(expense_id, user_id) if cached else None
+            deleted = self.db.delete_expense(expense_id, user_id)
+            if deleted:
+                with self._lock:
+                    ledger = self._ledgers.get(user_id)
+                    if ledger is not None and (expense is None or not ledger.remove(expense)):
+                        self._ledgers.pop(user_id, None)
+        return deleted
+
+    def delete_expenses(self, expense_ids, user_id):
+        with self._writing(user_id):
+            result = self.db.delete_expenses(expense_ids, user_id)
+            with self._lock:
+                ledger = self._ledgers.get(user_id)
+                if ledger is not None:
+                    if len(result['expenses']) > MAX_BATCH_UPDATE:
+                        self._ledgers.pop(user_id, None)
+                    else:
+                        for expense in result['expenses']:
+                            ledger.remove(expense)
+        return result
+
+    def restore_expenses(self, batch_id, user_id):
+        with self._writing(user_id):
+            restored = self.db.restore_expenses(batch_id, user_id)
+            with self._lock:
+                ledger = self._ledgers.get(user_id)
+                if ledger is not None:
+                    if len(restored) > MAX_BATCH_UPDATE:
+                        self._ledgers.pop(user_id, None)
+                    else:
+                        try:
+                            for expense in restored:
+                                ledger.add(expense)
+                        except (KeyError, ValueError):
+                            self._ledgers.pop(user_id, None)
+        return restored
+
+    def snapshot_columns(self, user_id, start_date=None, end_date=None, category=None,
+                         search=None):
+        """Columns of a user's expenses matching a filter, or None if not cacheable"""
+        bounds = None if search else self._bounds(start_date, end_date, category)
+        if bounds is None:
+            return None
+        ledger = self._ledger(user_id)
+        with self._lock:
+            if ledger is None or self._ledgers.get(user_id) is not ledger:
+                return None
+            return ledger.snapshot(bounds[0], bounds[1], category)
+
+    def invalidate(self, user_id=None):
+        """Drop one user's ledger, or all of them"""
+        with self._lock:
+            if user_id is None:
+                self._epoch += 1
+                self._ledgers.clear()
+            else:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+                self._ledgers.pop(user_id, None)
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'users': len(self._ledgers),
+                    'rows': sum(len(ledger) for ledger in self._ledgers.values())}
+
+
+def _matches(expense, start_day, end_day, category, search):
+    """Whether an expense falls inside a cached filter"""
+    if category and expense['category'] != category:
+        return False
+    day = parse_day(expense['date'])
+    if start_day is not None and day < start_day:
+        return False
+    if end_day is not None and day > end_day:
+        return False
+    return not search or matches(expense['description'], search)
+
+
+class QueryCache:
+    """Bounded memo of get_expenses_with_summary and analytics results in front of a Database.
+
+    Entries are keyed by user and normalized filter (plus the order and page asked for)
+    and evicted least recently used beyond max_entries. Writes made through
+    the cache invalidate only the entries of that user whose filter the
+    written expense falls inside; other users and other filters stay cached.
+    Results are shared between callers and must be treated as read-only.
+    Everything else is forwarded to the wrapped db, which may itself be an
+    ExpenseCache.
+    """
+
+    def __init__(self, db, max_entries=256):
+        self.db = db
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        # Bumped on every write for a user (the epoch on a full invalidation),
+        # so a read that raced with a write can tell its result may be stale
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def _store(self, key, result, generation):
+        user_id = key[0]
+        with self._lock:
+            if (self._epoch, self._generations.get(user_id, 0)) != generation:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._keys_by_user[old_key[0]].discard(old_key)
+
+    def _invalidate_where(self, user_id, predicate):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in [key for key in self._keys_by_user.get(user_id, ()) if predicate(key)]:
+                del self._entries[key]
+                self._keys_by_user[user_id].discard(key)
+                self.invalidations += 1
+
+    def get_expenses_with_summary(self, user_id, start_date=None, end_date=None, category=None,
+                                  limit=None, offset=0, search=None, sort=DEFAULT_SORT,
+                                  after=None, before=None):
+        try:
+            key = (user_id, parse_day(start_date) if start_date else None,
+                   parse_day(end_date) if end_date else None, category or None, search or None,
+                   limit, offset, tuple(sort), after, before)
+        except ValueError:
+            # Let the database report the malformed filter
+            return self.db.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                                     limit, offset, search, sort, after, before)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(user_id, 0))
+        result = self.db.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                                   limit, offset, search, sort, after, before)
+        self._store(key, result, generation)
+        return result
+
+    def get_analytics(self, user_id, filters, params, compute):
+        """Memoized compute() result for an analytics breakdown of a filter.
+
+        filters is (start_date, end_date, category, search) and params the
+        breakdown's own arguments. The entry is dropped by the same writes
+        that drop a page of that filter.
+        """
+        start_date, end_date, category, search = filters
+        try:
+            key = (user_id, parse_day(start_date) if start_date else None,
+                   parse_day(end_date) if end_date else None, category or None, search or None,
+                   'analytics') + tuple(params)
+        except ValueError:
+            return compute()
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(user_id, 0))
+        result = compute()
+        self._store(key, result, generation)
+        return result
+
+    def get_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                     limit=None, offset=0, search=None, sort=DEFAULT_SORT, after=None,
+                     before=None):
+        return self.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                              limit, offset, search, sort, after,
+                                              before)['expenses']
+
+    def get_expense_summary(self, user_id, start_date=None, end_date=None, category=None,
+                            search=None):
+        result = self.get_expenses_with_summary(user_id, start_date, end_date, category, limit=0,
+                                                search=search)
+        return {'total': result['total'], 'count': result['count']}
+
+    def count_expenses(self, user_id, start_date=None, end_date=None, category=None, search=None):
+        return self.get_expense_summary(user_id, start_date, end_date, category, search)['count']
+
+    def add_expense(self, user_id, amount, category, description, date):
+        expense = {'amount': amount, 'category': category, 'description': description,
+                   'date': date}
+        try:
+            return self.db.add_expense(user_id, amount, category, description, date)
+        finally:
+            self._invalidate_where(user_id, lambda key: _matches(expense, *key[1:5]))
+
+    def add_expenses(self, user_id, expenses):
+        try:
+            return self.db.add_expenses(user_id, expenses)
+        finally:
+            self.invalidate(user_id)
+
+    def delete_expense(self, expense_id, user_id):
+        expense = self.db.get_expense(expense_id, user_id)
+        try:
+            return self.db.delete_expense(expense_id, user_id)
+        finally:
+            if expense is not None:
+                self._invalidate_where(user_id, lambda key: _matches(expense, *key[1:5]))
+
+    def _invalidate_expenses(self, user_id, expenses):
+        """Drop the entries a batch of written expenses falls inside"""
+        if len(expenses) > MAX_BATCH_UPDATE:
+            self._invalidate_where(user_id, lambda key: True)
+        elif expenses:
+            self._invalidate_where(user_id, lambda key: any(_matches(expense, *key[1:5])
+                                                            for expense in expenses))
+
+    def delete_expenses(self, expense_ids, user_id):
+        # Both batch writes are single transactions: on error nothing changed
+        result = self.db.delete_expenses(expense_ids, user_id)
+        self._invalidate_expenses(user_id, result['expenses'])
+        return result
+
+    def restore_expenses(self, batch_id, user_id):
+        restored = self.db.restore_expenses(batch_id, user_id)
+        self._invalidate_expenses(user_id, restored)
+        return restored
+
+    def invalidate(self, user_id=None):
+        """Drop one user's entries, or all of them, here and in a wrapped cache"""
+        if user_id is None:
+            with self._lock:
+                self._epoch += 1
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._keys_by_user.clear()
+        else:
+            self._invalidate_where(user_id, lambda key: True)
+        invalidate = getattr(self.db, 'invalidate', None)
+        if invalidate is not None:
+            invalidate(user_id)
+
+    def stats(self):
+        """Hit/miss counters and current size, for sizing max_entries"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'entries': len(self._entries)}
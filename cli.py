@@ -0,0 +1,183 @@
+"""Headless command-line entry point for the expense tracker.
+
+Usage: python cli.py [--db FILE] COMMAND --user NAME ...
+
+This module must stay importable without tkinter, and it loads as little as
+possible up front: the importer and exporter are imported only by the
+commands that need them. Check with `python -X importtime cli.py list ...`.
+"""
+import argparse
+import os
+import sys
+
+from database import Database
+from money import format_cents
+from service import ExpenseService, make_expense, normalize_filters, parse_sort, PAGE_SIZE
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--start', help="first date to include (YYYY-MM-DD)")
+    parser.add_argument('--end', help="last date to include (YYYY-MM-DD)")
+    parser.add_argument('--category', help="only include this category")
+    parser.add_argument('--search', help="only include descriptions with words starting with these")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="Expense tracker command line")
+    parser.add_argument('--db', default=os.environ.get('EXPENSES_DB', 'expenses.db'),
+                        help="database file (default: $EXPENSES_DB or expenses.db)")
+    parser.add_argument('--metrics', action='store_true',
+                        help="time every database call and print the timings to stderr")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="add an expense")
+    add.add_argument('--user', required=True)
+    add.add_argument('amount')
+    add.add_argument('category')
+    add.add_argument('description', nargs='?', default='')
+    add.add_argument('--date', help="expense date (default: today)")
+
+    listing = commands.add_parser('list', help="list expenses, newest first by default")
+    listing.add_argument('--user', required=True)
+    add_filter_arguments(listing)
+    listing.add_argument('--limit', type=int, default=PAGE_SIZE)
+    listing.add_argument('--offset', type=int, default=0)
+    listing.add_argument('--sort', default='-date',
+                         help="date, category, description or amount, with a leading - for "
+                              "descending, e.g. --sort=-amount (default: -date)")
+
+    summary = commands.add_parser('summary', help="totals for a filter")
+    summary.add_argument('--user', required=True)
+    add_filter_arguments(summary)
+
+    delete = commands.add_parser('delete', help="delete expenses by id")
+    delete.add_argument('--user', required=True)
+    delete.add_argument('expense_ids', type=int, nargs='+', metavar='expense_id')
+
+    undo = commands.add_parser('undo', help="restore the most recently deleted expenses")
+    undo.add_argument('--user', required=True)
+
+    import_cmd = commands.add_parser('import', help="bulk import a CSV or JSON file")
+    import_cmd.add_argument('--user', required=True)
+    import_cmd.add_argument('file')
+
+    export = commands.add_parser('export', help="export expenses to CSV, JSON Lines or Parquet")
+    export.add_argument('--user', required=True)
+    export.add_argument('file')
+    add_filter_arguments(export)
+    export.add_argument('--format', choices=['csv', 'jsonl', 'parquet'])
+
+    calibrate = commands.add_parser('calibrate-kdf',
+                                    help="pick password hash parameters for this host")
+    calibrate.add_argument('--target-ms', type=float, default=100,
+                           help="slowest acceptable hash time (default: 100)")
+    calibrate.add_argument('--algorithm', choices=['scrypt', 'pbkdf2_sha256'])
+    calibrate.add_argument('--dry-run', action='store_true',
+                           help="only print the parameters instead of saving them in --db")
+
+    register = commands.add_parser('register', help="create a user account")
+    register.add_argument('username')
+    register.add_argument('--password', help="password (prompted for if omitted)")
+    return parser
+
+
+def run(args, metrics=None):
+    if args.command == 'calibrate-kdf':
+        import passwords
+        hasher, elapsed_ms = passwords.calibrate(args.target_ms, args.algorithm)
+        print(f"{hasher!r}: {elapsed_ms:.1f} ms per hash")
+        if not args.dry_run:
+            db = Database(args.db)
+            db.save_hasher(hasher)
+            db.close()
+            print(f"Saved in {args.db}; new passwords and upgraded logins use these parameters")
+        return 0
+
+    db = Database(args.db)
+    if metrics is not None:
+        metrics.instrument(db, 'db.')
+    service = ExpenseService(db)
+
+    if args.command == 'register':
+        password = args.password
+        if password is None:
+            import getpass
+            password = getpass.getpass()
+        if not service.register(args.username, password):
+            raise ValueError("Username already exists")
+        print(f"Created user {args.username}")
+        return 0
+
+    user_id = service.user_id(args.user)
+
+    if args.command == 'add':
+        from datetime import date
+        expense = make_expense(args.amount, args.category, args.description,
+                               args.date or date.today().strftime('%Y-%m-%d'))
+        stored = service.add_expense(user_id, expense)
+        if stored is None:
+            raise ValueError("Failed to add expense")
+        print(f"Added expense {stored['id']}")
+    elif args.command == 'list':
+        filters = normalize_filters(args.category, args.start, args.end, args.search)
+        page = service.load_page(user_id, filters, args.offset, args.limit, parse_sort(args.sort))
+        for expense in page['expenses']:
+            print(f"{expense['id']:>8}  {expense['date']}  {expense['category']:<13}  "
+                  f"{format_cents(expense['amount']):>12}  {expense['description']}")
+        shown = len(page['expenses'])
+        if shown:
+            print(f"-- {page['offset'] + 1:,}-{page['offset'] + shown:,} of {page['total_rows']:,}")
+        else:
+            print(f"-- 0 of {page['total_rows']:,}")
+    elif args.command == 'summary':
+        summary = service.summary(user_id, normalize_filters(args.category, args.start, args.end, args.search))
+        print(f"Total:   {format_cents(summary['total'], '$')}")
+        print(f"Count:   {summary['count']}")
+        print(f"Average: {format_cents(summary['average'], '$')}")
+        for category, group in sorted(summary['by_category'].items()):
+            print(f"  {category:<13} {format_cents(group['total'], '$'):>13}  ({group['count']})")
+    elif args.command == 'delete':
+        deleted = service.delete_expenses(user_id, args.expense_ids)['expenses']
+        missing = set(args.expense_ids) - {expense['id'] for expense in deleted}
+        if missing:
+            print(f"No expense {', '.join(map(str, sorted(missing)))} for user {args.user}",
+                  file=sys.stderr)
+        if not deleted:
+            return 1
+        print(f"Deleted {len(deleted):,} expenses (restore them with 'undo')")
+    elif args.command == 'undo':
+        restored = service.undo_delete(user_id)
+        if not restored:
+            raise ValueError("Nothing to undo")
+        print(f"Restored {len(restored):,} expenses")
+    elif args.command == 'import':
+        report = service.import_file(user_id, args.file,
+                                     on_progress=lambda r: print(f"\r{r}", end='', flush=True))
+        print()
+        for row_number, message in report.errors:
+            print(f"Row {row_number}: {message}")
+        return 0 if report.imported or not report.rejected else 1
+    elif args.command == 'export':
+        filters = normalize_filters(args.category, args.start, args.end, args.search)
+        print(service.export_file(user_id, args.file, filters, args.format))
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics = None
+    if args.metrics:
+        from metrics import MetricsRegistry
+        metrics = MetricsRegistry(enabled=True)
+    try:
+        return run(args, metrics)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if metrics is not None:
+            print(metrics.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1654 @@
+import heapq
+import logging
+import sqlite3
+import string
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from appendlog import AppendLog, DEFAULT_COMMIT_INTERVAL, DEFAULT_COMMIT_RECORDS
+from dates import format_day, month_of, month_start, month_sql, parse_day
+from money import divide
+from passwords import PasswordHasher
+from search import FTS_TOKENIZER, match_expression, matches
+
+log = logging.getLogger(__name__)
+
+
+def _add_filter_indexes(conn):
+    """Composite indexes for the per-user date range and category filters"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_expenses_user_date '
+                 'ON expenses (user_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_expenses_user_category_date '
+                 'ON expenses (user_id, category, date)')
+    conn.execute('ANALYZE')
+
+
+def _add_rollup_tables(conn):
+    """Per-user daily and monthly totals by category, kept up to date on write.
+
+    The tables are filled by _rebuild_rollups in the last migration that
+    reshapes the expenses table (_store_dates_as_days).
+    """
+    _create_rollup_tables(conn)
+
+
+def _create_rollup_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_daily_rollup (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, category)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_monthly_rollup (
+            user_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, month, category)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _rebuild_rollups(conn, user_id=None):
+    """Recompute the rollup tables from the raw expenses"""
+    where = 'WHERE user_id = ?' if user_id is not None else ''
+    params = (user_id,) if user_id is not None else ()
+    conn.execute(f'DELETE FROM expense_daily_rollup {where}', params)
+    conn.execute(f'DELETE FROM expense_monthly_rollup {where}', params)
+    conn.execute(f'''
+        INSERT INTO expense_daily_rollup (user_id, day, category, total, count)
+        SELECT user_id, day, category, SUM(amount), COUNT(*) FROM expenses {where}
+        GROUP BY user_id, day, category
+    ''', params)
+    # Roll the daily rows up rather than the expenses: far fewer month lookups
+    conn.execute(f'''
+        INSERT INTO expense_monthly_rollup (user_id, month, category, total, count)
+        SELECT user_id, {month_sql('day')}, category, SUM(total), SUM(count)
+        FROM expense_daily_rollup {where}
+        GROUP BY 1, 2, 3
+    ''', params)
+
+
+def _apply_rollup_delta(conn, user_id, day, category, amount, count):
+    """Add amount/count to the rollup rows an expense on this day belongs to"""
+    for table, key_column, key in [('expense_daily_rollup', 'day', day),
+                                   ('expense_monthly_rollup', 'month', month_of(day))]:
+        conn.execute(f'''
+            INSERT INTO {table} (user_id, {key_column}, category, total, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, {key_column}, category)
+            DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+        ''', (user_id, key, category, amount, count))
+        if count < 0:
+            conn.execute(f'DELETE FROM {table} WHERE user_id = ? AND {key_column} = ? '
+                         f'AND category = ? AND count <= 0', (user_id, key, category))
+
+
+def _filter_days(start_date, end_date):
+    """Day ordinals for the YYYY-MM-DD filter bounds, None where unbounded.
+
+    Raises ValueError for a malformed bound, before any query runs.
+    """
+    return (parse_day(start_date) if start_date else None,
+            parse_day(end_date) if end_date else None)
+
+
+def _rollup_segments(start_day, end_day):
+    """Split a day range into the rollup rows that cover it.
+
+    Whole calendar months inside the range are read from the monthly rollup and
+    the partial months at either edge from the daily rollup. Returns a list of
+    (table, conditions) pairs where conditions are (sql, value) tuples.
+    """
+    first_month = last_month = None
+    if start_day is not None:
+        first_month = month_of(start_day)
+        if month_start(first_month) != start_day:
+            first_month += 1
+    if end_day is not None:
+        last_month = month_of(end_day)
+        if month_start(last_month + 1) - 1 != end_day:
+            last_month -= 1
+
+    if first_month is not None and last_month is not None and first_month > last_month:
+        conditions = [('day >= ?', start_day), ('day <= ?', end_day)]
+        return [('expense_daily_rollup', conditions)]
+
+    conditions = []
+    if first_month is not None:
+        conditions.append(('month >= ?', first_month))
+    if last_month is not None:
+        conditions.append(('month <= ?', last_month))
+    segments = [('expense_monthly_rollup', conditions)]
+    if start_day is not None and start_day != month_start(first_month):
+        segments.append(('expense_daily_rollup', [('day >= ?', start_day),
+                                                  ('day < ?', month_start(first_month))]))
+    if end_day is not None:
+        after_last = month_start(last_month + 1)
+        if after_last <= end_day:
+            segments.append(('expense_daily_rollup', [('day >= ?', after_last),
+                                                      ('day <= ?', end_day)]))
+    return segments
+
+
+def _rollup_by_category(conn, user_id, start_day=None, end_day=None, category=None):
+    """Read per-category totals for a day range from the rollup tables"""
+    parts = []
+    params = []
+    for table, conditions in _rollup_segments(start_day, end_day):
+        clauses = ['user_id = ?']
+        params.append(user_id)
+        if category:
+            clauses.append('category = ?')
+            params.append(category)
+        for clause, value in conditions:
+            clauses.append(clause)
+            params.append(value)
+        parts.append(f'SELECT category, total, count FROM {table} WHERE {" AND ".join(clauses)}')
+    query = f'''
+        SELECT category, SUM(total), SUM(count) FROM ({' UNION ALL '.join(parts)})
+        GROUP BY category
+    '''
+    return {row[0]: {'total': row[1], 'count': row[2]} for row in conn.execute(query, params)}
+
+
+# Orderings of expense listings: the columns each sorts by, before id as the
+# final tie-breaker. Every one is an index prefix after user_id (or user_id
+# and category), so a page in any order is an index range read.
+SORT_COLUMNS = {
+    'date': ('day',),
+    'category': ('category', 'day'),
+    'description': ('description COLLATE NOCASE',),
+    'amount': ('amount',),
+}
+
+# (column, descending) of the default listing order, newest first
+DEFAULT_SORT = ('date', True)
+
+# SQLite's NOCASE collation folds ASCII letters only
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def sort_key(expense, column):
+    """Keyset key of an expense for a sort column: its values of the columns
+    the database sorts by (see SORT_COLUMNS), then its id.
+
+    Keys compare in Python exactly as the rows compare in SQL, so they can
+    place a new row in a page as well as be passed as after/before.
+    """
+    if column == 'date':
+        values = (parse_day(expense['date']),)
+    elif column == 'category':
+        values = (expense['category'], parse_day(expense['date']))
+    elif column == 'description':
+        values = (expense['description'].translate(_NOCASE),)
+    elif column == 'amount':
+        values = (expense['amount'],)
+    else:
+        raise ValueError(f"Unknown sort column: {column}")
+    return values + (expense['id'],)
+
+
+def _order_clause(sort, after=None, before=None):
+    """ORDER BY terms and keyset condition for a sort order.
+
+    after and before are sort keys (the sort columns' values followed by the
+    id, see sort_key) of the row just before or just after the
+    wanted page. A page before a key is read in reverse, so the caller must
+    reverse the rows it gets. Returns (order_by, condition, params) with
+    condition None when there is no key.
+    """
+    column, descending = sort
+    if column not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {column}")
+    columns = SORT_COLUMNS[column] + ('id',)
+    backwards = before is not None
+    downwards = descending != backwards
+    direction = ' DESC' if downwards else ''
+    order_by = ', '.join(name + direction for name in columns)
+    key = before if backwards else after
+    if key is None:
+        return order_by, None, []
+    condition = (f"({', '.join(columns)}) {'<' if downwards else '>'} "
+                 f"({', '.join('?' * len(columns))})")
+    return order_by, condition, list(key)
+
+
+# Columns selected for expense rows, in the order _expense() expects
+EXPENSE_COLUMNS = 'id, amount, category, description, day'
+
+
+def _expense(row):
+    """API dict for an expenses row: dates go back to YYYY-MM-DD text"""
+    return {'id': row[0], 'amount': row[1], 'category': row[2], 'description': row[3],
+            'date': format_day(row[4])}
+
+
+def _copy_expenses_table(conn, columns, select):
+    """Replace the expenses table with one built from a SELECT over the old one.
+
+    SQLite can't change a column's type in place. columns is the column list
+    of the new table and select produces its rows. The id counter is carried
+    over so ids of deleted expenses are never reused; indexes and rollups are
+    dropped with the old tables and must be recreated by the caller.
+    """
+    conn.execute(f'''
+        CREATE TABLE expenses_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            {columns},
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute(f'INSERT INTO expenses_new {select}')
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'expenses_new'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) "
+                 "SELECT 'expenses_new', seq FROM sqlite_sequence WHERE name = 'expenses'")
+    conn.execute('DROP TABLE expenses')
+    conn.execute('ALTER TABLE expenses_new RENAME TO expenses')
+    conn.execute('DROP TABLE IF EXISTS expense_daily_rollup')
+    conn.execute('DROP TABLE IF EXISTS expense_monthly_rollup')
+
+
+def _store_amounts_as_cents(conn):
+    """Convert expenses.amount from float dollars to integer cents"""
+    _copy_expenses_table(conn, '''
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL''', '''
+        SELECT id, user_id, CAST(ROUND(amount * 100) AS INTEGER), category, description, date,
+               created_at
+        FROM expenses''')
+    _add_filter_indexes(conn)
+    _create_rollup_tables(conn)
+
+
+def _legacy_day(text):
+    """Day ordinal of a stored date for the migration below, None if it can't be read"""
+    try:
+        return parse_day(text.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+def _store_dates_as_days(conn):
+    """Replace the YYYY-MM-DD expenses.date column with an integer day ordinal.
+
+    Dates are converted with the app's own parser, which also reads the
+    unpadded 2024-1-6 form early versions accepted. Rows whose date still
+    can't be read are moved to expense_quarantine and logged rather than
+    failing the upgrade.
+    """
+    conn.create_function('legacy_day', 1, _legacy_day, deterministic=True)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_quarantine (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TEXT,
+            created_at TIMESTAMP,
+            reason TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO expense_quarantine
+            (id, user_id, amount, category, description, date, created_at, reason)
+        SELECT id, user_id, amount, category, description, date, created_at, 'unreadable date'
+        FROM expenses WHERE legacy_day(date) IS NULL
+    ''')
+    for row in conn.execute("SELECT id, user_id, date FROM expense_quarantine "
+                            "WHERE reason = 'unreadable date'"):
+        log.warning("Expense %s of user %s has an unreadable date %r; moved to "
+                    "expense_quarantine", row[0], row[1], row[2])
+    _copy_expenses_table(conn, '''
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            day INTEGER NOT NULL''', '''
+        SELECT id, user_id, amount, category, description, legacy_day(date), created_at
+        FROM expenses WHERE legacy_day(date) IS NOT NULL''')
+    conn.execute('CREATE INDEX idx_expenses_user_day ON expenses (user_id, day)')
+    conn.execute('CREATE INDEX idx_expenses_user_category_day ON expenses (user_id, category, day)')
+    _create_rollup_tables(conn)
+    _rebuild_rollups(conn)
+    conn.execute('ANALYZE')
+
+
+def _add_search_index(conn):
+    """FTS5 index of expense descriptions, kept up to date on write.
+
+    It is an external-content table over expenses (rowid = expense id), so it
+    stores only the inverted index, not a second copy of the descriptions.
+    Extra indexes of 2- and 3-character prefixes keep short search-as-you-type
+    prefixes from expanding into thousands of terms.
+    """
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE expense_search USING fts5(
+            description, content='expenses', content_rowid='id',
+            tokenize='{FTS_TOKENIZER}', prefix='2 3'
+        )
+    ''')
+    conn.execute("INSERT INTO expense_search (expense_search) VALUES ('rebuild')")
+
+
+def _add_sort_indexes(conn):
+    """Indexes serving the amount and description sort orders, with and without a category.
+
+    The date and category orders are already served by the filter indexes.
+    Descriptions sort case-insensitively. Keyset comparisons skip NULLs, so
+    the few descriptions stored as NULL by early versions become ''; the
+    search index holds no terms for either.
+    """
+    conn.execute("UPDATE expenses SET description = '' WHERE description IS NULL")
+    conn.execute('CREATE INDEX idx_expenses_user_amount ON expenses (user_id, amount)')
+    conn.execute('CREATE INDEX idx_expenses_user_category_amount '
+                 'ON expenses (user_id, category, amount)')
+    conn.execute('CREATE INDEX idx_expenses_user_description '
+                 'ON expenses (user_id, description COLLATE NOCASE)')
+    conn.execute('CREATE INDEX idx_expenses_user_category_description '
+                 'ON expenses (user_id, category, description COLLATE NOCASE)')
+    conn.execute('ANALYZE')
+
+
+def _add_undo_journal(conn):
+    """Tables keeping the rows of recent delete_expenses batches so they can be restored"""
+    conn.execute('''
+        CREATE TABLE expense_undo_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_expense_undo_batches_user ON expense_undo_batches (user_id, id)')
+    conn.execute('''
+        CREATE TABLE expense_undo_rows (
+            batch_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            day INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            PRIMARY KEY (batch_id, id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _add_settings_table(conn):
+    """Name/value settings stored with the data, such as the password hash parameters"""
+    conn.execute('''
+        CREATE TABLE settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+# Schema migrations, applied in order. The position in this list (1-based) is
+# the schema version stored in PRAGMA user_version once the step has run.
+MIGRATIONS = [
+    _add_filter_indexes,
+    _add_rollup_tables,
+    _store_amounts_as_cents,
+    _store_dates_as_days,
+    _add_search_index,
+    _add_sort_indexes,
+    _add_undo_journal,
+    _add_settings_table,
+]
+
+# Setting holding PasswordHasher.settings() of the hasher to use, written by
+# 'cli.py calibrate-kdf'
+PASSWORD_HASHER_SETTING = 'password_hasher'
+
+# Number of delete batches per user kept in the undo journal
+UNDO_BATCHES = 20
+
+# Ids bound per statement in batch operations, well under the 999 parameter
+# limit of older SQLite versions
+_ID_CHUNK = 500
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections.
+
+    Connections are opened lazily up to max_size and handed out
+    most-recently-used first. Each keeps its own cache of prepared statements
+    (sqlite3's cached_statements), so the fixed query texts built by Database
+    are parsed once per connection rather than once per call. File databases
+    are switched to WAL journaling so readers don't block on a writer.
+    """
+
+    def __init__(self, db_name, max_size=8, statement_cache_size=256, timeout=30.0):
+        self.db_name = db_name
+        # Every connection to ':memory:' is a separate database, so share one
+        self.max_size = 1 if db_name == ':memory:' else max_size
+        self.statement_cache_size = statement_cache_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._in_use = 0
+        self._stats = {'created': 0, 'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0,
+                       'peak_in_use': 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+        conn.row_factory = sqlite3.Row
+        try:
+            self._use_wal(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+
+    def _use_wal(self, conn):
+        """Switch the file to WAL mode (a no-op once it is).
+
+        This is the first statement on a new connection, and SQLite can report
+        the file busy at once, without waiting out the busy timeout, while
+        another process closes the last connection and cleans up the WAL
+        files. Processes opening the same file together retry until timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        delay = 0.001
+        while True:
+            try:
+                conn.execute('PRAGMA journal_mode = WAL')
+                return
+            except sqlite3.OperationalError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+    def acquire(self):
+        """Take a connection, opening one or waiting for one to be released"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                create = self._size < self.max_size
+                if create:
+                    self._size += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+                with self._lock:
+                    self._stats['created'] += 1
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("timed out waiting for a pooled connection") from None
+                with self._lock:
+                    self._stats['waits'] += 1
+                    self._stats['wait_seconds'] += time.perf_counter() - started
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._in_use)
+        return conn
+
+    def release(self, conn):
+        """Return a connection, rolling back anything left uncommitted"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._size -= 1
+
+    def stats(self):
+        """Pool metrics: connections created, checkouts, waits and current usage"""
+        with self._lock:
+            return dict(self._stats, size=self._size, in_use=self._in_use,
+                        idle=self._size - self._in_use)
+
+
+class Database:
+    def __init__(self, db_name="expenses.db", pool_size=8, hasher=None):
+        """Open (creating and migrating if needed) a database file.
+
+        Without a hasher, passwords are hashed with the parameters saved by
+        save_hasher(), or the defaults if none were saved.
+        """
+        self.db_name = db_name
+        self.pool = ConnectionPool(db_name, max_size=pool_size)
+        self.init_database()
+        if hasher is None:
+            saved = self.get_setting(PASSWORD_HASHER_SETTING)
+            hasher = PasswordHasher.from_settings(saved) if saved else PasswordHasher()
+        self.hasher = hasher
+
+    def pool_stats(self):
+        """Connection pool metrics"""
+        return self.pool.stats()
+
+    def close(self):
+        """Close the pooled connections"""
+        self.pool.close()
+
+    def init_database(self):
+        """Create tables if they don't exist.
+
+        This is the original schema; migrate() brings it up to date (amounts
+        become integer cents in version 3, dates day ordinals in version 4).
+        """
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS expenses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    amount REAL NOT NULL,
+                    category TEXT NOT NULL,
+                    description TEXT,
+                    date TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+            conn.commit()
+        self.migrate()
+
+    def get_schema_version(self):
+        """Return the schema version recorded in the database file"""
+        with self.pool.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """Bring an existing database up to the current schema version.
+
+        The version is read again under the write lock before each step, so
+        several processes opening the same file at once apply every step
+        exactly once.
+        """
+        with self.pool.connection() as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+                return
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    version = conn.execute('PRAGMA user_version').fetchone()[0]
+                    if version >= len(MIGRATIONS):
+                        conn.commit()
+                        return
+                    MIGRATIONS[version](conn)
+                    conn.execute(f'PRAGMA user_version = {version + 1}')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+    def explain(self, query, params=()):
+        """Return the EXPLAIN QUERY PLAN details for a query"""
+        with self.pool.connection() as conn:
+            return [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+
+    def check_query_plans(self):
+        """Check that the filter queries are index seeks rather than table scans.
+
+        Every sort order is checked with a keyset condition too; without a
+        date range those pages must also come out of an index already in
+        order rather than through a sort of every match. Returns a list of
+        (filters, plan) pairs, filters being (start, end, category, sort
+        column), for each offending query; an empty list means all is well.
+        """
+        problems = []
+        for start_date, end_date, category in [(None, None, None),
+                                               ('2024-01-01', '2024-12-31', None),
+                                               (None, None, 'Food'),
+                                               ('2024-01-01', '2024-12-31', 'Food')]:
+            start_day, end_day = _filter_days(start_date, end_date)
+            where, params = self._filter_clause(0, start_day, end_day, category)
+            plans = [(None, self.explain(f'SELECT category, SUM(amount), COUNT(*) FROM expenses '
+                                         f'WHERE {where} GROUP BY category', params))]
+            for column, columns in SORT_COLUMNS.items():
+                key = (0,) * (len(columns) + 1)
+                with self.pool.connection() as conn:
+                    query, page_params, _ = self._page_query(conn, 0, start_day, end_day, category,
+                                                             None, 1, 0, (column, True), key, None)
+                plans.append((column, self.explain(query, page_params)))
+            for column, plan in plans:
+                scans = any(detail.startswith('SCAN expenses') for detail in plan)
+                sorts = start_date is None and any('TEMP B-TREE FOR ORDER BY' in detail
+                                                   for detail in plan)
+                if scans or sorts:
+                    problems.append(((start_date, end_date, category, column), plan))
+        return problems
+
+    def get_setting(self, name, default=None):
+        """Value of a stored setting, or default if it was never set"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, name, value):
+        with self.pool.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+                         (name, value))
+            conn.commit()
+
+    def save_hasher(self, hasher):
+        """Hash new passwords with hasher from now on, here and wherever the file is opened next.
+
+        Existing hashes with weaker parameters are upgraded at their next login.
+        """
+        self.set_setting(PASSWORD_HASHER_SETTING, hasher.settings())
+        self.hasher = hasher
+
+    def hash_password(self, password):
+        """Hash a password for storage"""
+        return self.hasher.hash(password)
+
+    def register_user(self, username, password):
+        """Register a new user. Returns False if the username is taken"""
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                             (username, self.hash_password(password)))
+                conn.commit()
+                return True
+            except sqlite3.IntegrityError:
+                return False
+
+    def get_user_id(self, username):
+        """Look up a user id by username, or None if there is no such user"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+            return row['id'] if row else None
+
+    def authenticate_user(self, username, password):
+        """Return the user id for valid credentials, otherwise None.
+
+        A stored hash made with an older scheme or weaker parameters than the
+        configured hasher is replaced after a successful login.
+        """
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT id, password FROM users WHERE username = ?',
+                               (username,)).fetchone()
+        if row is None:
+            # Keep unknown usernames as slow as wrong passwords
+            self.hasher.dummy_verify(password)
+            return None
+        if not self.hasher.verify(password, row['password']):
+            return None
+
+        if self.hasher.needs_rehash(row['password']):
+            new_hash = self.hasher.hash(password)
+            with self.pool.connection() as conn:
+                conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                             (new_hash, row['id'], row['password']))
+                conn.commit()
+        return row['id']
+
+    def add_expense(self, user_id, amount, category, description, date):
+        """Add a new expense with amount in integer cents. Returns its id, or False on failure"""
+        day = parse_day(date)
+        with self.pool.connection() as conn:
+            try:
+                cursor = conn.execute('''
+                    INSERT INTO expenses (user_id, amount, category, description, day)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, amount, category, description, day))
+                conn.execute('INSERT INTO expense_search (rowid, description) VALUES (?, ?)',
+                             (cursor.lastrowid, description))
+                _apply_rollup_delta(conn, user_id, day, category, amount, 1)
+                conn.commit()
+                return cursor.lastrowid
+            except sqlite3.Error:
+                conn.rollback()
+                return False
+
+    def add_expenses(self, user_id, expenses):
+        """Insert many expenses in one transaction.
+
+        expenses is an iterable of (amount, category, description, date)
+        tuples with amounts in integer cents. The rows go in through
+        executemany, the search index is filled from the new id range and the
+        rollups are updated once per (day, category) group. Returns the number
+        of rows inserted.
+        """
+        rows = [(user_id, amount, category, description, parse_day(date))
+                for amount, category, description, date in expenses]
+        deltas = {}
+        for _, amount, category, _, day in rows:
+            total, count = deltas.get((day, category), (0, 0))
+            deltas[(day, category)] = (total + amount, count + 1)
+
+        with self.pool.connection() as conn:
+            try:
+                conn.executemany('''
+                    INSERT INTO expenses (user_id, amount, category, description, day)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', rows)
+                if rows:
+                    # The write lock is held, so the new ids are consecutive
+                    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                    conn.execute('''
+                        INSERT INTO expense_search (rowid, description)
+                        SELECT id, description FROM expenses WHERE id BETWEEN ? AND ?
+                    ''', (last_id - len(rows) + 1, last_id))
+                for (day, category), (total, count) in deltas.items():
+                    _apply_rollup_delta(conn, user_id, day, category, total, count)
+                conn.commit()
+                return len(rows)
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def _filter_clause(self, user_id, start_day=None, end_day=None, category=None, search=None,
+                       by_day=True):
+        """Build the WHERE clause and parameters shared by the expense queries.
+
+        A search drives the query from the full-text matches, looked up by id;
+        the unary + on the other columns stops SQLite from walking the
+        (user_id, day) index instead, which would visit every row of the user.
+        by_day=False does the same for the date range alone (see _page_query).
+        """
+        column = '+{}' if search else '{}'
+        day = '+day' if search or not by_day else 'day'
+        clauses = [column.format('user_id') + ' = ?']
+        params = [user_id]
+        if start_day is not None:
+            clauses.append(day + ' >= ?')
+            params.append(start_day)
+        if end_day is not None:
+            clauses.append(day + ' <= ?')
+            params.append(end_day)
+        if category:
+            clauses.append(column.format('category') + ' = ?')
+            params.append(category)
+        if search:
+            clauses.append('id IN (SELECT rowid FROM expense_search WHERE expense_search MATCH ?)')
+            params.append(match_expression(search))
+        return ' AND '.join(clauses), params
+
+    def get_expense(self, expense_id, user_id):
+        """One of the user's expenses by id, or None"""
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {EXPENSE_COLUMNS} FROM expenses WHERE id = ? AND user_id = ?',
+                               (expense_id, user_id)).fetchone()
+        return _expense(row) if row else None
+
+    def _summary_by_category(self, conn, user_id, start_day, end_day, category, search):
+        """Per-category totals for a filter: from the rollups unless searching"""
+        if not search:
+            return _rollup_by_category(conn, user_id, start_day, end_day, category)
+        where, params = self._filter_clause(user_id, start_day, end_day, category, search)
+        query = f'SELECT category, SUM(amount), COUNT(*) FROM expenses WHERE {where} GROUP BY category'
+        return {row[0]: {'total': row[1], 'count': row[2]} for row in conn.execute(query, params)}
+
+    def _page_query(self, conn, user_id, start_day, end_day, category, search, limit, offset,
+                    sort, after, before, matched=None):
+        """Query and parameters for one page of a listing, plus whether to reverse its rows.
+
+        Sorted other than by date, a page under a date range is either the
+        first rows of the range's matches once SQLite has sorted them all, or
+        the first rows of the sort index that fall in the range. The second
+        reads about limit / (share of the user's rows in the range) rows, so
+        it wins when the range holds many rows; the + on day then keeps the
+        planner off the (user_id, day) index. matched is the number of rows
+        in the range, if the caller already knows it.
+        """
+        if category and sort[0] == 'category':
+            # Every row has the same category, so this is the date order
+            sort = ('date', sort[1])
+            after = after[1:] if after is not None else None
+            before = before[1:] if before is not None else None
+        by_day = True
+        if (sort[0] != 'date' and not search and limit is not None
+                and (start_day is not None or end_day is not None)):
+            if matched is None:
+                matched = sum(group['count'] for group in _rollup_by_category(
+                    conn, user_id, start_day, end_day, category).values())
+            total = sum(group['count'] for group in _rollup_by_category(
+                conn, user_id, category=category).values())
+            by_day = matched * matched <= (limit + offset) * total
+
+        where, params = self._filter_clause(user_id, start_day, end_day, category, search, by_day)
+        order_by, condition, key_params = _order_clause(sort, after, before)
+        if condition:
+            where += ' AND ' + condition
+            params += key_params
+        query = f'SELECT {EXPENSE_COLUMNS} FROM expenses WHERE {where} ORDER BY {order_by}'
+        if limit is not None or offset:
+            query += ' LIMIT ? OFFSET ?'
+            params += [-1 if limit is None else limit, offset]
+        return query, params, before is not None
+
+    def get_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                     limit=None, offset=0, search=None, sort=DEFAULT_SORT, after=None,
+                     before=None):
+        """Get expenses for a user, newest first unless sort says otherwise.
+
+        When limit is given only that many rows starting at offset are returned,
+        so callers can page through large ledgers without loading them whole.
+        search keeps only descriptions containing words that start with each
+        of its words (see the search module). sort is a (column, descending)
+        pair with column one of SORT_COLUMNS. after and before seek to the
+        rows following or preceding a sort key instead of skipping offset
+        rows, so every page costs the same however deep it is.
+        """
+        start_day, end_day = _filter_days(start_date, end_date)
+        with self.pool.connection() as conn:
+            query, params, backwards = self._page_query(conn, user_id, start_day, end_day,
+                                                        category, search, limit, offset, sort,
+                                                        after, before)
+            expenses = [_expense(row) for row in conn.execute(query, params)]
+        if backwards:
+            expenses.reverse()
+        return expenses
+
+    def iter_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                      batch_size=1000, search=None):
+        """Yield matching expenses newest first, fetching batch_size rows at a time.
+
+        Unlike get_expenses nothing is materialized, so memory stays flat no
+        matter how many rows match. The connection stays open until the
+        generator is exhausted or closed.
+        """
+        start_day, end_day = _filter_days(start_date, end_date)
+        where, params = self._filter_clause(user_id, start_day, end_day, category, search)
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {EXPENSE_COLUMNS} FROM expenses
+                WHERE {where}
+                ORDER BY day DESC, id DESC
+            ''', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _expense(row)
+
+    def count_expenses(self, user_id, start_date=None, end_date=None, category=None, search=None):
+        """Count the expenses matching the given filters"""
+        return self.get_expense_summary(user_id, start_date, end_date, category, search)['count']
+
+    def get_expense_summary(self, user_id, start_date=None, end_date=None, category=None,
+                            search=None):
+        """Get total amount (in cents) and number of expenses matching the filters.
+
+        Without a search this is read from the rollup tables, so the cost
+        depends on the number of days and months in the range rather than the
+        number of expenses.
+        """
+        start_day, end_day = _filter_days(start_date, end_date)
+        with self.pool.connection() as conn:
+            by_category = self._summary_by_category(conn, user_id, start_day, end_day, category,
+                                                    search)
+        return {'total': sum(group['total'] for group in by_category.values()),
+                'count': sum(group['count'] for group in by_category.values())}
+
+    def get_expenses_with_summary(self, user_id, start_date=None, end_date=None, category=None,
+                                  limit=None, offset=0, search=None, sort=DEFAULT_SORT,
+                                  after=None, before=None):
+        """Get a page of expenses together with the aggregates of every matching row.
+
+        The aggregates come from the rollup tables (or, when searching, from
+        the matching rows) and the page from the expenses table, read inside
+        a single transaction so the totals always agree with the rows. The
+        page is chosen as in get_expenses. The result has the keys
+        expenses, total, count, average and by_category, where by_category maps
+        each category to a {'total', 'count'} dict. Amounts are integer cents
+        and the average is rounded to the nearest cent.
+        """
+        start_day, end_day = _filter_days(start_date, end_date)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            by_category = self._summary_by_category(conn, user_id, start_day, end_day, category,
+                                                    search)
+            matched = sum(group['count'] for group in by_category.values())
+            query, params, backwards = self._page_query(conn, user_id, start_day, end_day,
+                                                        category, search, limit, offset, sort,
+                                                        after, before, matched)
+            expenses = [_expense(row) for row in conn.execute(query, params)]
+            conn.commit()
+        if backwards:
+            expenses.reverse()
+
+        total = sum(group['total'] for group in by_category.values())
+        count = sum(group['count'] for group in by_category.values())
+        return {'expenses': expenses, 'total': total, 'count': count,
+                'average': divide(total, count), 'by_category': by_category}
+
+    def delete_expense(self, expense_id, user_id):
+        """Delete an expense owned by the user"""
+        with self.pool.connection() as conn:
+            try:
+                row = conn.execute('SELECT amount, category, description, day FROM expenses '
+                                   'WHERE id = ? AND user_id = ?', (expense_id, user_id)).fetchone()
+                if row is None:
+                    return False
+                conn.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
+                conn.execute("INSERT INTO expense_search (expense_search, rowid, description) "
+                             "VALUES ('delete', ?, ?)", (expense_id, row['description']))
+                _apply_rollup_delta(conn, user_id, row['day'], row['category'], -row['amount'], -1)
+                conn.commit()
+                return True
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def delete_expenses(self, expense_ids, user_id):
+        """Delete many of the user's expenses in one transaction.
+
+        The rows are copied to the undo journal first, as one batch that
+        restore_expenses can put back; only the latest UNDO_BATCHES batches of
+        each user are kept. Ids that don't exist or belong to someone else are
+        skipped. Returns a dict with the batch_id (None if nothing was
+        deleted) and the deleted expenses.
+        """
+        # In ascending order: the search index flushes its pending changes
+        # whenever the rowids it is given stop increasing
+        expense_ids = sorted(set(expense_ids))
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                batch_id = conn.execute('INSERT INTO expense_undo_batches (user_id) VALUES (?)',
+                                        (user_id,)).lastrowid
+                deleted = []
+                for start in range(0, len(expense_ids), _ID_CHUNK):
+                    chunk = expense_ids[start:start + _ID_CHUNK]
+                    marks = ', '.join('?' * len(chunk))
+                    conn.execute(f'''
+                        INSERT INTO expense_undo_rows
+                            (batch_id, id, user_id, amount, category, description, day, created_at)
+                        SELECT ?, id, user_id, amount, category, description, day, created_at
+                        FROM expenses WHERE id IN ({marks}) AND +user_id = ?
+                    ''', [batch_id] + chunk + [user_id])
+                    # The + keeps SQLite on id lookups rather than the user's indexes
+                    rows = conn.execute(f'SELECT {EXPENSE_COLUMNS} FROM expenses '
+                                        f'WHERE id IN ({marks}) AND +user_id = ? ORDER BY id',
+                                        chunk + [user_id]).fetchall()
+                    conn.executemany('DELETE FROM expenses WHERE id = ?',
+                                     [(row['id'],) for row in rows])
+                    conn.executemany("INSERT INTO expense_search (expense_search, rowid, description) "
+                                     "VALUES ('delete', ?, ?)",
+                                     [(row['id'], row['description']) for row in rows])
+                    deleted.extend(rows)
+                if not deleted:
+                    conn.rollback()
+                    return {'batch_id': None, 'expenses': []}
+                self._apply_rows_delta(conn, user_id, deleted, -1)
+                self._prune_undo_journal(conn, user_id)
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return {'batch_id': batch_id, 'expenses': [_expense(row) for row in deleted]}
+
+    def _apply_rows_delta(self, conn, user_id, rows, sign):
+        """Add (sign=1) or remove (sign=-1) expense rows from the rollups, once per day and category"""
+        deltas = {}
+        for row in rows:
+            total, count = deltas.get((row['day'], row['category']), (0, 0))
+            deltas[(row['day'], row['category'])] = (total + row['amount'], count + 1)
+        for (day, category), (total, count) in deltas.items():
+            _apply_rollup_delta(conn, user_id, day, category, sign * total, sign * count)
+
+    def _prune_undo_journal(self, conn, user_id):
+        """Drop the user's batches beyond the latest UNDO_BATCHES"""
+        stale = '''
+            SELECT id FROM expense_undo_batches WHERE user_id = ?
+            ORDER BY id DESC LIMIT -1 OFFSET ?
+        '''
+        conn.execute(f'DELETE FROM expense_undo_rows WHERE batch_id IN ({stale})',
+                     (user_id, UNDO_BATCHES))
+        conn.execute(f'DELETE FROM expense_undo_batches WHERE id IN ({stale})',
+                     (user_id, UNDO_BATCHES))
+
+    def last_undo_batch(self, user_id):
+        """Id of the user's most recent restorable delete batch, or None"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT MAX(id) FROM expense_undo_batches WHERE user_id = ?',
+                                (user_id,)).fetchone()[0]
+
+    def restore_expenses(self, batch_id, user_id):
+        """Put back the expenses of a delete_expenses batch, with their original ids.
+
+        The batch leaves the journal. Returns the restored expenses, or an
+        empty list if the batch doesn't exist or isn't the user's.
+        """
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                rows = conn.execute(f'''
+                    SELECT {EXPENSE_COLUMNS} FROM expense_undo_rows
+                    WHERE batch_id = ? AND user_id = ? ORDER BY id
+                ''', (batch_id, user_id)).fetchall()
+                # AUTOINCREMENT never hands a deleted id out again, so they are free
+                conn.execute('''
+                    INSERT INTO expenses (id, user_id, amount, category, description, day, created_at)
+                    SELECT id, user_id, amount, category, description, day, created_at
+                    FROM expense_undo_rows WHERE batch_id = ? AND user_id = ?
+                ''', (batch_id, user_id))
+                conn.executemany('INSERT INTO expense_search (rowid, description) VALUES (?, ?)',
+                                 [(row['id'], row['description']) for row in rows])
+                self._apply_rows_delta(conn, user_id, rows, 1)
+                conn.execute('DELETE FROM expense_undo_rows WHERE batch_id = ? AND user_id = ?',
+                             (batch_id, user_id))
+                conn.execute('DELETE FROM expense_undo_batches WHERE id = ? AND user_id = ?',
+                             (batch_id, user_id))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return [_expense(row) for row in rows]
+
+    def user_ids_with_expenses(self):
+        """Ids of every user with at least one expense in this file, ascending"""
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT user_id FROM expenses '
+                                                   'ORDER BY user_id')]
+
+    def drop_user_expenses(self, user_id):
+        """Remove all of a user's expenses, rollups and undo batches from this file.
+
+        Unlike delete_expenses nothing is kept for undo; this is for moving a
+        user's ledger to another shard (see sharding.py). Returns the number
+        of expenses removed.
+        """
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                # Search index entries are removed in id order, as in delete_expenses
+                conn.execute('''
+                    INSERT INTO expense_search (expense_search, rowid, description)
+                    SELECT 'delete', id, description FROM expenses
+                    WHERE user_id = ? ORDER BY id
+                ''', (user_id,))
+                removed = conn.execute('DELETE FROM expenses WHERE user_id = ?',
+                                       (user_id,)).rowcount
+                conn.execute('DELETE FROM expense_undo_rows WHERE batch_id IN '
+                             '(SELECT id FROM expense_undo_batches WHERE user_id = ?)', (user_id,))
+                for table in ('expense_undo_batches', 'expense_daily_rollup',
+                              'expense_monthly_rollup'):
+                    conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return removed
+
+    def rebuild_search_index(self):
+        """Rebuild the description search index from the expenses table"""
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO expense_search (expense_search) VALUES ('rebuild')")
+            conn.commit()
+
+    def rebuild_rollups(self, user_id=None):
+        """Recompute the rollup tables for one user, or for everyone"""
+        with self.pool.connection() as conn:
+            _rebuild_rollups(conn, user_id)
+            conn.commit()
+
+    def verify_rollups(self, user_id=None):
+        """Compare the rollup tables against the raw expenses.
+
+        Returns a list of (table, user_id, key, category, expected, actual)
+        tuples, where expected and actual are (total, count) pairs or None for
+        a missing row. An empty list means the rollups are consistent.
+        """
+        where = 'WHERE user_id = ?' if user_id is not None else ''
+        params = (user_id,) if user_id is not None else ()
+        mismatches = []
+        with self.pool.connection() as conn:
+            for table, key_column, key_expr in [('expense_daily_rollup', 'day', 'day'),
+                                                ('expense_monthly_rollup', 'month', month_sql('day'))]:
+                expected = {}
+                for row in conn.execute(f'SELECT user_id, {key_expr}, category, SUM(amount), COUNT(*) '
+                                        f'FROM expenses {where} GROUP BY 1, 2, 3', params):
+                    expected[tuple(row[:3])] = (row[3], row[4])
+                actual = {}
+                for row in conn.execute(f'SELECT user_id, {key_column}, category, total, count '
+                                        f'FROM {table} {where}', params):
+                    actual[tuple(row[:3])] = (row[3], row[4])
+                for key in sorted(expected.keys() | actual.keys()):
+                    want, got = expected.get(key), actual.get(key)
+                    if want != got:
+                        mismatches.append((table,) + key + (want, got))
+        return mismatches
+
+
+# Expense ids LoggedDatabase reserves from the store at a time
+LOG_ID_BLOCK = 1000
+# Longest pause, in seconds, between compaction attempts after failures
+COMPACT_MAX_BACKOFF = 60.0
+
+
+class LoggedDatabase(Database):
+    """Database whose add_expense appends to a write-ahead log instead of committing.
+
+    Each added expense gets an id reserved from the expenses table, goes into
+    the log (see appendlog.AppendLog), which syncs many at once, and is kept
+    in memory until a background compaction stores the logged expenses in one
+    transaction. Reads merge the expenses still pending with the store, so
+    they see every add that has returned. max_unsynced is the number of
+    acknowledged adds a crash may lose, 0 for none; whatever made it into the
+    log is stored on the next open.
+
+    Compaction runs every compact_interval seconds, as soon as compact_records
+    expenses are pending, and before a delete, restore or maintenance command
+    on a user with pending expenses. add_expenses is already one transaction
+    and goes straight to the store.
+    """
+
+    def __init__(self, db_name="expenses.db", pool_size=8, hasher=None, log_dir=None,
+                 commit_interval=DEFAULT_COMMIT_INTERVAL, commit_records=DEFAULT_COMMIT_RECORDS,
+                 max_unsynced=0, compact_interval=1.0, compact_records=10000):
+        if log_dir is None and db_name == ':memory:':
+            raise ValueError("An in-memory database needs an explicit log_dir")
+        super().__init__(db_name, pool_size, hasher)
+        self.compact_interval = compact_interval
+        self.compact_records = compact_records
+        # Guards the pending expenses, the sequence numbers and the reserved ids
+        self._lock = threading.Lock()
+        # user_id -> [(seq, day, expense)] in seq order, not yet in the store
+        self._pending = {}
+        self._pending_count = 0
+        # The block of reserved ids in use and the next one, reserved ahead of
+        # time without holding _lock; _ids_ready wakes writers waiting for it
+        self._ids = iter(())
+        self._spare_ids = None
+        self._reserving = False
+        self._ids_ready = threading.Condition(self._lock)
+        self._compact_lock = threading.Lock()
+        self._compact_errors = 0
+        self._last_compact_error = None
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS expense_log_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    applied_seq INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO expense_log_state (id, applied_seq) VALUES (1, 0)')
+            conn.commit()
+            applied = self._applied_seq(conn)
+        self.log = AppendLog(log_dir or db_name + '-log', commit_interval, commit_records,
+                             max_unsynced)
+        # Store whatever a crash left in the log before taking new writes
+        recovered = list(self.log.replay(applied))
+        self._seq = recovered[-1][0] if recovered else applied
+        if recovered:
+            self._store_logged([(seq, record['user_id'], record['day'], record)
+                                for seq, record in recovered], self._seq)
+        self.log.remove(self.log.rotate()[1])
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._compactor = threading.Thread(target=self._compact_loop, name='log-compactor',
+                                           daemon=True)
+        self._compactor.start()
+
+    def close(self):
+        """Stop compacting, store every logged expense, then close the log and the pool"""
+        self._stop.set()
+        self._wake.set()
+        self._compactor.join()
+        self.log.close()
+        self.compact()
+        super().close()
+
+    def log_stats(self):
+        """Append log metrics, the expenses waiting for compaction and compaction failures.
+
+        last_compact_error is the latest failure while compaction keeps
+        failing, and None once it succeeds again.
+        """
+        with self._lock:
+            return dict(self.log.stats(), pending=self._pending_count,
+                        compact_errors=self._compact_errors,
+                        last_compact_error=self._last_compact_error)
+
+    @staticmethod
+    def _applied_seq(conn):
+        return conn.execute('SELECT applied_seq FROM expense_log_state').fetchone()[0]
+
+    def _reserve_ids(self):
+        """Take the next LOG_ID_BLOCK ids of the expenses table for logged expenses"""
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()
+                first = (row[0] if row else 0) + 1
+                if row:
+                    conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'expenses'",
+                                 (first + LOG_ID_BLOCK - 1,))
+                else:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('expenses', ?)",
+                                 (first + LOG_ID_BLOCK - 1,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+        return iter(range(first, first + LOG_ID_BLOCK))
+
+    def _take_id(self):
+        """Next reserved expense id.
+
+        Whoever takes the first id of a block reserves the following one, in
+        a database transaction run without _lock, so other writers keep
+        taking ids meanwhile. Only a writer that finds both blocks used up
+        waits for it.
+        """
+        while True:
+            with self._lock:
+                expense_id = next(self._ids, None)
+                if expense_id is None and self._spare_ids is not None:
+                    self._ids, self._spare_ids = self._spare_ids, None
+                    expense_id = next(self._ids)
+                refill = self._spare_ids is None and not self._reserving
+                if refill:
+                    self._reserving = True
+                elif expense_id is None:
+                    self._ids_ready.wait()
+                    continue
+            if refill:
+                block = None
+                try:
+                    block = self._reserve_ids()
+                finally:
+                    with self._lock:
+                        self._spare_ids = block
+                        self._reserving = False
+                        self._ids_ready.notify_all()
+            if expense_id is not None:
+                return expense_id
+
+    def add_expense(self, user_id, amount, category, description, date):
+        """Log a new expense with amount in integer cents. Returns its id.
+
+        Returns once the log holds it within the max_unsynced bound; it is
+        readable right away and stored in the expenses table by compaction.
+        If the log can't take or write it, the error is raised and the
+        expense is dropped, so neither reads nor compaction see it.
+        """
+        day = parse_day(date)
+        expense_id = self._take_id()
+        with self._lock:
+            seq = self._seq + 1
+            self.log.append(seq, {'id': expense_id, 'user_id': user_id, 'amount': amount,
+                                  'category': category, 'description': description, 'day': day})
+            self._seq = seq
+            expense = {'id': expense_id, 'amount': amount, 'category': category,
+                       'description': description, 'date': format_day(day)}
+            self._pending.setdefault(user_id, []).append((seq, day, expense))
+            self._pending_count += 1
+            full = self._pending_count >= self.compact_records
+        if full:
+            self._wake.set()
+        try:
+            self.log.wait(seq)
+        except OSError:
+            self._drop_pending(user_id, seq)
+            raise
+        return expense_id
+
+    def _drop_pending(self, user_id, seq):
+        """Forget a pending expense whose log write failed"""
+        with self._lock:
+            pending = self._pending.get(user_id, [])
+            left = [entry for entry in pending if entry[0] != seq]
+            if len(left) < len(pending):
+                self._pending_count -= 1
+                if left:
+                    self._pending[user_id] = left
+                else:
+                    del self._pending[user_id]
+
+    def _compact_loop(self):
+        """Compact periodically; after a failure, log it and retry with doubling pauses"""
+        delay = self.compact_interval
+        failing = False
+        while not self._stop.is_set():
+            if failing:
+                # A full backlog mustn't turn the retries into a busy loop
+                self._stop.wait(delay)
+            else:
+                self._wake.wait(delay)
+                self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.compact()
+            except Exception as e:
+                delay = min(max(delay, 0.1) * 2, COMPACT_MAX_BACKOFF)
+                failing = True
+                with self._lock:
+                    self._compact_errors += 1
+                    self._last_compact_error = f"{type(e).__name__}: {e}"
+                log.exception("Compacting the append log of %s failed; retrying in %.1fs",
+                              self.db_name, delay)
+            else:
+                if failing:
+                    with self._lock:
+                        self._last_compact_error = None
+                delay = self.compact_interval
+                failing = False
+
+    def compact(self):
+        """Move every expense the log has written into the store. Returns how many were moved"""
+        with self._compact_lock:
+            last_seq, segments = self.log.rotate()
+            with self._lock:
+                records = [(seq, user_id, day, expense)
+                           for user_id, pending in self._pending.items()
+                           for seq, day, expense in pending if seq <= last_seq]
+            if records:
+                self._store_logged(sorted(records, key=lambda record: record[0]), last_seq)
+                with self._lock:
+                    for user_id in list(self._pending):
+                        left = [entry for entry in self._pending[user_id] if entry[0] > last_seq]
+                        if left:
+                            self._pending[user_id] = left
+                        else:
+                            del self._pending[user_id]
+                    self._pending_count -= len(records)
+            self.log.remove(segments)
+            return len(records)
+
+    def _store_logged(self, records, last_seq):
+        """Insert (seq, user_id, day, expense) records with their reserved ids, in one transaction.
+
+        The applied sequence number is saved in the same transaction, so
+        readers and recovery know which logged expenses the store holds.
+        """
+        deltas = {}
+        for _, user_id, day, expense in records:
+            total, count = deltas.get((user_id, day, expense['category']), (0, 0))
+            deltas[(user_id, day, expense['category'])] = (total + expense['amount'], count + 1)
+        with self.pool.connection() as conn:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('''
+                    INSERT INTO expenses (id, user_id, amount, category, description, day)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(expense['id'], user_id, expense['amount'], expense['category'],
+                       expense['description'], day) for _, user_id, day, expense in records])
+                conn.executemany('INSERT INTO expense_search (rowid, description) VALUES (?, ?)',
+                                 [(expense['id'], expense['description'])
+                                  for _, _, _, expense in records])
+                for (user_id, day, category), (total, count) in deltas.items():
+                    _apply_rollup_delta(conn, user_id, day, category, total, count)
+                conn.execute('UPDATE expense_log_state SET applied_seq = ?', (last_seq,))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def _settle(self, user_id=None):
+        """Compact first if the user (or anyone, for None) has expenses pending"""
+        with self._lock:
+            pending = self._pending_count if user_id is None else user_id in self._pending
+        if pending:
+            self.compact()
+
+    def _pending_matches(self, user_id, start_day, end_day, category, search):
+        """Snapshot of the user's pending expenses as (seq, day, expense), filtered.
+
+        Taken before the reader's store transaction starts: an expense
+        compacted after that is in the snapshot, and the reader drops those
+        at or below the applied sequence number it then reads.
+        """
+        with self._lock:
+            pending = list(self._pending.get(user_id, ()))
+        return [(seq, day, expense) for seq, day, expense in pending
+                if (start_day is None or day >= start_day) and (end_day is None or day <= end_day)
+                and (not category or expense['category'] == category)
+                and (not search or matches(expense['description'], search))]
+
+    @staticmethod
+    def _unapplied(conn, pending):
+        applied = LoggedDatabase._applied_seq(conn)
+        return [expense for seq, _, expense in pending if seq > applied]
+
+    def _merged_page(self, conn, user_id, start_day, end_day, category, search, limit, offset,
+                     sort, after, before, pending, matched=None):
+        """A page of the store rows and the pending expenses together, as get_expenses returns it"""
+        column, descending = sort
+        wanted = None if limit is None else limit + offset
+        query, params, backwards = self._page_query(conn, user_id, start_day, end_day, category,
+                                                    search, wanted, 0, sort, after, before,
+                                                    matched)
+        rows = [_expense(row) for row in conn.execute(query, params)]
+        downwards = descending != backwards
+        bound = before if backwards else after
+        for expense in pending:
+            key = sort_key(expense, column)
+            if bound is None or (key < tuple(bound) if downwards else key > tuple(bound)):
+                rows.append(expense)
+        rows.sort(key=lambda expense: sort_key(expense, column), reverse=downwards)
+        page = rows[offset:None if limit is None else offset + limit]
+        if backwards:
+            page.reverse()
+        return page
+
+    def get_expense(self, expense_id, user_id):
+        """One of the user's expenses by id, or None"""
+        with self._lock:
+            pending = list(self._pending.get(user_id, ()))
+        for _, _, expense in pending:
+            if expense['id'] == expense_id:
+                return dict(expense)
+        return super().get_expense(expense_id, user_id)
+
+    def get_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                     limit=None, offset=0, search=None, sort=DEFAULT_SORT, after=None,
+                     before=None):
+        """Get expenses for a user, pending ones included. See Database.get_expenses"""
+        start_day, end_day = _filter_days(start_date, end_date)
+        pending = self._pending_matches(user_id, start_day, end_day, category, search)
+        if not pending:
+            return super().get_expenses(user_id, start_date, end_date, category, limit, offset,
+                                        search, sort, after, before)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            expenses = self._merged_page(conn, user_id, start_day, end_day, category, search,
+                                         limit, offset, sort, after, before,
+                                         self._unapplied(conn, pending))
+            conn.commit()
+        return [dict(expense) for expense in expenses]
+
+    def iter_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                      batch_size=1000, search=None):
+        """Yield matching expenses newest first, pending ones included"""
+        start_day, end_day = _filter_days(start_date, end_date)
+        pending = self._pending_matches(user_id, start_day, end_day, category, search)
+        if not pending:
+            yield from super().iter_expenses(user_id, start_date, end_date, category,
+                                             batch_size, search)
+            return
+        where, params = self._filter_clause(user_id, start_day, end_day, category, search)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            unapplied = self._unapplied(conn, pending)
+            cursor = conn.execute(f'''
+                SELECT {EXPENSE_COLUMNS} FROM expenses
+                WHERE {where}
+                ORDER BY day DESC, id DESC
+            ''', params)
+
+            def stored():
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        return
+                    for row in rows:
+                        yield _expense(row)
+            unapplied.sort(key=lambda expense: (parse_day(expense['date']), expense['id']),
+                           reverse=True)
+            for expense in heapq.merge(stored(), map(dict, unapplied), reverse=True,
+                                       key=lambda expense: (parse_day(expense['date']),
+                                                            expense['id'])):
+                yield expense
+            conn.commit()
+
+    def get_expense_summary(self, user_id, start_date=None, end_date=None, category=None,
+                            search=None):
+        """Total (in cents) and count of the matching expenses, pending ones included"""
+        start_day, end_day = _filter_days(start_date, end_date)
+        pending = self._pending_matches(user_id, start_day, end_day, category, search)
+        if not pending:
+            return super().get_expense_summary(user_id, start_date, end_date, category, search)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            by_category = self._summary_by_category(conn, user_id, start_day, end_day, category,
+                                                    search)
+            unapplied = self._unapplied(conn, pending)
+            conn.commit()
+        by_category = _add_to_categories(by_category, unapplied)
+        return {'total': sum(group['total'] for group in by_category.values()),
+                'count': sum(group['count'] for group in by_category.values())}
+
+    def get_expenses_with_summary(self, user_id, start_date=None, end_date=None, category=None,
+                                  limit=None, offset=0, search=None, sort=DEFAULT_SORT,
+                                  after=None, before=None):
+        """A page of expenses with the aggregates of every match, pending ones included"""
+        start_day, end_day = _filter_days(start_date, end_date)
+        pending = self._pending_matches(user_id, start_day, end_day, category, search)
+        if not pending:
+            return super().get_expenses_with_summary(user_id, start_date, end_date, category,
+                                                     limit, offset, search, sort, after, before)
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            by_category = self._summary_by_category(conn, user_id, start_day, end_day, category,
+                                                    search)
+            unapplied = self._unapplied(conn, pending)
+            expenses = self._merged_page(conn, user_id, start_day, end_day, category, search,
+                                         limit, offset, sort, after, before, unapplied,
+                                         sum(group['count'] for group in by_category.values()))
+            conn.commit()
+        by_category = _add_to_categories(by_category, unapplied)
+        total = sum(group['total'] for group in by_category.values())
+        count = sum(group['count'] for group in by_category.values())
+        return {'expenses': [dict(expense) for expense in expenses], 'total': total,
+                'count': count, 'average': divide(total, count), 'by_category': by_category}
+
+    def delete_expense(self, expense_id, user_id):
+        self._settle(user_id)
+        return super().delete_expense(expense_id, user_id)
+
+    def delete_expenses(self, expense_ids, user_id):
+        self._settle(user_id)
+        return super().delete_expenses(expense_ids, user_id)
+
+    def restore_expenses(self, batch_id, user_id):
+        self._settle(user_id)
+        return super().restore_expenses(batch_id, user_id)
+
+    def drop_user_expenses(self, user_id):
+        self._settle(user_id)
+        return super().drop_user_expenses(user_id)
+
+    def user_ids_with_expenses(self):
+        self._settle()
+        return super().user_ids_with_expenses()
+
+    def rebuild_search_index(self):
+        self._settle()
+        super().rebuild_search_index()
+
+    def rebuild_rollups(self, user_id=None):
+        self._settle(user_id)
+        super().rebuild_rollups(user_id)
+
+    def verify_rollups(self, user_id=None):
+        self._settle(user_id)
+        return super().verify_rollups(user_id)
+
+
+def _add_to_categories(by_category, expenses):
+    """Copy of a per-category {'total', 'count'} breakdown with expenses added in"""
+    merged = {name: dict(group) for name, group in by_category.items()}
+    for expense in expenses:
+        group = merged.setdefault(expense['category'], {'total': 0, 'count': 0})
+        group['total'] += expense['amount']
+        group['count'] += 1
+    return merged
+
+
+def main():
+    """Maintenance commands for an existing database file"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Expense tracker database maintenance")
+    parser.add_argument('--db', default='expenses.db', help="database file (default: expenses.db)")
+    parser.add_argument('command', choices=['rebuild-rollups', 'verify-rollups', 'check-plans',
+                                            'rebuild-search'])
+    parser.add_argument('--user-id', type=int, help="limit rollup commands to one user")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    if args.command == 'rebuild-rollups':
+        db.rebuild_rollups(args.user_id)
+        print("Rollups rebuilt")
+    elif args.command == 'verify-rollups':
+        mismatches = db.verify_rollups(args.user_id)
+        for mismatch in mismatches:
+            print("Mismatch: %s user=%s key=%s category=%s expected=%s actual=%s" % mismatch)
+        print(f"{len(mismatches)} mismatched rollup rows")
+        return 1 if mismatches else 0
+    elif args.command == 'rebuild-search':
+        db.rebuild_search_index()
+        print("Search index rebuilt")
+    elif args.command == 'check-plans':
+        problems = db.check_query_plans()
+        for filters, plan in problems:
+            print(f"Table scan or full sort for filters {filters}: {plan}")
+        print(f"{len(problems)} queries scan or sort the expenses table")
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
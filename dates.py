@@ -0,0 +1,52 @@
+"""Calendar dates as integer day ordinals.
+
+Expenses are stored and indexed by date.toordinal() (0001-01-01 is day 1), so
+date filters are integer comparisons and a month is a simple range of days.
+YYYY-MM-DD text only appears at the edges. The parser is a pre-compiled regex
+plus date(), which is several times faster than strptime, and both directions
+are memoized because bulk loads repeat the same few hundred dates.
+"""
+import re
+from datetime import date
+from functools import lru_cache
+
+# SQLite's julianday() of midnight at the start of day ordinal 0, so
+# date(day + JULIAN_OFFSET) renders a day ordinal inside SQL
+JULIAN_OFFSET = 1721424.5
+
+_ISO_DATE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+
+
+@lru_cache(maxsize=16384)
+def parse_day(text):
+    """Day ordinal of a YYYY-MM-DD string, raising ValueError if it isn't a real date"""
+    match = _ISO_DATE.fullmatch(text)
+    if match is None:
+        raise ValueError(f"not a YYYY-MM-DD date: {text!r}")
+    year, month, day = match.groups()
+    return date(int(year), int(month), int(day)).toordinal()
+
+
+@lru_cache(maxsize=16384)
+def format_day(day):
+    """YYYY-MM-DD text of a day ordinal"""
+    return date.fromordinal(day).isoformat()
+
+
+@lru_cache(maxsize=16384)
+def month_of(day):
+    """Month number (year * 12 + month - 1) containing a day ordinal"""
+    value = date.fromordinal(day)
+    return value.year * 12 + value.month - 1
+
+
+def month_start(month):
+    """Day ordinal of the first day of a month number"""
+    return date(month // 12, month % 12 + 1, 1).toordinal()
+
+
+def month_sql(column):
+    """SQL expression for the month number of a day-ordinal column"""
+    shifted = f'{column} + {JULIAN_OFFSET}'
+    return (f"(CAST(strftime('%Y', {shifted}) AS INTEGER) * 12 "
+            f"+ CAST(strftime('%m', {shifted}) AS INTEGER) - 1)")
@@ -1,11 +1,36 @@
+import os
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
-from datetime import datetime, date
-from database import Database
-import re
+from tkinter import ttk, messagebox, filedialog
+from datetime import date, datetime
+from database import DEFAULT_SORT, UNDO_BATCHES, Database
+from cache import ExpenseCache, QueryCache
+from metrics import MetricsRegistry, Profiler
+from money import format_cents
+from query_executor import QueryExecutor
+from remote import RemoteService
+from service import (ExpenseService, PAGE_SIZE, PageMemo, normalize_filters, matches_filters,
+                     make_expense, apply_summary_delta, average, empty_summary, sort_key)
+from validation import CATEGORIES, parse_date, validate_credentials
+from collections import deque
 
 class ModernExpenseTracker:
-    def __init__(self, root):
+    # Number of expenses rendered in the table at a time
+    PAGE_SIZE = PAGE_SIZE
+    # Quiet period after the last keystroke in a filter entry before it is applied
+    FILTER_DEBOUNCE_MS = 300
+    # Recently shown pages kept for instant redisplay until the next write
+    PAGE_MEMO_SIZE = 16
+    # Sort column behind each table heading, and the direction a first click sorts in
+    SORT_HEADINGS = {'Date': ('date', True), 'Category': ('category', False),
+                     'Description': ('description', False), 'Amount': ('amount', True)}
+    # Debug overlay: how often it redraws and how many of the busiest metrics it lists
+    OVERLAY_INTERVAL_MS = 500
+    OVERLAY_ROWS = 14
+    # Where F11 saves a profile capture, relative to the working directory
+    PROFILE_FILE = 'expense-tracker-%Y%m%d-%H%M%S.prof'
+    
+    def __init__(self, root, server=None):
         self.root = root
         self.root.title("Expense Tracker")
         self.root.geometry("1200x700")
@@ -25,9 +50,60 @@ class ModernExpenseTracker:
             'input': '#3d3d5c'
         }
         
-        self.db = Database()
+        if server:
+            # Every operation goes to an expense server (see server.py)
+            self.db = self.cache = None
+            self.service = RemoteService(server)
+        else:
+            self.db = Database()
+            self.cache = QueryCache(ExpenseCache(self.db))
+            self.service = ExpenseService(self.cache)
+        
+        # Timing of database calls and refresh phases, off unless
+        # EXPENSES_METRICS=1; F12 toggles it along with the on-screen overlay
+        # and F11 starts or stops a cProfile capture
+        self.metrics = MetricsRegistry(enabled=os.environ.get('EXPENSES_METRICS') == '1')
+        if self.db is not None:
+            self.metrics.instrument(self.db, 'db.')
+        else:
+            self.metrics.instrument(self.service, 'remote.', ['request'])
+        self.metrics.instrument(self.service, 'service.', ['load_page', 'analytics'])
+        self.profiler = Profiler()
+        self.overlay = None
+        self.overlay_after_id = None
+        self.refresh_started = None
+        self.root.bind('<F12>', self.toggle_metrics)
+        self.root.bind('<F11>', self.toggle_profile)
+        
+        self.executor = QueryExecutor(self.root, profiler=self.profiler)
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
         self.current_user_id = None
         self.current_user = None
+        self.page_offset = 0
+        self.total_rows = 0
+        
+        # Table order and the keyset position of the page: the sort key of
+        # the row just above it (page_after) or just below it (page_before)
+        self.sort = DEFAULT_SORT
+        self.page_after = None
+        self.page_before = None
+        self.has_previous = False
+        self.has_next = False
+        
+        # State of the last full refresh, used to apply edits incrementally
+        self.active_filters = (None, None, None, None)
+        self.visible_expenses = {}
+        self.summary = empty_summary()
+        
+        # Delete batches of this session that can still be undone, latest last;
+        # the database keeps only the latest UNDO_BATCHES per user
+        self.undo_batches = deque(maxlen=UNDO_BATCHES)
+        
+        # Live filtering: the pending debounce timer, the filters of the last
+        # refresh asked for, and pages already loaded keyed by (filters, sort, position)
+        self.filter_after_id = None
+        self.requested_filters = None
+        self.page_memo = PageMemo(self.PAGE_MEMO_SIZE)
         
         # Configure style
         self.setup_styles()
@@ -62,6 +138,7 @@ class ModernExpenseTracker:
     
     def clear_window(self):
         """Clear all widgets from the window"""
+        self.hide_overlay()
         for widget in self.root.winfo_children():
             widget.destroy()
     
@@ -135,11 +212,18 @@ class ModernExpenseTracker:
         username = self.username_entry.get().strip()
         password = self.password_entry.get()
         
-        if not username or not password:
-            messagebox.showerror("Error", "Please enter both username and password")
+        try:
+            validate_credentials(username, password)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        user_id = self.db.authenticate_user(username, password)
+        self.executor.submit(self.service.login, username, password, key='auth',
+                             on_success=lambda user_id: self.on_login(username, user_id),
+                             on_error=self.show_db_error)
+    
+    def on_login(self, username, user_id):
+        """Handle the result of an authentication query"""
         if user_id:
             self.current_user_id = user_id
             self.current_user = username
@@ -152,15 +236,18 @@ class ModernExpenseTracker:
         username = self.username_entry.get().strip()
         password = self.password_entry.get()
         
-        if not username or not password:
-            messagebox.showerror("Error", "Please enter both username and password")
-            return
-        
-        if len(password) < 4:
-            messagebox.showerror("Error", "Password must be at least 4 characters")
+        try:
+            validate_credentials(username, password, new_account=True)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        if self.db.register_user(username, password):
+        self.executor.submit(self.service.register, username, password, key='auth',
+                             on_success=self.on_registered, on_error=self.show_db_error)
+    
+    def on_registered(self, created):
+        """Handle the result of a registration query"""
+        if created:
             messagebox.showinfo("Success", "Account created successfully! Please login.")
             self.password_entry.delete(0, tk.END)
         else:
@@ -189,6 +276,22 @@ class ModernExpenseTracker:
                               command=self.logout)
         logout_btn.pack(side=tk.RIGHT, padx=20, pady=15)
         
+        # Import button
+        self.import_btn = tk.Button(top_bar, text="Import...", font=('Segoe UI', 10),
+                                    bg=self.colors['input'], fg=self.colors['text'],
+                                    activebackground='#4d4d6c', relief=tk.FLAT,
+                                    cursor='hand2', padx=15, pady=5,
+                                    command=self.import_expenses)
+        self.import_btn.pack(side=tk.RIGHT, pady=15)
+        
+        # Export button
+        self.export_btn = tk.Button(top_bar, text="Export...", font=('Segoe UI', 10),
+                                    bg=self.colors['input'], fg=self.colors['text'],
+                                    activebackground='#4d4d6c', relief=tk.FLAT,
+                                    cursor='hand2', padx=15, pady=5,
+                                    command=self.export_expenses)
+        self.export_btn.pack(side=tk.RIGHT, padx=(0, 10), pady=15)
+        
         # Main content area
         main_container = tk.Frame(self.root, bg=self.colors['bg'])
         main_container.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
@@ -207,11 +310,16 @@ class ModernExpenseTracker:
         
         # Summary cards
         self.create_summary_cards(right_panel)
+        self.create_analytics_cards(right_panel)
         
         # Expenses list
         self.create_expenses_list(right_panel)
         
+        if self.metrics.enabled:
+            self.show_overlay()
+        
         # Load initial data
+        self.reset_paging()
         self.refresh_data()
     
     def create_add_expense_form(self, parent):
@@ -236,8 +344,7 @@ class ModernExpenseTracker:
         tk.Label(form_frame, text="Category", font=('Segoe UI', 10),
                 bg=self.colors['card'], fg=self.colors['text']).pack(anchor='w', pady=(0, 5))
         self.category_var = tk.StringVar()
-        categories = ['Food', 'Transport', 'Shopping', 'Bills', 'Entertainment', 
-                     'Healthcare', 'Education', 'Other']
+        categories = CATEGORIES
         category_combo = ttk.Combobox(form_frame, textvariable=self.category_var,
                                      values=categories, font=('Segoe UI', 11),
                                      state='readonly', width=27)
@@ -276,6 +383,17 @@ class ModernExpenseTracker:
         filter_frame = tk.Frame(parent, bg=self.colors['card'])
         filter_frame.pack(padx=20, pady=10, fill=tk.BOTH)
         
+        # Description search
+        tk.Label(filter_frame, text="Search Descriptions", font=('Segoe UI', 10),
+                bg=self.colors['card'], fg=self.colors['text']).pack(anchor='w', pady=(0, 5))
+        self.search_entry = tk.Entry(filter_frame, font=('Segoe UI', 11),
+                                     bg=self.colors['input'], fg=self.colors['text'],
+                                     insertbackground=self.colors['text'],
+                                     relief=tk.FLAT, bd=10)
+        self.search_entry.pack(fill=tk.X, pady=(0, 10), ipady=8)
+        self.search_entry.bind('<Return>', lambda e: self.apply_filters())
+        self.search_entry.bind('<KeyRelease>', self.schedule_live_filter)
+        
         # Category filter
         tk.Label(filter_frame, text="Category", font=('Segoe UI', 10),
                 bg=self.colors['card'], fg=self.colors['text']).pack(anchor='w', pady=(0, 5))
@@ -285,7 +403,7 @@ class ModernExpenseTracker:
                                        state='readonly', width=27)
         filter_cat_combo.pack(fill=tk.X, pady=(0, 10), ipady=8)
         filter_cat_combo.set('All')
-        filter_cat_combo.bind('<<ComboboxSelected>>', lambda e: self.refresh_data())
+        filter_cat_combo.bind('<<ComboboxSelected>>', lambda e: self.apply_filters())
         
         # Date range
         tk.Label(filter_frame, text="Start Date (optional)", font=('Segoe UI', 10),
@@ -295,6 +413,7 @@ class ModernExpenseTracker:
                                          insertbackground=self.colors['text'],
                                          relief=tk.FLAT, bd=10)
         self.start_date_entry.pack(fill=tk.X, pady=(0, 10), ipady=8)
+        self.start_date_entry.bind('<KeyRelease>', self.schedule_live_filter)
         
         tk.Label(filter_frame, text="End Date (optional)", font=('Segoe UI', 10),
                 bg=self.colors['card'], fg=self.colors['text']).pack(anchor='w', pady=(0, 5))
@@ -303,13 +422,14 @@ class ModernExpenseTracker:
                                        insertbackground=self.colors['text'],
                                        relief=tk.FLAT, bd=10)
         self.end_date_entry.pack(fill=tk.X, pady=(0, 10), ipady=8)
+        self.end_date_entry.bind('<KeyRelease>', self.schedule_live_filter)
         
         # Apply filter button
         filter_btn = tk.Button(filter_frame, text="Apply Filters", font=('Segoe UI', 10),
                               bg=self.colors['accent'], fg=self.colors['text'],
                               activebackground=self.colors['accent_hover'],
                               relief=tk.FLAT, cursor='hand2', padx=10, pady=8,
-                              command=self.refresh_data)
+                              command=self.apply_filters)
         filter_btn.pack(fill=tk.X, pady=(0, 10))
         
         # Clear filters button
@@ -358,6 +478,27 @@ class ModernExpenseTracker:
                                   bg=self.colors['card'], fg=self.colors['success'])
         self.avg_label.pack()
     
+    def create_analytics_cards(self, parent):
+        """Create the breakdown cards fed by the analytics module"""
+        analytics_frame = tk.Frame(parent, bg=self.colors['bg'])
+        analytics_frame.pack(fill=tk.X, pady=(0, 20))
+        
+        self.analytics_labels = {}
+        cards = [('top_category', "Top Category", self.colors['accent']),
+                 ('month_change', "vs Last Month", self.colors['danger']),
+                 ('percentiles', "Median / 90th pct", self.colors['success'])]
+        for index, (name, title, color) in enumerate(cards):
+            card = tk.Frame(analytics_frame, bg=self.colors['card'], width=200, height=90)
+            card.pack(side=tk.LEFT, padx=(0, 15) if index < len(cards) - 1 else 0)
+            card.pack_propagate(False)
+            
+            tk.Label(card, text=title, font=('Segoe UI', 11),
+                    bg=self.colors['card'], fg=self.colors['text_secondary']).pack(pady=(12, 3))
+            label = tk.Label(card, text="–", font=('Segoe UI', 14, 'bold'),
+                             bg=self.colors['card'], fg=color)
+            label.pack()
+            self.analytics_labels[name] = label
+    
     def create_expenses_list(self, parent):
         """Create the expenses list/table"""
         list_frame = tk.Frame(parent, bg=self.colors['bg'])
@@ -378,14 +519,15 @@ class ModernExpenseTracker:
         # Treeview
         columns = ('Date', 'Category', 'Description', 'Amount')
         self.expenses_tree = ttk.Treeview(tree_frame, columns=columns, show='headings',
-                                         height=15, yscrollcommand=scrollbar.set)
+                                         height=15, selectmode='extended',
+                                         yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.expenses_tree.yview)
         
-        # Configure columns
-        self.expenses_tree.heading('Date', text='Date')
-        self.expenses_tree.heading('Category', text='Category')
-        self.expenses_tree.heading('Description', text='Description')
-        self.expenses_tree.heading('Amount', text='Amount')
+        # Configure columns; clicking a heading sorts by it
+        for heading in columns:
+            self.expenses_tree.heading(heading, text=heading,
+                                       command=lambda heading=heading: self.sort_by(heading))
+        self.update_sort_headings()
         
         self.expenses_tree.column('Date', width=120, anchor='center')
         self.expenses_tree.column('Category', width=120, anchor='center')
@@ -402,118 +544,633 @@ class ModernExpenseTracker:
         
         self.expenses_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
-        # Bind double-click to delete
+        # Bind double-click and the Delete key to delete, Ctrl+Z to undo it
         self.expenses_tree.bind('<Double-1>', self.delete_selected_expense)
+        self.expenses_tree.bind('<Delete>', self.delete_selected_expense)
+        self.expenses_tree.bind('<Control-z>', self.undo_delete)
+        self.expenses_tree.bind('<Control-a>', self.select_all_rows)
+        
+        # Scrolling past either end of the window moves to the next/previous page
+        self.expenses_tree.bind('<MouseWheel>', self.on_tree_scroll)
+        self.expenses_tree.bind('<Button-4>', self.on_tree_scroll)
+        self.expenses_tree.bind('<Button-5>', self.on_tree_scroll)
+        
+        # Paging controls
+        page_frame = tk.Frame(list_frame, bg=self.colors['bg'])
+        page_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        self.prev_page_btn = tk.Button(page_frame, text="◀ Prev", font=('Segoe UI', 10),
+                                       bg=self.colors['input'], fg=self.colors['text'],
+                                       activebackground='#4d4d6c', relief=tk.FLAT,
+                                       cursor='hand2', padx=10, pady=5,
+                                       command=self.prev_page)
+        self.prev_page_btn.pack(side=tk.LEFT)
+        
+        self.next_page_btn = tk.Button(page_frame, text="Next ▶", font=('Segoe UI', 10),
+                                       bg=self.colors['input'], fg=self.colors['text'],
+                                       activebackground='#4d4d6c', relief=tk.FLAT,
+                                       cursor='hand2', padx=10, pady=5,
+                                       command=self.next_page)
+        self.next_page_btn.pack(side=tk.RIGHT)
         
-        # Delete button
-        delete_btn = tk.Button(list_frame, text="Delete Selected", font=('Segoe UI', 10),
+        self.page_label = tk.Label(page_frame, text="", font=('Segoe UI', 10),
+                                   bg=self.colors['bg'], fg=self.colors['text_secondary'])
+        self.page_label.pack(side=tk.LEFT, expand=True)
+        
+        # Delete and undo buttons
+        action_frame = tk.Frame(list_frame, bg=self.colors['bg'])
+        action_frame.pack(pady=(10, 0))
+        
+        delete_btn = tk.Button(action_frame, text="Delete Selected", font=('Segoe UI', 10),
                               bg=self.colors['danger'], fg=self.colors['text'],
                               activebackground='#c02a2a', relief=tk.FLAT,
                               cursor='hand2', padx=15, pady=8,
                               command=self.delete_selected_expense)
-        delete_btn.pack(pady=(10, 0))
+        delete_btn.pack(side=tk.LEFT)
+        
+        delete_matching_btn = tk.Button(action_frame, text="Delete All Matching",
+                                        font=('Segoe UI', 10), bg=self.colors['danger'],
+                                        fg=self.colors['text'], activebackground='#c02a2a',
+                                        relief=tk.FLAT, cursor='hand2', padx=15, pady=8,
+                                        command=self.delete_matching_expenses)
+        delete_matching_btn.pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.undo_btn = tk.Button(action_frame, text="Undo Delete", font=('Segoe UI', 10),
+                                  bg=self.colors['input'], fg=self.colors['text'],
+                                  activebackground='#4d4d6c', relief=tk.FLAT,
+                                  cursor='hand2', padx=15, pady=8,
+                                  command=self.undo_delete)
+        self.undo_btn.pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.delete_status_label = tk.Label(action_frame, text="", font=('Segoe UI', 10),
+                                            bg=self.colors['bg'],
+                                            fg=self.colors['text_secondary'])
+        self.delete_status_label.pack(side=tk.LEFT, padx=(10, 0))
+        self.update_undo_button()
     
     def add_expense(self):
         """Add a new expense"""
         try:
-            amount = float(self.amount_entry.get())
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be greater than 0")
-                return
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid amount")
+            expense = make_expense(self.amount_entry.get(), self.category_var.get(),
+                                   self.description_entry.get(), self.date_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
         
-        category = self.category_var.get()
-        description = self.description_entry.get().strip() or "No description"
-        expense_date = self.date_entry.get().strip()
-        
-        # Validate date format
-        try:
-            datetime.strptime(expense_date, '%Y-%m-%d')
-        except ValueError:
-            messagebox.showerror("Error", "Please enter date in YYYY-MM-DD format")
-            return
-        
-        if self.db.add_expense(self.current_user_id, amount, category, description, expense_date):
+        self.executor.submit(self.service.add_expense, self.current_user_id, expense,
+                             on_success=self.on_expense_added, on_error=self.show_db_error)
+    
+    def on_expense_added(self, expense):
+        """Handle the result of an add_expense query"""
+        if expense:
+            self.page_memo.clear()
             messagebox.showinfo("Success", "Expense added successfully!")
             # Clear form
             self.amount_entry.delete(0, tk.END)
             self.description_entry.delete(0, tk.END)
             self.date_entry.delete(0, tk.END)
             self.date_entry.insert(0, date.today().strftime('%Y-%m-%d'))
-            # Refresh data
-            self.refresh_data()
+            # Show the new row without reloading the page, unless a reload
+            # that may have missed the insert is still in flight
+            if self.executor.is_pending('refresh'):
+                self.refresh_data()
+            else:
+                self.insert_expense_row(expense)
         else:
             messagebox.showerror("Error", "Failed to add expense")
     
-    def refresh_data(self):
-        """Refresh expenses list and summary"""
-        # Get filters
-        category_filter = self.filter_category_var.get()
-        start_date = self.start_date_entry.get().strip() or None
-        end_date = self.end_date_entry.get().strip() or None
-        
-        if category_filter == 'All':
-            category_filter = None
+    def refresh_data(self, on_loaded=None):
+        """Refresh the visible page of expenses and the summary.
         
-        # Get expenses
-        expenses = self.db.get_expenses(self.current_user_id, start_date, end_date, category_filter)
+        The queries run on a worker thread; a newer refresh supersedes one that
+        is still in flight. on_loaded is called once the new page is shown.
+        """
+        self.cancel_live_filter()
+        try:
+            filters = self.read_filters()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.load_filters(filters, on_loaded)
+    
+    def read_filters(self):
+        """Normalized filters from the filter widgets; raises ValueError if malformed"""
+        return normalize_filters(self.filter_category_var.get(), self.start_date_entry.get(),
+                                 self.end_date_entry.get(), self.search_entry.get())
+    
+    def load_filters(self, filters, on_loaded=None):
+        """Show the current page for filters, from the page memo if it was seen already"""
+        self.requested_filters = filters
+        self.refresh_started = time.perf_counter() if self.metrics.enabled else None
+        page = self.page_memo.get(filters, self.sort, self.page_offset, self.page_after,
+                                  self.page_before)
+        if page is not None:
+            # A query still in flight for other filters must not land on top
+            self.executor.cancel('refresh')
+            self.show_page(page, on_loaded)
+            return
+        self.executor.submit(self.service.load_page, self.current_user_id, filters,
+                             self.page_offset, self.PAGE_SIZE, self.sort, self.page_after,
+                             self.page_before, key='refresh',
+                             on_success=lambda page: self.show_page(page, on_loaded),
+                             on_error=self.show_db_error)
+    
+    def schedule_live_filter(self, event=None):
+        """Restart the debounce timer after a keystroke in a filter entry"""
+        self.cancel_live_filter()
+        self.filter_after_id = self.root.after(self.FILTER_DEBOUNCE_MS, self.apply_live_filter)
+    
+    def cancel_live_filter(self):
+        if self.filter_after_id is not None:
+            self.root.after_cancel(self.filter_after_id)
+            self.filter_after_id = None
+    
+    def apply_live_filter(self):
+        """Apply the filter entries once typing pauses.
+        
+        Incomplete dates are highlighted instead of reported, and filters
+        that are already shown or on their way are not queried again.
+        """
+        self.filter_after_id = None
+        invalid = False
+        for entry in (self.start_date_entry, self.end_date_entry):
+            text = entry.get().strip()
+            try:
+                if text:
+                    parse_date(text)
+                entry.config(fg=self.colors['text'])
+            except ValueError:
+                entry.config(fg=self.colors['danger'])
+                invalid = True
+        if invalid:
+            return
+        try:
+            filters = self.read_filters()
+        except ValueError:
+            # An inverted range; wait for the user to finish the other date
+            return
+        if filters == self.requested_filters:
+            return
+        self.reset_paging()
+        self.load_filters(filters)
+    
+    def show_page(self, page, on_loaded=None):
+        """Render a page fetched by ExpenseService.load_page"""
+        self.active_filters = page['filters']
+        self.sort = page['sort']
+        self.page_offset = page['offset']
+        self.page_after = page['after']
+        self.page_before = page['before']
+        self.has_previous = page['has_previous']
+        self.has_next = page['has_next']
+        self.total_rows = page['total_rows']
         
         # Clear treeview
-        for item in self.expenses_tree.get_children():
-            self.expenses_tree.delete(item)
+        with self.metrics.timer('ui.tree_clear'):
+            self.expenses_tree.delete(*self.expenses_tree.get_children())
+            self.visible_expenses = {}
         
         # Populate treeview
-        for expense in expenses:
-            self.expenses_tree.insert('', 'end', iid=expense['id'],
-                                     values=(expense['date'], expense['category'],
-                                            expense['description'], f"${expense['amount']:.2f}"))
+        with self.metrics.timer('ui.tree_insert'):
+            for expense in page['expenses']:
+                self.add_tree_row(expense)
         
         # Update summary
-        summary = self.db.get_expense_summary(self.current_user_id, start_date, end_date)
-        self.total_label.config(text=f"${summary['total']:.2f}")
-        self.count_label.config(text=str(summary['count']))
+        with self.metrics.timer('ui.summary_update'):
+            self.summary = page['summary']
+            self.update_summary_cards()
+            self.update_page_controls()
+        if self.refresh_started is not None and self.metrics.enabled:
+            # From the refresh being asked for to the page being on screen
+            self.metrics.record('ui.refresh', time.perf_counter() - self.refresh_started)
+        self.refresh_started = None
+        
+        self.page_memo.put(page)
+        self.refresh_analytics()
+        
+        if on_loaded:
+            on_loaded()
+    
+    def add_tree_row(self, expense, index='end'):
+        """Insert a single expense into the treeview"""
+        self.expenses_tree.insert('', index, iid=expense['id'],
+                                 values=(expense['date'], expense['category'],
+                                        expense['description'], format_cents(expense['amount'], '$')))
+        self.visible_expenses[str(expense['id'])] = expense
+    
+    def update_summary_cards(self):
+        """Render the summary cards from self.summary"""
+        self.total_label.config(text=format_cents(self.summary['total'], '$'))
+        self.count_label.config(text=str(self.summary['count']))
         
-        if summary['count'] > 0:
-            avg = summary['total'] / summary['count']
-            self.avg_label.config(text=f"${avg:.2f}")
+        avg = average(self.summary['total'], self.summary['count'])
+        self.avg_label.config(text=format_cents(avg, '$'))
+    
+    def refresh_analytics(self):
+        """Recompute the analytics cards for the active filters in the background"""
+        self.executor.submit(self.service.analytics, self.current_user_id, self.active_filters,
+                             key='analytics', on_success=self.update_analytics_cards,
+                             on_error=self.show_db_error)
+    
+    def update_analytics_cards(self, result):
+        """Render the analytics cards from an analytics.analyze() result"""
+        by_category = result['by_category']
+        if by_category:
+            category = max(by_category, key=by_category.get)
+            top_text = f"{category} {format_cents(by_category[category], '$', grouping=True)}"
         else:
-            self.avg_label.config(text="$0.00")
+            top_text = "–"
+        self.analytics_labels['top_category'].config(text=top_text)
+        
+        change = result['month_over_month']
+        self.analytics_labels['month_change'].config(
+            text="–" if change is None else f"{change:+.0%}")
+        
+        percentiles = result['percentiles']
+        self.analytics_labels['percentiles'].config(
+            text=f"{format_cents(percentiles[50], '$', grouping=True)} / "
+                 f"{format_cents(percentiles[90], '$', grouping=True)}"
+            if percentiles else "–")
+    
+    def apply_summary_delta(self, expense, sign):
+        """Add (sign=1) or remove (sign=-1) a listed expense from the summary cards"""
+        self.summary = apply_summary_delta(self.summary, expense, sign)
+        self.update_summary_cards()
+        self.refresh_analytics()
+    
+    def insert_expense_row(self, expense):
+        """Place a newly added expense in the current page without a full refresh"""
+        if not matches_filters(expense, self.active_filters):
+            return
+        self.apply_summary_delta(expense, 1)
+        self.total_rows += 1
+        
+        # Binary search for the position in the table's sort order
+        column, descending = self.sort
+        children = self.expenses_tree.get_children()
+        key = sort_key(expense, column)
+        lo, hi = 0, len(children)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row_key = sort_key(self.visible_expenses[children[mid]], column)
+            if (row_key > key) if descending else (row_key < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        
+        # Rows sorting before or after this page belong to the pages there, if any
+        belongs_to_earlier_page = lo == 0 and self.has_previous
+        belongs_to_later_page = lo == len(children) and self.has_next
+        if not (belongs_to_earlier_page or belongs_to_later_page):
+            self.add_tree_row(expense, lo)
+            self.expenses_tree.see(expense['id'])
+            # Keep the window at PAGE_SIZE rows
+            if len(children) + 1 > self.PAGE_SIZE:
+                if lo == len(children):
+                    # A full last page slides down a row to show the new one
+                    dropped = children[0]
+                    self.page_offset += 1
+                    self.has_previous = True
+                else:
+                    # The overflow moves to the next page
+                    dropped = children[-1]
+                    self.has_next = True
+                self.expenses_tree.delete(dropped)
+                del self.visible_expenses[dropped]
+        self.update_page_controls()
+    
+    def remove_expense_rows(self, expenses):
+        """Take deleted expenses out of the current page and the summary without a full refresh"""
+        listed = [expense for expense in expenses if matches_filters(expense, self.active_filters)]
+        if not listed:
+            return
+        visible = [str(expense['id']) for expense in listed
+                   if str(expense['id']) in self.visible_expenses]
+        if visible:
+            self.expenses_tree.delete(*visible)
+        for iid in visible:
+            del self.visible_expenses[iid]
+        for expense in listed:
+            self.summary = apply_summary_delta(self.summary, expense, -1)
+        self.update_summary_cards()
+        self.refresh_analytics()
+        self.total_rows -= len(listed)
+        
+        if not self.visible_expenses and self.total_rows:
+            # The page emptied out, fetch its replacement
+            self.refresh_data()
+        else:
+            self.update_page_controls()
+    
+    def update_page_controls(self):
+        """Update the page label and enable/disable the paging buttons"""
+        if self.total_rows:
+            first = self.page_offset + 1
+            last = min(self.page_offset + len(self.visible_expenses), self.total_rows)
+            self.page_label.config(text=f"Showing {first:,}–{last:,} of {self.total_rows:,}")
+        else:
+            self.page_label.config(text="No expenses")
+        
+        self.prev_page_btn.config(state=tk.NORMAL if self.has_previous else tk.DISABLED)
+        self.next_page_btn.config(state=tk.NORMAL if self.has_next else tk.DISABLED)
+    
+    def reset_paging(self):
+        """Go back to the first page, e.g. for new filters or a new order"""
+        self.page_offset = 0
+        self.page_after = None
+        self.page_before = None
+    
+    def prev_page(self):
+        """Show the page of expenses above the first visible row"""
+        children = self.expenses_tree.get_children()
+        if self.has_previous and children:
+            self.page_offset = max(self.page_offset - self.PAGE_SIZE, 0)
+            self.page_after = None
+            self.page_before = sort_key(self.visible_expenses[children[0]], self.sort[0])
+            self.refresh_data(on_loaded=self.scroll_to_bottom)
+    
+    def next_page(self):
+        """Show the page of expenses below the last visible row"""
+        children = self.expenses_tree.get_children()
+        if self.has_next and children:
+            self.page_offset += len(children)
+            self.page_after = sort_key(self.visible_expenses[children[-1]], self.sort[0])
+            self.page_before = None
+            self.refresh_data(on_loaded=lambda: self.expenses_tree.yview_moveto(0))
+    
+    def sort_by(self, heading):
+        """Sort the table by a heading's column, reversing the order on a second click"""
+        column, descending = self.SORT_HEADINGS[heading]
+        if self.sort[0] == column:
+            descending = not self.sort[1]
+        self.sort = (column, descending)
+        self.update_sort_headings()
+        self.reset_paging()
+        self.refresh_data(on_loaded=lambda: self.expenses_tree.yview_moveto(0))
+    
+    def update_sort_headings(self):
+        """Mark the sorted heading with an arrow pointing the way values run"""
+        for heading, (column, _) in self.SORT_HEADINGS.items():
+            text = heading
+            if column == self.sort[0]:
+                text += ' ▼' if self.sort[1] else ' ▲'
+            self.expenses_tree.heading(heading, text=text)
+    
+    def scroll_to_bottom(self):
+        """Scroll the table to its last row"""
+        children = self.expenses_tree.get_children()
+        if children:
+            self.expenses_tree.see(children[-1])
+    
+    def on_tree_scroll(self, event):
+        """Turn the page when the user scrolls past the end of the visible window"""
+        if self.executor.is_pending('refresh'):
+            return
+        scrolling_down = event.num == 5 or event.delta < 0
+        top, bottom = self.expenses_tree.yview()
+        if scrolling_down and bottom >= 1.0:
+            self.next_page()
+        elif not scrolling_down and top <= 0.0:
+            self.prev_page()
+    
+    def apply_filters(self):
+        """Apply the current filters starting from the first page"""
+        self.reset_paging()
+        self.refresh_data()
     
     def clear_filters(self):
         """Clear all filters"""
         self.filter_category_var.set('All')
-        self.start_date_entry.delete(0, tk.END)
-        self.end_date_entry.delete(0, tk.END)
-        self.refresh_data()
+        self.search_entry.delete(0, tk.END)
+        for entry in (self.start_date_entry, self.end_date_entry):
+            entry.delete(0, tk.END)
+            entry.config(fg=self.colors['text'])
+        self.apply_filters()
+    
+    def select_all_rows(self, event=None):
+        """Select every row of the visible page"""
+        children = self.expenses_tree.get_children()
+        if children:
+            self.expenses_tree.selection_set(*children)
+        return 'break'
     
     def delete_selected_expense(self, event=None):
-        """Delete selected expense"""
+        """Delete the selected expenses as one batch that can be undone"""
         selected = self.expenses_tree.selection()
         if not selected:
             messagebox.showwarning("Warning", "Please select an expense to delete")
             return
         
-        expense_id = int(selected[0])
+        expense_ids = [int(iid) for iid in selected]
+        question = ("Are you sure you want to delete this expense?" if len(expense_ids) == 1
+                    else f"Are you sure you want to delete {len(expense_ids):,} expenses?")
+        if messagebox.askyesno("Confirm", question):
+            self.executor.submit(self.service.delete_expenses, self.current_user_id, expense_ids,
+                                 on_success=self.on_expenses_deleted,
+                                 on_error=self.show_db_error)
+    
+    def delete_matching_expenses(self):
+        """Delete every expense matching the active filters, on all pages"""
+        if not self.total_rows:
+            return
+        if messagebox.askyesno("Confirm", f"Delete all {self.total_rows:,} expenses matching "
+                                          f"the current filters?"):
+            self.executor.submit(self.service.delete_matching, self.current_user_id,
+                                 self.active_filters, on_success=self.on_expenses_deleted,
+                                 on_error=self.show_db_error)
+    
+    def on_expenses_deleted(self, result):
+        """Handle the result of a delete_expenses query"""
+        deleted = result['expenses']
+        if not deleted:
+            messagebox.showerror("Error", "Failed to delete expense")
+            return
+        self.page_memo.clear()
+        self.undo_batches.append(result['batch_id'])
+        self.update_undo_button(f"Deleted {len(deleted):,} "
+                                f"{'expense' if len(deleted) == 1 else 'expenses'}")
+        if self.executor.is_pending('refresh') or len(deleted) > self.PAGE_SIZE:
+            self.refresh_data()
+        else:
+            self.remove_expense_rows(deleted)
+    
+    def undo_delete(self, event=None):
+        """Restore the most recent batch deleted in this session"""
+        if not self.undo_batches:
+            return
+        batch_id = self.undo_batches.pop()
+        self.update_undo_button()
+        self.executor.submit(self.service.undo_delete, self.current_user_id, batch_id,
+                             on_success=self.on_expenses_restored, on_error=self.show_db_error)
+    
+    def on_expenses_restored(self, restored):
+        """Put restored expenses back into the visible page"""
+        self.page_memo.clear()
+        self.update_undo_button(f"Restored {len(restored):,} "
+                                f"{'expense' if len(restored) == 1 else 'expenses'}")
+        if self.executor.is_pending('refresh') or len(restored) > self.PAGE_SIZE:
+            self.refresh_data()
+        else:
+            for expense in restored:
+                self.insert_expense_row(expense)
+    
+    def update_undo_button(self, status=None):
+        """Enable the undo button while there is a batch to restore"""
+        self.undo_btn.config(state=tk.NORMAL if self.undo_batches else tk.DISABLED)
+        if status is not None:
+            self.delete_status_label.config(text=status)
+    
+    def import_expenses(self):
+        """Bulk import expenses from a CSV or JSON file"""
+        path = filedialog.askopenfilename(
+            title="Import expenses",
+            filetypes=[("Expense files", "*.csv *.json *.jsonl *.ndjson"), ("All files", "*.*")])
+        if not path:
+            return
+        
+        self.import_btn.config(state=tk.DISABLED, text="Importing...")
+        self.executor.submit(self.service.import_file, self.current_user_id, path,
+                             key='import', on_success=self.on_import_finished,
+                             on_error=self.on_import_failed)
+    
+    def on_import_finished(self, report):
+        """Show the import report and reload the table"""
+        self.page_memo.clear()
+        self.import_btn.config(state=tk.NORMAL, text="Import...")
+        message = str(report)
+        if report.errors:
+            shown = '\n'.join(f"Row {row}: {error}" for row, error in report.errors[:10])
+            message += f"\n\nRejected rows:\n{shown}"
+        messagebox.showinfo("Import", message)
+        self.refresh_data()
+    
+    def on_import_failed(self, error):
+        """Report an import that could not be completed"""
+        # Chunks committed before the failure are in the database
+        self.page_memo.clear()
+        self.import_btn.config(state=tk.NORMAL, text="Import...")
+        messagebox.showerror("Import", f"Import failed: {error}")
+    
+    def export_expenses(self):
+        """Export the expenses matching the active filters"""
+        path = filedialog.asksaveasfilename(
+            title="Export expenses", defaultextension='.csv',
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Parquet", "*.parquet")])
+        if not path:
+            return
         
-        if messagebox.askyesno("Confirm", "Are you sure you want to delete this expense?"):
-            if self.db.delete_expense(expense_id, self.current_user_id):
-                messagebox.showinfo("Success", "Expense deleted successfully")
-                self.refresh_data()
-            else:
-                messagebox.showerror("Error", "Failed to delete expense")
+        self.export_btn.config(state=tk.DISABLED, text="Exporting...")
+        self.executor.submit(self.service.export_file, self.current_user_id, path,
+                             self.active_filters, key='export', on_success=self.on_export_finished,
+                             on_error=self.on_export_failed)
+    
+    def on_export_finished(self, report):
+        """Report a completed export"""
+        self.export_btn.config(state=tk.NORMAL, text="Export...")
+        messagebox.showinfo("Export", str(report))
+    
+    def on_export_failed(self, error):
+        """Report an export that could not be completed"""
+        self.export_btn.config(state=tk.NORMAL, text="Export...")
+        messagebox.showerror("Export", f"Export failed: {error}")
+    
+    def toggle_metrics(self, event=None):
+        """Turn timing on or off, showing it in the dashboard overlay while on (F12)"""
+        if self.metrics.toggle():
+            if self.current_user_id is not None:
+                self.show_overlay()
+        else:
+            self.hide_overlay()
+    
+    def show_overlay(self):
+        """Pin the debug overlay to the bottom right corner of the dashboard"""
+        if self.overlay is not None:
+            return
+        self.overlay = tk.Label(self.root, font=('Consolas', 9), justify=tk.LEFT,
+                                bg='#000000', fg='#00ff88', padx=8, pady=6)
+        self.overlay.place(relx=1.0, rely=1.0, x=-10, y=-10, anchor='se')
+        self.update_overlay()
+    
+    def hide_overlay(self):
+        if self.overlay_after_id is not None:
+            self.root.after_cancel(self.overlay_after_id)
+            self.overlay_after_id = None
+        if self.overlay is not None:
+            self.overlay.destroy()
+            self.overlay = None
+    
+    def update_overlay(self):
+        """Redraw the overlay: the metrics with the most time spent, then cache and pool counters"""
+        snapshot = self.metrics.snapshot()
+        busiest = sorted(snapshot, key=lambda name: snapshot[name]['total'],
+                         reverse=True)[:self.OVERLAY_ROWS]
+        text = f"{self.metrics.report(busiest)}\n\n"
+        if self.cache is not None:
+            queries = self.cache.stats()
+            ledgers = self.cache.db.stats()
+            pool = self.db.pool.stats()
+            text += (f"query cache {queries['hit_rate']:.0%} hits, {queries['entries']} entries   "
+                     f"ledger cache {ledgers['hit_rate']:.0%} hits, {ledgers['rows']:,} rows\n"
+                     f"pool {pool['in_use']}/{pool['size']} in use, {pool['waits']} waits   ")
+        else:
+            text += f"server {self.service.host}:{self.service.port}   "
+        self.overlay.config(text=text + "F12 hide  F11 profile")
+        self.overlay.lift()
+        self.overlay_after_id = self.root.after(self.OVERLAY_INTERVAL_MS, self.update_overlay)
+    
+    def toggle_profile(self, event=None):
+        """Start a cProfile capture, or stop the running one and save it (F11)"""
+        if not self.profiler.active:
+            self.profiler.start()
+            self.root.title("Expense Tracker [profiling, F11 to stop]")
+            return
+        self.root.title("Expense Tracker")
+        path = os.path.abspath(datetime.now().strftime(self.PROFILE_FILE))
+        try:
+            self.profiler.stop(path)
+        except OSError as e:
+            messagebox.showerror("Profile", f"Could not save the profile: {e}")
+            return
+        messagebox.showinfo("Profile", f"Profile saved to {path}\n\n"
+                                       f"Inspect it with: python -m pstats {path}")
+    
+    def show_db_error(self, error):
+        """Report a failed background database call"""
+        if isinstance(error, ValueError):
+            # Validation and throttling messages are meant for the user as-is
+            messagebox.showerror("Error", str(error))
+        else:
+            messagebox.showerror("Error", f"Database error: {error}")
+    
+    def on_close(self):
+        """Stop the worker threads and close the window"""
+        self.executor.shutdown()
+        if self.db is not None:
+            self.db.close()
+        else:
+            self.service.close()
+        self.root.destroy()
     
     def logout(self):
         """Logout user"""
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
+            self.executor.cancel_all()
+            if self.db is None:
+                # Best effort: an unreachable server lets the session expire on its own
+                self.executor.submit(self.service.logout, self.current_user_id,
+                                     on_error=lambda error: None)
+            self.cancel_live_filter()
+            self.requested_filters = None
+            self.page_memo.clear()
+            self.undo_batches.clear()
             self.current_user_id = None
             self.current_user = None
             self.show_login()
 
 def main():
     root = tk.Tk()
-    app = ModernExpenseTracker(root)
+    # EXPENSES_SERVER=http://host:port runs against an expense server instead of a local file
+    app = ModernExpenseTracker(root, server=os.environ.get('EXPENSES_SERVER'))
     root.mainloop()
 
 if __name__ == "__main__":
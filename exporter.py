@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+import time
+
+from money import format_cents, to_decimal
+
+COLUMNS = ('id', 'date', 'category', 'description', 'amount')
+
+# Rows buffered per Parquet row group
+ROW_GROUP_SIZE = 50000
+
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.parquet': 'parquet',
+}
+
+
+class ExportReport:
+    """Outcome and throughput of an export"""
+
+    def __init__(self, path, rows, seconds):
+        self.path = path
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"Exported {self.rows:,} expenses to {self.path} "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:,.0f} rows/s)")
+
+
+def write_csv(expenses, f):
+    """Stream expenses to a text file as CSV. Returns the row count"""
+    writer = csv.writer(f)
+    writer.writerow(COLUMNS)
+    count = 0
+    for expense in expenses:
+        writer.writerow([expense['id'], expense['date'], expense['category'],
+                         expense['description'], format_cents(expense['amount'])])
+        count += 1
+    return count
+
+
+def write_jsonl(expenses, f):
+    """Stream expenses to a text file as JSON Lines. Returns the row count"""
+    count = 0
+    for expense in expenses:
+        row = {column: expense[column] for column in COLUMNS}
+        # cents / 100 prints as the shortest decimal that round-trips, e.g. 12.5
+        row['amount'] /= 100
+        f.write(json.dumps(row))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def write_parquet(expenses, path, row_group_size=ROW_GROUP_SIZE):
+    """Stream expenses to a Parquet file one row group at a time. Requires pyarrow"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires the pyarrow package") from None
+
+    schema = pa.schema([('id', pa.int64()), ('date', pa.string()), ('category', pa.string()),
+                        ('description', pa.string()), ('amount', pa.decimal128(18, 2))])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        columns = {column: [] for column in COLUMNS}
+        for expense in expenses:
+            for column in ('id', 'date', 'category', 'description'):
+                columns[column].append(expense[column])
+            columns['amount'].append(to_decimal(expense['amount']))
+            count += 1
+            if count % row_group_size == 0:
+                writer.write_table(pa.table(columns, schema=schema))
+                columns = {column: [] for column in COLUMNS}
+        if columns['id'] or count == 0:
+            writer.write_table(pa.table(columns, schema=schema))
+    return count
+
+
+def export_expenses(expenses, path, fmt=None):
+    """Write an iterable of expenses to path.
+
+    The format is taken from fmt ('csv', 'jsonl' or 'parquet') or the file
+    extension. Rows are written as they arrive and only swapped into place
+    once the export is complete.
+    """
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in FORMATS.values():
+        raise ValueError(f"Unsupported export format: {fmt or path}")
+
+    started = time.perf_counter()
+    partial = path + '.partial'
+    try:
+        if fmt == 'parquet':
+            rows = write_parquet(expenses, partial)
+        else:
+            with open(partial, 'w', newline='', encoding='utf-8') as f:
+                rows = write_csv(expenses, f) if fmt == 'csv' else write_jsonl(expenses, f)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return ExportReport(path, rows, time.perf_counter() - started)
+
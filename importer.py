@@ -0,0 +1,227 @@
+import csv
+import json
+import os
+import re
+import time
+
+from validation import parse_amount, parse_category, parse_date, clean_description
+
+# Rows inserted per transaction
+CHUNK_SIZE = 5000
+
+# Rejected rows kept in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Characters of a JSON array element read before giving up on it as malformed
+MAX_RECORD_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class ImportReport:
+    """Outcome and throughput of a bulk import"""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def reject(self, row_number, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def __str__(self):
+        return (f"Imported {self.imported:,} expenses ({self.rejected:,} rejected) "
+                f"in {self.seconds:.2f}s ({self.rows_per_second:,.0f} rows/s)")
+
+
+def read_csv(path):
+    """Yield one dict per CSV row, with lower-cased column names"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames:
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        yield from reader
+
+
+class MalformedRecord:
+    """Stands in for a JSON element or line that could not be read, so it is rejected"""
+
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+
+
+def _element_end(text, start=0, state=(0, False, False)):
+    """Find the ',' or ']' after the array element starting at text[start].
+
+    Returns its position, or None and the (depth, in_string, escaped) state
+    to carry on scanning with the text that follows.
+    """
+    depth, in_string, escaped = state
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in ',]' and depth <= 0:
+            return pos, None
+        elif char in '}]':
+            depth -= 1
+    return None, (depth, in_string, escaped)
+
+
+def read_json(path, buffer_size=1 << 16, max_record_size=MAX_RECORD_SIZE):
+    """Yield the objects of a JSON array or JSON Lines file without loading it whole.
+
+    A line or array element that isn't valid JSON, or an element longer than
+    max_record_size characters, is yielded as a MalformedRecord with its line
+    number and reading carries on after it.
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        text = f.read(buffer_size)
+        if not text.lstrip().startswith('['):
+            # JSON Lines: one object per line
+            f.seek(0)
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield MalformedRecord(line_number, f"Invalid JSON ({exc.msg})")
+                    continue
+                yield record
+            return
+
+        # A single top-level array, decoded one element at a time. line_number
+        # is the line buffer starts on
+        decoder = json.JSONDecoder()
+        start = text.index('[')
+        line_number = 1 + text.count('\n', 0, start)
+        buffer, pos, eof = text[start + 1:], 0, False
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                line_number += buffer.count('\n')
+                if eof:
+                    yield MalformedRecord(line_number, "Truncated JSON array")
+                    return
+                buffer, pos = f.read(buffer_size), 0
+                eof = not buffer
+                continue
+            if buffer[pos] == ',':
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                end, state = _element_end(buffer, pos)
+                if end is None and not eof and len(buffer) - pos < max_record_size:
+                    # The element runs on past the buffer
+                    chunk = f.read(buffer_size)
+                    eof = not chunk
+                    line_number += buffer.count('\n', 0, pos)
+                    buffer, pos = buffer[pos:] + chunk, 0
+                    continue
+                line = line_number + buffer.count('\n', 0, pos)
+                if end is not None:
+                    yield MalformedRecord(line, f"Invalid JSON ({exc.msg})")
+                elif eof:
+                    yield MalformedRecord(line, "Truncated JSON array")
+                    return
+                else:
+                    yield MalformedRecord(
+                        line, f"JSON element longer than {max_record_size:,} characters")
+                # Drop the element, reading on past it if it is oversized
+                while end is None:
+                    line_number += buffer.count('\n')
+                    buffer = f.read(buffer_size)
+                    if not buffer:
+                        return
+                    end, state = _element_end(buffer, 0, state)
+                pos = end
+                continue
+            yield record
+            if len(buffer) - pos < buffer_size // 2 and not eof:
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                line_number += buffer.count('\n', 0, pos)
+                buffer, pos = buffer[pos:] + chunk, 0
+
+
+def read_records(path):
+    """Pick a reader from the file extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return read_csv(path)
+    if extension in ('.json', '.jsonl', '.ndjson'):
+        return read_json(path)
+    raise ValueError(f"Unsupported file type: {extension or path}")
+
+
+def validate_record(record):
+    """Turn a raw record into an (amount, category, description, date) tuple"""
+    if isinstance(record, MalformedRecord):
+        raise ValueError(f"Line {record.line}: {record.message}")
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object with amount, category, description and date")
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    return (parse_amount(record.get('amount')),
+            parse_category(record.get('category') or 'Other'),
+            clean_description(record.get('description')),
+            parse_date(record.get('date')))
+
+
+def import_records(db, user_id, records, chunk_size=CHUNK_SIZE, on_progress=None):
+    """Validate records and insert them in batches of chunk_size.
+
+    Each chunk is written with Database.add_expenses in one transaction.
+    on_progress, if given, is called with the report after every chunk.
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+    chunk = []
+    for row_number, record in enumerate(records, start=1):
+        try:
+            chunk.append(validate_record(record))
+        except ValueError as exc:
+            report.reject(row_number, str(exc))
+            continue
+        if len(chunk) >= chunk_size:
+            report.imported += db.add_expenses(user_id, chunk)
+            report.chunks += 1
+            chunk = []
+            report.seconds = time.perf_counter() - started
+            if on_progress:
+                on_progress(report)
+    if chunk:
+        report.imported += db.add_expenses(user_id, chunk)
+        report.chunks += 1
+    report.seconds = time.perf_counter() - started
+    if on_progress:
+        on_progress(report)
+    return report
+
+
+def import_file(db, user_id, path, chunk_size=CHUNK_SIZE, on_progress=None):
+    """Import a CSV, JSON or JSON Lines file of expenses for a user"""
+    return import_records(db, user_id, read_records(path), chunk_size, on_progress)
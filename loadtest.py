@@ -0,0 +1,265 @@
+"""Load test for server.py: many concurrent keep-alive clients on localhost.
+
+Usage: python loadtest.py [--url http://127.0.0.1:8765] [--clients 1000]
+                          [--users 20] [--rows 2000] [--duration 10]
+
+Without --url it starts server.py on a temporary database with rate limits
+off and stops it afterwards. Every client holds one keep-alive connection and
+loops over a mix of operations for --duration seconds: paging and summaries
+mostly, plus adds, deletes of what it added, and batched requests. Clients
+share --users accounts, each seeded with --rows expenses. Reports throughput,
+latency percentiles per operation and any non-2xx responses; exits 1 if there
+were errors.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from metrics import Histogram
+from server import raise_file_limit
+from service import sort_key
+
+LOADTEST_PASSWORD = 'loadtest-password'
+CATEGORIES = ['Food', 'Transport', 'Shopping', 'Bills', 'Entertainment']
+# Relative frequency of each operation a client picks
+OPERATIONS = {'list': 45, 'list_next': 10, 'summary': 20, 'add': 10, 'delete': 5, 'batch': 10}
+# Seconds to wait for a spawned server to start listening
+STARTUP_TIMEOUT = 30
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection speaking JSON"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None, token=None, query=None):
+        """Send a request and return (status, decoded body), reconnecting if the server closed"""
+        if query:
+            path = f'{path}?{urlencode(query)}'
+        data = json.dumps(body).encode() if body is not None else b''
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host}',
+                f'Content-Length: {len(data)}']
+        if token:
+            head.append(f'Authorization: Bearer {token}')
+        message = ('\r\n'.join(head) + '\r\n\r\n').encode() + data
+        for attempt in (1, 2):
+            if self.writer is None:
+                await self.connect()
+            try:
+                self.writer.write(message)
+                await self.writer.drain()
+                status_line, _, header_block = (await self.reader.readuntil(b'\r\n\r\n')) \
+                    .decode('latin-1').partition('\r\n')
+                headers = dict(line.lower().split(': ', 1)
+                               for line in header_block.split('\r\n') if line)
+                payload = await self.reader.readexactly(int(headers.get('content-length', 0)))
+                if headers.get('connection') == 'close':
+                    await self.close()
+                return int(status_line.split(' ')[1]), json.loads(payload) if payload else None
+            except (asyncio.IncompleteReadError, ConnectionError):
+                await self.close()
+                if attempt == 2:
+                    raise
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.reader = self.writer = None
+
+
+def random_expense(rng):
+    return [rng.randint(100, 20000), rng.choice(CATEGORIES), f"load test {rng.randint(0, 999)}",
+            f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"]
+
+
+async def set_up_users(host, port, users, rows, seed):
+    """Register (if needed), log in and seed each test user. Returns their tokens"""
+    client = Client(host, port)
+    rng = random.Random(seed)
+    tokens = []
+    try:
+        for index in range(users):
+            credentials = {'username': f'loadtest-{index}', 'password': LOADTEST_PASSWORD}
+            status, body = await client.request('POST', '/register', credentials)
+            created = status == 201
+            if not created and status != 409:
+                raise RuntimeError(f"Could not register a test user: {status} {body}")
+            status, body = await client.request('POST', '/login', credentials)
+            if status != 200:
+                raise RuntimeError(f"Could not log in a test user: {status} {body}")
+            token = body['token']
+            tokens.append(token)
+            if created:
+                for start in range(0, rows, 5000):
+                    batch = [random_expense(rng) for _ in range(min(5000, rows - start))]
+                    status, body = await client.request('POST', '/expenses/bulk',
+                                                        {'expenses': batch}, token)
+                    if status != 200:
+                        raise RuntimeError(f"Could not seed a test user: {status} {body}")
+    finally:
+        await client.close()
+    return tokens
+
+
+async def run_client(host, port, token, deadline, seed, histograms, statuses):
+    """Issue a random mix of requests until the deadline"""
+    rng = random.Random(seed)
+    client = Client(host, port)
+    names, weights = list(OPERATIONS), list(OPERATIONS.values())
+    added = []
+    after = None
+    try:
+        while time.monotonic() < deadline:
+            operation = rng.choices(names, weights)[0]
+            category = rng.choice(CATEGORIES + [None, None])
+            query = {'category': category} if category else {}
+            if operation == 'list_next' and after is not None:
+                args = ('GET', '/expenses', None, token,
+                        dict(query, after=json.dumps(after), limit=50))
+            elif operation in ('list', 'list_next'):
+                operation = 'list'
+                args = ('GET', '/expenses', None, token, dict(query, limit=50))
+            elif operation == 'summary':
+                args = ('GET', '/summary', None, token, query)
+            elif operation == 'add':
+                expense = random_expense(rng)
+                args = ('POST', '/expenses', dict(zip(('amount', 'category', 'description',
+                                                       'date'), expense)), token, None)
+            elif operation == 'delete' and added:
+                args = ('POST', '/expenses/delete', {'ids': [added.pop()]}, token, None)
+            else:
+                operation = 'batch'
+                args = ('POST', '/batch', {'requests': [
+                    {'method': 'GET', 'path': '/expenses', 'query': dict(query, limit=20)},
+                    {'method': 'GET', 'path': '/summary', 'query': query}]}, token, None)
+            started = time.perf_counter()
+            try:
+                status, body = await client.request(*args)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                statuses[(operation, type(e).__name__)] += 1
+                await asyncio.sleep(0.1)
+                continue
+            histograms.setdefault(operation, Histogram()).record(time.perf_counter() - started)
+            statuses[(operation, status)] += 1
+            if status == 201 and operation == 'add':
+                added.append(body['id'])
+            elif status == 200 and operation == 'list':
+                expenses = body['expenses']
+                after = list(sort_key(expenses[-1], 'date')) if body['has_next'] else None
+    finally:
+        # Leave the seeded ledgers as they were
+        if added:
+            try:
+                await client.request('POST', '/expenses/delete', {'ids': added}, token)
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+        await client.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(db_path, port):
+    """Start server.py on db_path without rate limits and wait until it listens"""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+         '--db', db_path, '--port', str(port), '--rate', '0', '--login-rate', '0'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server.py exited with status {server.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server.py did not start listening in time")
+
+
+async def load_test(host, port, args):
+    tokens = await set_up_users(host, port, args.users, args.rows, args.seed)
+    histograms, statuses = {}, Counter()
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(run_client(host, port, tokens[index % len(tokens)], deadline,
+                                      args.seed + index, histograms, statuses)
+                           for index in range(args.clients)))
+    return histograms, statuses, time.monotonic() - started
+
+
+def print_report(histograms, statuses, elapsed, clients):
+    total = sum(statuses.values())
+    print(f"{total:,} requests from {clients:,} clients in {elapsed:.1f}s: "
+          f"{total / elapsed:,.0f} requests/s")
+    print(f"{'operation':<10} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in sorted(histograms):
+        stats = histograms[name].snapshot()
+        print(f"{name:<10} {stats['count']:>8,} "
+              + ' '.join(f"{stats[key] * 1000:>9.1f}" for key in ('p50', 'p95', 'p99', 'max')))
+    errors = {key: count for key, count in statuses.items()
+              if not (isinstance(key[1], int) and 200 <= key[1] < 300)}
+    for (operation, status), count in sorted(errors.items(), key=str):
+        print(f"  {operation}: {count:,} x {status}")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='loadtest.py', description="Load test server.py")
+    parser.add_argument('--url', help="server to test (default: start one on a temporary database)")
+    parser.add_argument('--clients', type=int, default=1000,
+                        help="concurrent connections (default: 1000)")
+    parser.add_argument('--users', type=int, default=20,
+                        help="accounts the clients share (default: 20)")
+    parser.add_argument('--rows', type=int, default=2000,
+                        help="expenses seeded per new account (default: 2000)")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds of load (default: 10)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    raise_file_limit()
+    server = None
+    with tempfile.TemporaryDirectory(prefix='expense-loadtest-') as tmp:
+        if args.url:
+            parts = urlsplit(args.url if '//' in args.url else f'http://{args.url}')
+            host, port = parts.hostname, parts.port or 80
+        else:
+            host, port = '127.0.0.1', free_port()
+            print(f"Starting server.py on port {port}...")
+            server = spawn_server(os.path.join(tmp, 'loadtest.db'), port)
+        try:
+            histograms, statuses, elapsed = asyncio.run(load_test(host, port, args))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    errors = print_report(histograms, statuses, elapsed, args.clients)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
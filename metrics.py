@@ -0,0 +1,283 @@
+"""Timing histograms for the hot paths of the app and the CLI.
+
+A MetricsRegistry is off by default. While it is off, timer() hands out a
+shared no-op context manager and instrumented objects carry no wrappers at
+all, so the only cost is one attribute check per timed UI phase. Turning it
+on installs a timing wrapper over each public method of every object passed
+to instrument(), as an instance attribute that shadows the method; turning it
+off deletes them again.
+
+Durations go into histograms with fixed log-spaced buckets: recording is a
+bisect and a few additions, memory stays constant however many calls are
+timed, and percentiles are accurate to a bucket (about 19%).
+
+Profiler captures a cProfile of the main thread together with the jobs
+QueryExecutor runs on its workers while it is active.
+"""
+import bisect
+import cProfile
+import inspect
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+
+# Bucket upper bounds in seconds: 1µs to about 4.6 minutes, four per doubling
+BUCKET_BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(113)]
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """Distribution of durations in BUCKET_BOUNDS buckets"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Duration below which q percent of the recorded ones fall, or None if empty.
+
+        Reports the upper bound of the bucket the percentile lands in, kept
+        within the smallest and largest duration seen.
+        """
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        """Count, total and mean, min/max and p50/p95/p99, all in seconds"""
+        return {'count': self.count, 'total': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min, 'max': self.max, 'p50': self.percentile(50),
+                'p95': self.percentile(95), 'p99': self.percentile(99)}
+
+
+class _Timer:
+    """Context manager recording the duration of a with block"""
+
+    __slots__ = ('registry', 'name', 'started')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.record(self.name, time.perf_counter() - self.started)
+
+
+class MetricsRegistry:
+    """Named histograms of durations, collected only while enabled.
+
+    Safe to use from worker threads; the app and its background queries share
+    one registry.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = False
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # (object, name prefix, method names) for everything instrument() was given
+        self._targets = []
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        """Start collecting, wrapping the methods of instrumented objects"""
+        if not self.enabled:
+            self.enabled = True
+            for target in self._targets:
+                self._install(*target)
+
+    def disable(self):
+        """Stop collecting and remove every wrapper; the histograms are kept"""
+        if self.enabled:
+            self.enabled = False
+            for obj, _prefix, names in self._targets:
+                for name in names:
+                    obj.__dict__.pop(name, None)
+
+    def toggle(self):
+        """Flip collection on or off. Returns whether it is now on"""
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+    def instrument(self, obj, prefix, names=None):
+        """Time calls to obj's public methods (or just names) as prefix + method name.
+
+        The wrappers are installed on the instance only while the registry is
+        enabled, so nothing changes for callers while it is off. Generator
+        methods are timed across their whole iteration, excluding the time the
+        consumer spends between items.
+        """
+        if names is None:
+            names = [name for name, _ in inspect.getmembers(type(obj), callable)
+                     if not name.startswith('_')]
+        target = (obj, prefix, tuple(names))
+        self._targets.append(target)
+        if self.enabled:
+            self._install(*target)
+
+    def _install(self, obj, prefix, names):
+        for name in names:
+            method = getattr(obj, name)
+            if inspect.isgeneratorfunction(method):
+                wrapper = self._timed_generator(method, prefix + name)
+            else:
+                wrapper = self._timed(method, prefix + name)
+            setattr(obj, name, wrapper)
+
+    def _timed(self, method, name):
+        record = self.record
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - started)
+        timed.__wrapped__ = method
+        return timed
+
+    def _timed_generator(self, method, name):
+        record = self.record
+
+        def timed(*args, **kwargs):
+            elapsed = 0.0
+            iterator = method(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    yield item
+            finally:
+                iterator.close()
+                record(name, elapsed)
+        timed.__wrapped__ = method
+        return timed
+
+    def timer(self, name):
+        """Context manager timing a with block as name; a no-op while disabled"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        """Add one duration to the histogram called name"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self._histograms = {}
+
+    def snapshot(self):
+        """{name: Histogram.snapshot()} for every histogram, by name"""
+        with self._lock:
+            return {name: self._histograms[name].snapshot()
+                    for name in sorted(self._histograms)}
+
+    def report(self, names=None):
+        """The histograms as a plain text table, times in milliseconds"""
+        lines = [f"{'metric (ms)':<36} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"]
+        for name, stats in self.snapshot().items():
+            if names is not None and name not in names:
+                continue
+            lines.append(f"{name:<36} {stats['count']:>7} "
+                         + ' '.join(f"{stats[key] * 1000:>9.2f}"
+                                    for key in ('p50', 'p95', 'p99', 'max')))
+        return '\n'.join(lines)
+
+
+class Profiler:
+    """cProfile capture of the main thread plus the work run through run().
+
+    cProfile only sees the thread that enabled it, so QueryExecutor passes its
+    jobs through run(), which profiles each one on its own worker while a
+    capture is active. stop() merges them all into one profile file.
+    """
+
+    def __init__(self):
+        self._main = None
+        self._jobs = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._main is not None
+
+    def start(self):
+        """Begin a capture on the calling thread"""
+        if self._main is None:
+            self._jobs = []
+            self._main = cProfile.Profile()
+            self._main.enable()
+
+    def run(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs), profiling it if a capture is active"""
+        if self._main is None:
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 one profiler sees every thread and a second
+            # cannot be enabled; the main thread's captures this job already
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self._jobs.append(profile)
+
+    def stop(self, path):
+        """End the capture and write it to path for pstats or snakeviz. Returns path"""
+        main, self._main = self._main, None
+        if main is None:
+            raise RuntimeError("No profile capture is running")
+        main.disable()
+        with self._lock:
+            jobs, self._jobs = self._jobs, []
+        stats = pstats.Stats(main)
+        for profile in jobs:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return path
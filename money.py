@@ -0,0 +1,67 @@
+"""Money as integer cents.
+
+Amounts are stored in the database, held in the cache, summed and compared as
+plain ints counting cents, so totals over any number of rows are exact and
+never pay for float rounding or Decimal objects. Conversion to and from
+decimal text happens only at the edges: form and file input go through
+parse_cents, display and text exports through format_cents.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+# Largest accepted single amount, $10 trillion. Keeps sums of many expenses
+# well inside SQLite's signed 64-bit integers.
+MAX_CENTS = 10 ** 15
+
+# Plain amounts like '12', '12.5' or '12.50', parsed without building a Decimal
+_SIMPLE_AMOUNT = re.compile(r'\s*(\d{1,13})(?:\.(\d{1,2}))?\s*')
+
+
+def parse_cents(value):
+    """Parse an amount such as '12.5', 12.5 or 12 into cents (1250, 1250, 1200).
+
+    More than two decimal places is an error rather than being rounded away.
+    Raises ValueError with a user-facing message.
+    """
+    if isinstance(value, str):
+        match = _SIMPLE_AMOUNT.fullmatch(value)
+        if match:
+            whole, fraction = match.groups()
+            return int(whole) * 100 + (int(fraction.ljust(2, '0')) if fraction else 0)
+    elif isinstance(value, float):
+        # repr gives the shortest text that round-trips, e.g. 0.1 -> '0.1'
+        value = repr(value)
+    try:
+        cents = Decimal(str(value).strip()).scaleb(2)
+    except (InvalidOperation, TypeError):
+        raise ValueError("Please enter a valid amount") from None
+    if not cents.is_finite():
+        raise ValueError("Please enter a valid amount")
+    if abs(cents) > MAX_CENTS:
+        raise ValueError("Amount is too large")
+    if cents != cents.to_integral_value():
+        raise ValueError("Amounts can have at most two decimal places")
+    return int(cents)
+
+
+def format_cents(cents, symbol='', grouping=False):
+    """Render cents as decimal text: format_cents(-123456, '$', True) == '-$1,234.56'"""
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    whole = f'{whole:,}' if grouping else str(whole)
+    return f'{sign}{symbol}{whole}.{fraction:02d}'
+
+
+def divide(cents, count):
+    """cents / count rounded to the nearest cent, ties to even; 0 for no items"""
+    if not count:
+        return 0
+    quotient, remainder = divmod(cents, count)
+    if 2 * remainder > count or (2 * remainder == count and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def to_decimal(cents):
+    """Exact Decimal value of an amount in cents, e.g. for Parquet decimal columns"""
+    return Decimal(cents).scaleb(-2)
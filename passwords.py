@@ -0,0 +1,244 @@
+"""Password hashing with a tunable work factor, and a login throttle.
+
+Hashes are stored as self-describing strings so the parameters can be raised
+later without invalidating existing accounts:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+Unsalted SHA-256 hex digests written by older versions are still accepted and
+are replaced by the current scheme on the next successful login.
+"""
+import base64
+import hashlib
+import heapq
+import hmac
+import os
+import threading
+import time
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+HAS_SCRYPT = hasattr(hashlib, 'scrypt')
+
+# Defaults aim for roughly 50ms per hash on a typical desktop; use calibrate()
+# to pick parameters for a specific host.
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+DEFAULT_PBKDF2_ITERATIONS = 200000
+
+# Relative strength of the schemes; unsalted SHA-256 and unknown ones rank 0
+ALGORITHM_RANK = {'pbkdf2_sha256': 1, 'scrypt': 2}
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """Hash and verify passwords with scrypt or PBKDF2-SHA256.
+
+    max_concurrent bounds how many hashes may be computed at once, so a burst
+    of login attempts queues up instead of saturating every core.
+    """
+
+    def __init__(self, algorithm=None, n=DEFAULT_SCRYPT_N, r=DEFAULT_SCRYPT_R,
+                 p=DEFAULT_SCRYPT_P, iterations=DEFAULT_PBKDF2_ITERATIONS, max_concurrent=2):
+        if algorithm is None:
+            algorithm = 'scrypt' if HAS_SCRYPT else 'pbkdf2_sha256'
+        if algorithm not in ('scrypt', 'pbkdf2_sha256'):
+            raise ValueError(f"Unsupported password hash algorithm: {algorithm}")
+        if algorithm == 'scrypt' and not HAS_SCRYPT:
+            raise ValueError("scrypt is not available in this Python build")
+        self.algorithm = algorithm
+        self.n = n
+        self.r = r
+        self.p = p
+        self.iterations = iterations
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @classmethod
+    def from_settings(cls, text, max_concurrent=2):
+        """Hasher for parameters saved with settings(), e.g. 'scrypt$16384$8$1'"""
+        algorithm, *params = text.split('$')
+        try:
+            params = [int(value) for value in params]
+        except ValueError:
+            raise ValueError(f"Invalid password hash settings: {text!r}") from None
+        if algorithm == 'scrypt' and len(params) == 3:
+            n, r, p = params
+            return cls('scrypt', n=n, r=r, p=p, max_concurrent=max_concurrent)
+        if algorithm == 'pbkdf2_sha256' and len(params) == 1:
+            return cls('pbkdf2_sha256', iterations=params[0], max_concurrent=max_concurrent)
+        raise ValueError(f"Invalid password hash settings: {text!r}")
+
+    def settings(self):
+        """The algorithm and parameters as text for from_settings(), in the stored hash format"""
+        if self.algorithm == 'scrypt':
+            return f'scrypt${self.n}${self.r}${self.p}'
+        return f'pbkdf2_sha256${self.iterations}'
+
+    def __repr__(self):
+        if self.algorithm == 'scrypt':
+            return f"PasswordHasher('scrypt', n={self.n}, r={self.r}, p={self.p})"
+        return f"PasswordHasher('pbkdf2_sha256', iterations={self.iterations})"
+
+    def _derive(self, algorithm, params, password, salt):
+        with self._slots:
+            if algorithm == 'scrypt':
+                n, r, p = params
+                return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                                      maxmem=128 * r * (n + p + 2) + (1 << 20),
+                                      dklen=HASH_BYTES)
+            (iterations,) = params
+            return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations,
+                                       dklen=HASH_BYTES)
+
+    def hash(self, password):
+        """Hash a password with a fresh salt using the current parameters"""
+        salt = os.urandom(SALT_BYTES)
+        if self.algorithm == 'scrypt':
+            params = (self.n, self.r, self.p)
+        else:
+            params = (self.iterations,)
+        digest = self._derive(self.algorithm, params, password, salt)
+        fields = [self.algorithm] + [str(value) for value in params]
+        return '$'.join(fields + [_b64encode(salt), _b64encode(digest)])
+
+    def verify(self, password, encoded):
+        """Check a password against a stored hash in any supported format"""
+        if '$' not in encoded:
+            # Legacy unsalted SHA-256
+            return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+        try:
+            algorithm, *params, salt, digest = encoded.split('$')
+            params = tuple(int(value) for value in params)
+            salt = _b64decode(salt)
+            digest = _b64decode(digest)
+        except ValueError:
+            return False
+        if len(params) != {'scrypt': 3, 'pbkdf2_sha256': 1}.get(algorithm):
+            return False
+        return hmac.compare_digest(self._derive(algorithm, params, password, salt), digest)
+
+    def needs_rehash(self, encoded):
+        """True if a stored hash uses a weaker scheme or weaker parameters than ours.
+
+        A hash made with a stronger scheme or higher costs is left alone, so
+        lowering the settings never downgrades existing accounts.
+        """
+        fields = encoded.split('$')
+        stored_rank = ALGORITHM_RANK.get(fields[0], 0) if len(fields) > 1 else 0
+        if stored_rank != ALGORITHM_RANK[self.algorithm]:
+            return stored_rank < ALGORITHM_RANK[self.algorithm]
+        try:
+            if self.algorithm == 'scrypt':
+                n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+                # Memory grows with n * r and time with n * r * p
+                return n * r < self.n * self.r or n * r * p < self.n * self.r * self.p
+            return int(fields[1]) < self.iterations
+        except (IndexError, ValueError):
+            return True
+
+    def dummy_verify(self, password):
+        """Spend the same time as a real verification, for unknown usernames"""
+        self._derive(self.algorithm,
+                     (self.n, self.r, self.p) if self.algorithm == 'scrypt' else (self.iterations,),
+                     password, bytes(SALT_BYTES))
+
+
+def time_hash(hasher, rounds=3):
+    """Median seconds one hash takes on this host"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.hash('calibration password')
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(target_ms=100, algorithm=None):
+    """Find the largest work factor whose hashes take at most target_ms here.
+
+    The work factor is doubled from a low starting point until a hash would
+    overshoot the target. Returns (hasher, measured_ms).
+    """
+    hasher = PasswordHasher(algorithm, n=2 ** 10, iterations=10000)
+    best = hasher, time_hash(hasher) * 1000
+    while True:
+        if hasher.algorithm == 'scrypt':
+            candidate = PasswordHasher('scrypt', n=hasher.n * 2, r=hasher.r, p=hasher.p)
+        else:
+            candidate = PasswordHasher('pbkdf2_sha256', iterations=hasher.iterations * 2)
+        elapsed_ms = time_hash(candidate) * 1000
+        if elapsed_ms > target_ms:
+            return best
+        hasher = candidate
+        best = hasher, elapsed_ms
+
+
+class LoginThrottle:
+    """Limit failed logins per username with an exponential lockout.
+
+    After max_failures failures within window seconds, further attempts are
+    refused for base_delay seconds, doubling on each further failure up to
+    max_delay. Refused attempts are rejected before any hashing happens, so
+    they cost almost no CPU.
+    """
+
+    def __init__(self, max_failures=5, window=300, base_delay=1.0, max_delay=300.0):
+        self.max_failures = max_failures
+        self.window = window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._failures = {}
+        # (time the entry may be forgotten, username), earliest first; an
+        # item goes stale when the entry is updated or removed after it
+        self._expiries = []
+
+    def retry_after(self, username):
+        """Seconds until this username may try again, 0 if it may try now"""
+        with self._lock:
+            entry = self._failures.get(username)
+            if entry is None:
+                return 0
+            count, first_failure, locked_until = entry
+            now = time.monotonic()
+            if now - first_failure > self.window and now >= locked_until:
+                del self._failures[username]
+                return 0
+            return max(0.0, locked_until - now)
+
+    def record_failure(self, username):
+        with self._lock:
+            now = time.monotonic()
+            count, first_failure, locked_until = self._failures.get(username, (0, now, 0))
+            if now - first_failure > self.window:
+                count, first_failure = 0, now
+            count += 1
+            if count >= self.max_failures:
+                delay = min(self.base_delay * 2 ** (count - self.max_failures), self.max_delay)
+                locked_until = now + delay
+            self._failures[username] = (count, first_failure, locked_until)
+            heapq.heappush(self._expiries, (max(first_failure + self.window, locked_until),
+                                            username))
+            self._forget_expired(now)
+
+    def _forget_expired(self, now):
+        """Drop entries past their window and lockout, so the table can't grow without bound"""
+        while self._expiries and self._expiries[0][0] < now:
+            _, username = heapq.heappop(self._expiries)
+            entry = self._failures.get(username)
+            if entry is not None and max(entry[1] + self.window, entry[2]) < now:
+                del self._failures[username]
+
+    def record_success(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
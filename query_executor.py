@@ -0,0 +1,125 @@
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryExecutor:
+    """Run database work on a thread pool and deliver results on the Tk main loop.
+
+    Tk widgets may only be touched from the main thread, so workers never call
+    back directly. Finished jobs are queued and drained by a root.after poll,
+    which runs the success/error callbacks on the main thread.
+
+    Jobs submitted with a key supersede earlier jobs with the same key: a queued
+    job is cancelled outright and a running one has its result discarded. This
+    keeps rapid filter changes from piling up or painting stale results.
+
+    With a metrics.Profiler, jobs run through Profiler.run so that a profile
+    capture covers the workers as well as the main thread.
+    """
+
+    POLL_INTERVAL_MS = 15
+
+    def __init__(self, root, max_workers=4, profiler=None):
+        self.root = root
+        self.profiler = profiler
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db-worker')
+        self.results = queue.Queue()
+        self.generations = {}
+        self.futures = {}
+        self.outstanding = 0
+        self.poll_id = None
+        self.closed = False
+
+    def submit(self, func, *args, on_success=None, on_error=None, key=None, **kwargs):
+        """Run func(*args, **kwargs) on a worker and call on_success(result) afterwards.
+
+        Must be called from the main thread.
+        """
+        if self.closed:
+            return None
+
+        generation = None
+        if key is not None:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            previous = self.futures.pop(key, None)
+            if previous is not None and previous.cancel():
+                self.outstanding -= 1
+
+        def job():
+            try:
+                if self.profiler is not None:
+                    result = self.profiler.run(func, *args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+            except Exception as exc:
+                self.results.put((key, generation, on_error, exc, False))
+            else:
+                self.results.put((key, generation, on_success, result, True))
+
+        future = self.pool.submit(job)
+        if key is not None:
+            self.futures[key] = future
+        self.outstanding += 1
+        self._schedule_poll()
+        return future
+
+    def is_pending(self, key):
+        """Check whether a job with this key is still queued or running"""
+        return key in self.futures
+
+    def cancel(self, key):
+        """Drop the job with this key; its result will never be delivered"""
+        self.generations[key] = self.generations.get(key, 0) + 1
+        future = self.futures.pop(key, None)
+        if future is not None and future.cancel():
+            self.outstanding -= 1
+
+    def cancel_all(self):
+        """Drop every keyed job, e.g. when the user logs out"""
+        for key in list(self.futures):
+            self.cancel(key)
+
+    def shutdown(self):
+        """Stop accepting work and release the worker threads"""
+        self.closed = True
+        self.cancel_all()
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_poll(self):
+        if self.poll_id is None and not self.closed:
+            self.poll_id = self.root.after(self.POLL_INTERVAL_MS, self._poll)
+
+    def _poll(self):
+        """Drain finished jobs and run their callbacks on the main thread.
+
+        A callback that raises, or a failed job without on_error, is reported
+        through root.report_callback_exception as Tk does for its own
+        callbacks, and the remaining results are still delivered.
+        """
+        self.poll_id = None
+        try:
+            while True:
+                try:
+                    key, generation, callback, value, ok = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                self.outstanding -= 1
+                if key is not None:
+                    if generation != self.generations.get(key):
+                        continue
+                    self.futures.pop(key, None)
+                try:
+                    if callback is not None:
+                        callback(value)
+                    elif not ok:
+                        raise value
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            if self.outstanding > 0:
+                self._schedule_poll()
@@ -0,0 +1,205 @@
+"""ExpenseService over HTTP, for running the Tk app against server.py.
+
+RemoteService has the methods of ExpenseService that the app uses, with the
+same arguments and results, so ModernExpenseTracker can take either. Each
+worker thread keeps its own keep-alive connection to the server. Validation
+and throttling errors come back as ValueError with the server's message, and
+other failures as RuntimeError or OSError, just like the local service.
+"""
+import http.client
+import json
+import threading
+from urllib.parse import urlencode, urlsplit
+
+from database import DEFAULT_SORT
+from service import PAGE_SIZE, sort_key
+
+# Rows per request when streaming expenses for an export
+EXPORT_PAGE_SIZE = 1000
+
+
+def _query(filters, **params):
+    start_date, end_date, category, search = filters
+    params.update(start=start_date, end=end_date, category=category, search=search)
+    return {name: value for name, value in params.items() if value is not None}
+
+
+def _key(value):
+    return tuple(value) if value is not None else None
+
+
+class RemoteService:
+    """Expense tracker operations on an expense server"""
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url if '//' in url else f'http://{url}')
+        if parts.scheme != 'http' or not parts.hostname:
+            raise ValueError(f"Expected an http://host:port server address, not {url}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        # Login token of every user logged in through this client
+        self.tokens = {}
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port,
+                                                                 timeout=self.timeout)
+        return conn
+
+    def request(self, method, path, body=None, user_id=None, query=None):
+        """Send one request and return its decoded JSON result.
+
+        A kept-alive connection the server has since closed is reopened once.
+        Raises ValueError with the server's message for rejected requests.
+        """
+        if query:
+            path = f'{path}?{urlencode(query)}'
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body, separators=(',', ':')).encode()
+            headers['Content-Type'] = 'application/json'
+        if user_id is not None:
+            token = self.tokens.get(user_id)
+            if token is None:
+                raise ValueError("Not logged in")
+            headers['Authorization'] = f'Bearer {token}'
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, data, headers)
+                response = conn.getresponse()
+                payload = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                self._local.conn = None
+                if attempt == 2:
+                    raise
+        result = json.loads(payload) if payload else None
+        if response.status >= 400:
+            message = result.get('error') if isinstance(result, dict) else response.reason
+            if response.status >= 500:
+                raise RuntimeError(f"Server error: {message}")
+            error = ValueError(message)
+            error.status = response.status
+            raise error
+        return result
+
+    def close(self):
+        """Close this thread's connection; the other threads' close as they exit"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def login(self, username, password):
+        """Return the user id for valid credentials, otherwise None"""
+        try:
+            result = self.request('POST', '/login', {'username': username, 'password': password})
+        except ValueError as e:
+            if getattr(e, 'status', None) == 401:
+                return None
+            raise
+        self.tokens[result['user_id']] = result['token']
+        return result['user_id']
+
+    def logout(self, user_id):
+        """End the user's session on the server"""
+        if user_id in self.tokens:
+            try:
+                self.request('POST', '/logout', user_id=user_id)
+            finally:
+                del self.tokens[user_id]
+
+    def register(self, username, password):
+        """Create an account. Returns False if the username is taken"""
+        try:
+            self.request('POST', '/register', {'username': username, 'password': password})
+        except ValueError as e:
+            if getattr(e, 'status', None) == 409:
+                return False
+            raise
+        return True
+
+    def add_expense(self, user_id, expense):
+        """Store an expense from make_expense. Returns it with its id"""
+        return self.request('POST', '/expenses', expense, user_id)
+
+    def add_expenses(self, user_id, expenses):
+        """Store (amount, category, description, date) tuples. Returns the number stored"""
+        result = self.request('POST', '/expenses/bulk',
+                              {'expenses': [list(expense) for expense in expenses]}, user_id)
+        return result['imported']
+
+    def delete_expense(self, user_id, expense_id):
+        """Delete one of the user's expenses. Returns False if it didn't exist"""
+        return bool(self.delete_expenses(user_id, [expense_id])['expenses'])
+
+    def delete_expenses(self, user_id, expense_ids):
+        """Delete a batch of expenses, keeping it for undo. See ExpenseService.delete_expenses"""
+        return self.request('POST', '/expenses/delete', {'ids': list(expense_ids)}, user_id)
+
+    def delete_matching(self, user_id, filters):
+        """Delete every expense matching a filter as one undoable batch"""
+        return self.request('POST', '/expenses/delete',
+                            {'filters': _query(filters)}, user_id)
+
+    def undo_delete(self, user_id, batch_id=None):
+        """Restore a deleted batch, by default the latest one. Returns the restored expenses"""
+        body = {'batch_id': batch_id} if batch_id is not None else {}
+        return self.request('POST', '/undo', body, user_id)['expenses']
+
+    def load_page(self, user_id, filters, offset=0, limit=PAGE_SIZE, sort=DEFAULT_SORT,
+                  after=None, before=None):
+        """Fetch one page of expenses and the summary. See ExpenseService.load_page"""
+        column, descending = sort
+        query = _query(filters, offset=offset, limit=limit,
+                       sort=f"{'-' if descending else ''}{column}")
+        if after is not None:
+            query['after'] = json.dumps(list(after))
+        if before is not None:
+            query['before'] = json.dumps(list(before))
+        page = self.request('GET', '/expenses', user_id=user_id, query=query)
+        # Tuples come back as arrays; the app uses these as dictionary keys
+        page['filters'] = tuple(page['filters'])
+        page['sort'] = tuple(page['sort'])
+        page['after'] = _key(page['after'])
+        page['before'] = _key(page['before'])
+        return page
+
+    def summary(self, user_id, filters):
+        """Total, count, average and per-category breakdown for a filter"""
+        return self.request('GET', '/summary', user_id=user_id, query=_query(filters))
+
+    def iter_expenses(self, user_id, filters):
+        """Stream every expense matching a filter, newest first, a page at a time"""
+        after = None
+        while True:
+            page = self.load_page(user_id, filters, limit=EXPORT_PAGE_SIZE, after=after)
+            yield from page['expenses']
+            if not page['has_next'] or not page['expenses']:
+                return
+            after = sort_key(page['expenses'][-1], 'date')
+
+    def analytics(self, user_id, filters, top_n=5, rolling_days=30):
+        """Category, monthly, rolling and percentile breakdowns. See ExpenseService.analytics"""
+        result = self.request('GET', '/analytics', user_id=user_id,
+                              query=_query(filters, top_n=top_n, rolling_days=rolling_days))
+        result['percentiles'] = {int(q): value for q, value in result['percentiles'].items()}
+        for name in ('monthly', 'rolling_average', 'top_descriptions'):
+            result[name] = [tuple(item) for item in result[name]]
+        return result
+
+    def import_file(self, user_id, path, on_progress=None):
+        """Bulk import a CSV or JSON file, validated here and sent in chunks"""
+        import importer
+        return importer.import_file(self, user_id, path, on_progress=on_progress)
+
+    def export_file(self, user_id, path, filters, fmt=None):
+        """Export the expenses matching a filter. Returns an ExportReport"""
+        import exporter
+        return exporter.export_expenses(self.iter_expenses(user_id, filters), path, fmt)
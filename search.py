@@ -0,0 +1,46 @@
+"""Token and prefix search over expense descriptions.
+
+The database keeps an SQLite FTS5 index of descriptions (see
+Database._add_search_index); this module turns what the user typed into an
+FTS5 query and applies the same rules in Python to rows that are already in
+memory. A search matches an expense when every search token is a prefix of
+some token of its description, ignoring case and accents, so "cof sta" finds
+"Coffee at Starbucks".
+"""
+import re
+import unicodedata
+
+# Letters and digits; everything else, underscore included, separates tokens
+# like FTS5's unicode61 tokenizer does
+_TOKEN = re.compile(r'[^\W_]+')
+
+# Tokenizer settings of the FTS5 table, matching tokenize() below
+FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+
+# unicode61 folds case one character at a time, so a word-final sigma becomes
+# a plain one, and it leaves compatibility characters such as the fi ligature
+# alone; hence lower() and NFD rather than casefold() and NFKD
+_FINAL_SIGMA = str.maketrans('\u03c2', '\u03c3')
+
+
+def tokenize(text):
+    """Lowercase, accent-free tokens of a piece of text"""
+    decomposed = unicodedata.normalize('NFD', text.lower().translate(_FINAL_SIGMA))
+    return _TOKEN.findall(''.join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def normalize_search(text):
+    """Canonical form of a search box entry: its tokens joined by spaces, or None if empty"""
+    return ' '.join(tokenize(text or '')) or None
+
+
+def match_expression(search):
+    """FTS5 MATCH expression requiring every token of search as a prefix"""
+    # Tokens are letters and digits only, so quoting them needs no escaping
+    return ' AND '.join(f'"{token}"*' for token in tokenize(search))
+
+
+def matches(description, search):
+    """Check a description against a search the way the FTS index would"""
+    words = tokenize(description or '')
+    return all(any(word.startswith(token) for word in words) for token in tokenize(search))
@@ -0,0 +1,626 @@
+"""Local HTTP/JSON server giving several clients the same ledger.
+
+Usage: python server.py [--db FILE | --shards DIR] [--host 127.0.0.1] [--port 8765]
+
+Runs the ExpenseService stack (Database behind the expense and query caches)
+in one process, so every client shares one set of caches and connections.
+Clients log in once and send the returned token as "Authorization: Bearer
+TOKEN". Money is integer cents and dates are YYYY-MM-DD in both directions.
+
+    POST /login            {username, password} -> {token, user_id}
+    POST /register         {username, password} -> {created}
+    POST /logout
+    GET  /expenses         ?start&end&category&search&sort&limit&offset&after&before
+                           -> one page, as ExpenseService.load_page returns it;
+                           after/before are sort keys as JSON arrays
+    POST /expenses         {amount, category, description, date} -> the stored expense
+    POST /expenses/bulk    {expenses: [[amount, category, description, date], ...]}
+                           -> {imported}
+    POST /expenses/delete  {ids: [...]} or {filters: {start, end, category, search}}
+                           -> {batch_id, expenses}
+    POST /undo             {batch_id} (default: the latest batch) -> {expenses}
+    GET  /summary          ?start&end&category&search
+    GET  /analytics        ?start&end&category&search
+    POST /batch            {requests: [{method, path, query, body}, ...]}
+                           -> {responses: [{status, body}, ...]}, run in order
+
+Connections are kept alive between requests (HTTP/1.1) until the client
+closes them or stays idle for KEEPALIVE_TIMEOUT seconds. Each user, and each
+client address before it logs in, gets a token bucket of requests; a batch
+costs one token per request in it. Over the limit, requests get 429 with a
+Retry-After header. Logins and registrations, which each cost a deliberately
+slow password hash, have a stricter bucket per client address. Errors are
+JSON objects with an "error" message.
+
+The event loop only parses and routes; database work runs on a thread pool
+the size of the connection pool. With --shards the ledgers come from a
+sharded store (see sharding.py) instead of one file, and with
+--shard-processes each shard is served by that many worker processes. With
+--append-log single adds go through a group-committed write-ahead log next to
+--db (see database.LoggedDatabase).
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import secrets
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from cache import ExpenseCache, QueryCache
+from database import Database, LoggedDatabase
+from metrics import MetricsRegistry
+from service import ExpenseService, PAGE_SIZE, normalize_filters, parse_sort
+from sharding import ShardedDatabase
+from validation import clean_description, parse_category, parse_date
+
+log = logging.getLogger('expense_server')
+
+DEFAULT_PORT = 8765
+# Seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = 15
+# Largest request head and body accepted
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# Largest page, bulk insert and batch a client may ask for
+MAX_PAGE_SIZE = 1000
+MAX_BULK_ROWS = 10000
+MAX_BATCH_REQUESTS = 100
+# Sessions expire after this many seconds without a request
+SESSION_TTL = 12 * 3600
+# JSON types of a keyset position's values per sort column, before the id
+# (see database.sort_key)
+SORT_KEY_TYPES = {'date': (int,), 'category': (str, int), 'description': (str,),
+                  'amount': (int,)}
+
+
+class HTTPError(Exception):
+    """A request failure reported to the client with a status code"""
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class RateLimiter:
+    """Token bucket per key: rate requests a second, in bursts of up to burst.
+
+    Used from the event loop thread only. A rate of 0 disables limiting.
+    """
+
+    # Buckets kept before idle ones are swept
+    MAX_BUCKETS = 10000
+
+    def __init__(self, rate=50.0, burst=100.0):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    def acquire(self, key, cost=1):
+        """Take cost tokens from key's bucket. Returns 0, or the seconds to wait if it is short"""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / self.rate
+        self._buckets[key] = (tokens - cost, now)
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._sweep(now)
+        return 0.0
+
+    def _sweep(self, now):
+        """Forget buckets that have filled up again; they hold no state"""
+        full = self.burst / self.rate
+        self._buckets = {key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                         if now - updated < full}
+
+
+class SessionStore:
+    """Login tokens and the user each belongs to, with a sliding expiry"""
+
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+
+    def create(self, user_id):
+        token = secrets.token_urlsafe(32)
+        self._sessions[token] = (user_id, time.monotonic() + self.ttl)
+        if len(self._sessions) % 1000 == 0:
+            self._sweep()
+        return token
+
+    def user_id(self, token):
+        """The user a token belongs to, or None for unknown and expired tokens"""
+        session = self._sessions.get(token)
+        if session is None:
+            return None
+        user_id, expires = session
+        now = time.monotonic()
+        if now >= expires:
+            del self._sessions[token]
+            return None
+        self._sessions[token] = (user_id, now + self.ttl)
+        return user_id
+
+    def drop(self, token):
+        self._sessions.pop(token, None)
+
+    def _sweep(self):
+        now = time.monotonic()
+        self._sessions = {token: session for token, session in self._sessions.items()
+                          if session[1] > now}
+
+
+class Request:
+    """A parsed request as the handlers see it"""
+
+    __slots__ = ('method', 'path', 'query', 'body', 'token', 'user_id')
+
+    def __init__(self, method, path, query, body, token=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.token = token
+        self.user_id = None
+
+
+def parse_head(head):
+    """Split a request head into (method, target, version, headers); raises ValueError"""
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ')
+    if not version.startswith('HTTP/1.'):
+        raise ValueError(f"Unsupported protocol: {version}")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def encode_response(status, payload, keep_alive, headers=()):
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+             'Content-Type: application/json',
+             f'Content-Length: {len(body)}',
+             'Connection: keep-alive' if keep_alive else 'Connection: close']
+    lines.extend(f'{name}: {value}' for name, value in headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def _object(value, what="request body"):
+    if not isinstance(value, dict):
+        raise ValueError(f"The {what} must be a JSON object")
+    return value
+
+
+def _cents(value):
+    """A positive integer amount of cents from JSON"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("Amounts must be integer cents")
+    if value <= 0:
+        raise ValueError("Amount must be greater than 0")
+    return value
+
+
+def _expense_row(amount, category, description, expense_date):
+    """Validate JSON expense fields into an (amount, category, description, date) tuple"""
+    return (_cents(amount), parse_category(category), clean_description(description),
+            parse_date(expense_date))
+
+
+def _filters(values):
+    """Normalized filters from query parameters or a filters object"""
+    return normalize_filters(values.get('category'), values.get('start'), values.get('end'),
+                             values.get('search'))
+
+
+def _int(query, name, default, low, high):
+    value = query.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number") from None
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return number
+
+
+def _sort_key(query, name, sort):
+    """A keyset position passed as a JSON array, as a tuple.
+
+    It must hold the values database.sort_key gives for the sort column,
+    then the id, each of the matching JSON type.
+    """
+    value = query.get(name)
+    if not value:
+        return None
+    try:
+        key = json.loads(value)
+    except ValueError:
+        key = None
+    types = SORT_KEY_TYPES[sort[0]] + (int,)
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(_is_key_value(item, kind) for item, kind in zip(key, types))):
+        raise ValueError(f"{name} must be a sort key: a JSON array of {len(types)} values "
+                         f"for the {sort[0]} order")
+    return tuple(key)
+
+
+def _is_key_value(value, kind):
+    if kind is int:
+        return (isinstance(value, int) and not isinstance(value, bool)
+                and -2 ** 63 <= value < 2 ** 63)
+    return isinstance(value, kind)
+
+
+def _content_length(headers):
+    """The declared body size; raises ValueError unless it is a plain decimal number"""
+    value = headers.get('content-length') or '0'
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f"Invalid Content-Length: {value}")
+    return int(value)
+
+
+class ExpenseServer:
+    """Routes HTTP requests to an ExpenseService, running database work on a thread pool"""
+
+    # (method, path) -> (handler name, whether a login is required)
+    ROUTES = {
+        ('POST', '/login'): ('login', False),
+        ('POST', '/register'): ('register', False),
+        ('POST', '/logout'): ('logout', True),
+        ('GET', '/expenses'): ('list_expenses', True),
+        ('POST', '/expenses'): ('add_expense', True),
+        ('POST', '/expenses/bulk'): ('add_expenses', True),
+        ('POST', '/expenses/delete'): ('delete_expenses', True),
+        ('POST', '/undo'): ('undo_delete', True),
+        ('GET', '/summary'): ('summary', True),
+        ('GET', '/analytics'): ('analytics', True),
+    }
+    PATHS = {path for _, path in ROUTES} | {'/batch'}
+
+    # Handlers that hash a password and are limited per address by login_limiter
+    PASSWORD_HANDLERS = {'login', 'register'}
+
+    def __init__(self, service, workers=8, rate=50.0, burst=100.0, login_rate=2.0,
+                 login_burst=20.0, metrics=None):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db-worker')
+        self.limiter = RateLimiter(rate, burst)
+        self.login_limiter = RateLimiter(login_rate, login_burst)
+        self.sessions = SessionStore()
+        self.metrics = metrics or MetricsRegistry()
+        self.connections = 0
+
+    async def call(self, func, *args, **kwargs):
+        """Run a blocking service call on the worker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until it closes or idles out"""
+        peer = writer.get_extra_info('peername')
+        client = peer[0] if peer else 'local'
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    writer.write(encode_response(431, {'error': "Request header too large"},
+                                                 False))
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.CancelledError:
+                    # Shutting down while the connection idles: just close it
+                    break
+                try:
+                    method, target, version, headers = parse_head(head)
+                    length = _content_length(headers)
+                except ValueError:
+                    writer.write(encode_response(400, {'error': "Malformed request"}, False))
+                    break
+                if 'transfer-encoding' in headers:
+                    writer.write(encode_response(501, {'error': "Send a Content-Length body"},
+                                                 False))
+                    break
+                if length > MAX_BODY_BYTES:
+                    writer.write(encode_response(413, {'error': "Request body too large"},
+                                                 False))
+                    break
+                try:
+                    body = await reader.readexactly(length) if length else b''
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                              else connection == 'keep-alive')
+                status, payload, extra = await self.respond(method, target, headers, body,
+                                                            client)
+                writer.write(encode_response(status, payload, keep_alive, extra))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def respond(self, method, target, headers, body, client):
+        """Handle one request. Returns (status, payload, extra headers)"""
+        url = urlsplit(target)
+        auth = headers.get('authorization', '')
+        token = auth[7:] if auth[:7].lower() == 'bearer ' else None
+        try:
+            try:
+                payload = json.loads(body) if body else None
+            except ValueError:
+                raise HTTPError(400, "The request body is not valid JSON") from None
+            if (method, url.path) == ('POST', '/batch'):
+                return 200, await self.batch(payload, token, client), ()
+            request = Request(method, url.path, dict(parse_qsl(url.query)), payload, token)
+            return await self.dispatch(request, client)
+        except HTTPError as e:
+            return e.status, {'error': str(e)}, e.headers
+
+    async def dispatch(self, request, client, cost=1):
+        """Authenticate, rate limit and run the handler of one request"""
+        route = self.ROUTES.get((request.method, request.path))
+        try:
+            if route is None:
+                if request.path in self.PATHS:
+                    raise HTTPError(405, f"{request.method} is not allowed on {request.path}")
+                raise HTTPError(404, f"No such endpoint: {request.path}")
+            handler, needs_login = route
+            if request.token is not None:
+                request.user_id = self.sessions.user_id(request.token)
+            if needs_login and request.user_id is None:
+                raise HTTPError(401, "Log in first")
+            self.throttle(request.user_id, client, cost)
+            if handler in self.PASSWORD_HANDLERS:
+                self.throttle(None, client, 1, self.login_limiter)
+            with self.metrics.timer(f'http.{request.method} {request.path}'):
+                status, payload = await getattr(self, handler)(request)
+            return status, payload, ()
+        except HTTPError as e:
+            return e.status, {'error': str(e)}, e.headers
+        except ValueError as e:
+            # Validation and throttling messages are meant for the user as-is
+            return 400, {'error': str(e)}, ()
+        except Exception:
+            log.exception("%s %s failed", request.method, request.path)
+            return 500, {'error': "Internal server error"}, ()
+
+    def throttle(self, user_id, client, cost=1, limiter=None):
+        """Charge a request to its user, or its address before login; raises 429 when over"""
+        key = user_id if user_id is not None else f'address:{client}'
+        wait = (limiter or self.limiter).acquire(key, cost)
+        if wait:
+            raise HTTPError(429, "Too many requests", [('Retry-After', max(1, round(wait)))])
+
+    async def batch(self, payload, token, client):
+        """Run the requests of a batch in order, each with its own status"""
+        requests = payload.get('requests') if isinstance(payload, dict) else None
+        if not isinstance(requests, list):
+            raise HTTPError(400, "A batch needs a list of requests")
+        if len(requests) > MAX_BATCH_REQUESTS:
+            raise HTTPError(400, f"A batch holds at most {MAX_BATCH_REQUESTS} requests")
+        user_id = self.sessions.user_id(token) if token else None
+        # The whole batch is charged up front, so it is admitted or refused at once
+        self.throttle(user_id, client, len(requests))
+        responses = []
+        for item in requests:
+            query = (item.get('query') or {}) if isinstance(item, dict) else None
+            if not isinstance(query, dict) or item.get('path') == '/batch':
+                responses.append({'status': 400, 'body': {'error': "Invalid batch request"}})
+                continue
+            request = Request(str(item.get('method', 'GET')).upper(), str(item.get('path')),
+                              {str(k): str(v) for k, v in query.items()}, item.get('body'),
+                              token)
+            status, body, _ = await self.dispatch(request, client, cost=0)
+            responses.append({'status': status, 'body': body})
+        return {'responses': responses}
+
+    # Handlers: each takes a Request and returns (status, payload)
+
+    async def login(self, request):
+        body = _object(request.body)
+        user_id = await self.call(self.service.login, body.get('username'), body.get('password'))
+        if not user_id:
+            raise HTTPError(401, "Invalid username or password")
+        return 200, {'token': self.sessions.create(user_id), 'user_id': user_id}
+
+    async def register(self, request):
+        body = _object(request.body)
+        created = await self.call(self.service.register, body.get('username'),
+                                  body.get('password'))
+        if not created:
+            raise HTTPError(409, "Username already exists")
+        return 201, {'created': True}
+
+    async def logout(self, request):
+        self.sessions.drop(request.token)
+        return 200, {}
+
+    async def list_expenses(self, request):
+        query = request.query
+        filters = _filters(query)
+        sort = parse_sort(query.get('sort') or '-date')
+        limit = _int(query, 'limit', PAGE_SIZE, 0, MAX_PAGE_SIZE)
+        offset = _int(query, 'offset', 0, 0, 2 ** 62)
+        page = await self.call(self.service.load_page, request.user_id, filters, offset, limit,
+                               sort, _sort_key(query, 'after', sort),
+                               _sort_key(query, 'before', sort))
+        return 200, page
+
+    async def add_expense(self, request):
+        body = _object(request.body)
+        amount, category, description, expense_date = _expense_row(
+            body.get('amount'), body.get('category'), body.get('description'), body.get('date'))
+        expense = {'amount': amount, 'category': category, 'description': description,
+                   'date': expense_date}
+        stored = await self.call(self.service.add_expense, request.user_id, expense)
+        if stored is None:
+            raise HTTPError(500, "Failed to add expense")
+        return 201, stored
+
+    async def add_expenses(self, request):
+        rows = _object(request.body).get('expenses')
+        if not isinstance(rows, list):
+            raise ValueError("expenses must be a list of [amount, category, description, date]")
+        if len(rows) > MAX_BULK_ROWS:
+            raise ValueError(f"Send at most {MAX_BULK_ROWS} expenses at a time")
+        expenses = []
+        for row in rows:
+            if not isinstance(row, list) or len(row) != 4:
+                raise ValueError("expenses must be a list of [amount, category, description, date]")
+            expenses.append(_expense_row(*row))
+        imported = await self.call(self.service.db.add_expenses, request.user_id, expenses)
+        return 200, {'imported': imported}
+
+    async def delete_expenses(self, request):
+        body = _object(request.body)
+        if 'filters' in body:
+            filters = _filters(_object(body['filters'], "filters"))
+            result = await self.call(self.service.delete_matching, request.user_id, filters)
+        else:
+            ids = body.get('ids')
+            if (not isinstance(ids, list)
+                    or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+                raise ValueError("ids must be a list of expense ids")
+            result = await self.call(self.service.delete_expenses, request.user_id, ids)
+        return 200, result
+
+    async def undo_delete(self, request):
+        batch_id = _object(request.body or {}).get('batch_id')
+        if batch_id is not None and (isinstance(batch_id, bool) or not isinstance(batch_id, int)):
+            raise ValueError("batch_id must be a delete batch id")
+        restored = await self.call(self.service.undo_delete, request.user_id, batch_id)
+        return 200, {'expenses': restored}
+
+    async def summary(self, request):
+        return 200, await self.call(self.service.summary, request.user_id,
+                                    _filters(request.query))
+
+    async def analytics(self, request):
+        query = request.query
+        return 200, await self.call(self.service.analytics, request.user_id, _filters(query),
+                                    _int(query, 'top_n', 5, 1, 100),
+                                    _int(query, 'rolling_days', 30, 1, 366))
+
+
+def raise_file_limit():
+    """Lift the soft open-file limit to the hard one, for thousands of connections"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def serve(server, host, port, ready=None):
+    """Accept connections until cancelled or sent SIGINT/SIGTERM.
+
+    ready, if given, is set once listening.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, task.cancel)
+        except (NotImplementedError, RuntimeError):
+            # Not on Windows, nor outside the main thread; Ctrl+C still interrupts
+            pass
+    listener = await asyncio.start_server(server.handle_connection, host, port,
+                                          limit=MAX_HEADER_BYTES, backlog=4096)
+    addresses = ', '.join(str(sock.getsockname()[:2]) for sock in listener.sockets)
+    log.info("Serving on %s", addresses)
+    if ready is not None:
+        ready.set()
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='server.py', description="Expense tracker HTTP server")
+    parser.add_argument('--db', default=os.environ.get('EXPENSES_DB', 'expenses.db'),
+                        help="database file (default: $EXPENSES_DB or expenses.db)")
+    parser.add_argument('--shards', metavar='DIR',
+                        help="serve the sharded store in this directory instead of --db")
+    parser.add_argument('--shard-processes', type=int, default=0,
+                        help="worker processes per shard, 0 to use threads (default: 0)")
+    parser.add_argument('--append-log', action='store_true',
+                        help="log single adds and group-commit them instead of one "
+                             "transaction each")
+    parser.add_argument('--log-unsynced', type=int, default=0,
+                        help="acknowledged adds a crash may lose with --append-log (default: 0)")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default: 127.0.0.1, this machine only)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=8,
+                        help="database threads and pooled connections (default: 8)")
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help="requests per second allowed per user, 0 for no limit (default: 50)")
+    parser.add_argument('--burst', type=float, default=100.0,
+                        help="requests a user may send at once above the rate (default: 100)")
+    parser.add_argument('--login-rate', type=float, default=2.0,
+                        help="logins and registrations per second allowed per client address, "
+                             "0 for no limit (default: 2)")
+    parser.add_argument('--login-burst', type=float, default=20.0)
+    parser.add_argument('--metrics', action='store_true',
+                        help="time every endpoint and print the timings on shutdown")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    raise_file_limit()
+    if args.shards and args.append_log:
+        parser.error("--append-log works with --db only")
+    if args.shards:
+        db = ShardedDatabase(args.shards, processes=args.shard_processes, pool_size=args.workers)
+    elif args.append_log:
+        db = LoggedDatabase(args.db, pool_size=args.workers, max_unsynced=args.log_unsynced)
+    else:
+        db = Database(args.db, pool_size=args.workers)
+    metrics = MetricsRegistry(enabled=args.metrics)
+    server = ExpenseServer(ExpenseService(QueryCache(ExpenseCache(db))), workers=args.workers,
+                           rate=args.rate, burst=args.burst, login_rate=args.login_rate,
+                           login_burst=args.login_burst, metrics=metrics)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        server.executor.shutdown(wait=True)
+        db.close()
+        if args.metrics:
+            print(metrics.report())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
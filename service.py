@@ -0,0 +1,297 @@
+"""UI-free expense tracker logic shared by the Tk app and the command line.
+
+Nothing here may import tkinter: the CLI and batch jobs import this module on
+machines without a display.
+"""
+import math
+from collections import OrderedDict
+
+from database import DEFAULT_SORT, SORT_COLUMNS, sort_key
+from money import divide
+from passwords import LoginThrottle
+from search import matches, normalize_search
+from validation import (parse_amount, parse_category, parse_date, clean_description,
+                        validate_credentials)
+
+# Default number of expenses per page
+PAGE_SIZE = 200
+
+
+def normalize_filters(category=None, start_date=None, end_date=None, search=None):
+    """Turn raw filter inputs into the (start_date, end_date, category, search) tuple.
+
+    Blank values and the 'All' category mean "no filter" and become None; the
+    search text is reduced to its tokens (see search.normalize_search).
+    Dates are checked and canonicalized here, so a malformed or inverted range
+    raises ValueError with a user-facing message instead of reaching a query.
+    """
+    category = (category or '').strip()
+    if category == 'All':
+        category = ''
+    start_date = (start_date or '').strip()
+    end_date = (end_date or '').strip()
+    if start_date:
+        start_date = parse_date(start_date, "the start date")
+    if end_date:
+        end_date = parse_date(end_date, "the end date")
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("The start date must not be after the end date")
+    return start_date or None, end_date or None, category or None, normalize_search(search)
+
+
+def parse_sort(text):
+    """Turn 'amount' or '-amount' (descending) into a (column, descending) sort"""
+    column = (text or '').strip()
+    descending = column.startswith('-')
+    column = column.lstrip('-')
+    if column not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {column}")
+    return column, descending
+
+
+def matches_filters(expense, filters):
+    """Check whether an expense falls inside a normalized filter tuple"""
+    start_date, end_date, category, search = filters
+    if category and expense['category'] != category:
+        return False
+    if start_date and expense['date'] < start_date:
+        return False
+    if end_date and expense['date'] > end_date:
+        return False
+    if search and not matches(expense['description'], search):
+        return False
+    return True
+
+
+def make_expense(amount, category, description, expense_date):
+    """Validate raw form or file input and return an expense dict without an id.
+
+    The amount is converted to integer cents, like every amount past this point.
+    """
+    return {'amount': parse_amount(amount),
+            'category': parse_category(category),
+            'description': clean_description(description),
+            'date': parse_date(expense_date)}
+
+
+def average(total, count):
+    """Average expense in cents, rounded to the nearest cent; 0 when there are none"""
+    return divide(total, count)
+
+
+def empty_summary():
+    return {'total': 0, 'count': 0, 'by_category': {}}
+
+
+def apply_summary_delta(summary, expense, sign):
+    """Return summary with an expense added (sign=1) or removed (sign=-1)"""
+    by_category = dict(summary['by_category'])
+    group = by_category.get(expense['category'], {'total': 0, 'count': 0})
+    group = {'total': group['total'] + sign * expense['amount'],
+             'count': group['count'] + sign}
+    if group['count']:
+        by_category[expense['category']] = group
+    else:
+        by_category.pop(expense['category'], None)
+    return {'total': summary['total'] + sign * expense['amount'],
+            'count': summary['count'] + sign,
+            'by_category': by_category}
+
+
+class PageMemo:
+    """Pages from ExpenseService.load_page kept for redisplay, least recently used evicted.
+
+    A page is filed under the position it actually shows: load_page may
+    answer a cursor that ran off the end with the last page, found by offset.
+    """
+
+    def __init__(self, max_pages):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def get(self, filters, sort, offset, after, before):
+        """The page shown for these arguments to load_page, or None"""
+        key = (filters, tuple(sort), offset, after, before)
+        page = self._pages.get(key)
+        if page is not None:
+            self._pages.move_to_end(key)
+        return page
+
+    def put(self, page):
+        key = (page['filters'], tuple(page['sort']), page['offset'], page['after'],
+               page['before'])
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def clear(self):
+        self._pages.clear()
+
+
+class ExpenseService:
+    """Expense tracker operations on top of a Database"""
+
+    def __init__(self, db, throttle=None):
+        self.db = db
+        self.throttle = throttle or LoginThrottle()
+
+    def login(self, username, password):
+        """Return the user id for valid credentials, otherwise None.
+
+        Raises ValueError for missing input, and for a username that is locked
+        out after repeated failures; locked-out attempts never reach the KDF.
+        """
+        validate_credentials(username, password)
+        username = username.strip()
+        wait = self.throttle.retry_after(username)
+        if wait:
+            raise ValueError(f"Too many failed attempts. Try again in {math.ceil(wait)} seconds")
+        user_id = self.db.authenticate_user(username, password)
+        if user_id:
+            self.throttle.record_success(username)
+        else:
+            self.throttle.record_failure(username)
+        return user_id
+
+    def register(self, username, password):
+        """Create an account. Returns False if the username is taken"""
+        validate_credentials(username, password, new_account=True)
+        return self.db.register_user(username.strip(), password)
+
+    def user_id(self, username):
+        """Look up a user id, raising ValueError for unknown users"""
+        user_id = self.db.get_user_id(username)
+        if user_id is None:
+            raise ValueError(f"No such user: {username}")
+        return user_id
+
+    def add_expense(self, user_id, expense):
+        """Store an expense from make_expense. Returns it with its id, or None on failure"""
+        expense_id = self.db.add_expense(user_id, expense['amount'], expense['category'],
+                                         expense['description'], expense['date'])
+        if not expense_id:
+            return None
+        return dict(expense, id=expense_id)
+
+    def delete_expense(self, user_id, expense_id):
+        """Delete one of the user's expenses. Returns False if it didn't exist"""
+        return self.db.delete_expense(expense_id, user_id)
+
+    def delete_expenses(self, user_id, expense_ids):
+        """Delete a batch of the user's expenses at once, keeping it for undo.
+
+        Returns a dict with the batch_id to pass to undo_delete (None if
+        nothing was deleted) and the deleted expenses.
+        """
+        return self.db.delete_expenses(expense_ids, user_id)
+
+    def delete_matching(self, user_id, filters):
+        """Delete every expense matching a filter as one undoable batch, like delete_expenses"""
+        expense_ids = [expense['id'] for expense in self.iter_expenses(user_id, filters)]
+        return self.delete_expenses(user_id, expense_ids)
+
+    def undo_delete(self, user_id, batch_id=None):
+        """Restore a deleted batch, by default the latest one. Returns the restored expenses"""
+        if batch_id is None:
+            batch_id = self.db.last_undo_batch(user_id)
+            if batch_id is None:
+                return []
+        return self.db.restore_expenses(batch_id, user_id)
+
+    def load_page(self, user_id, filters, offset=0, limit=PAGE_SIZE, sort=DEFAULT_SORT,
+                  after=None, before=None):
+        """Fetch one page of expenses and the summary of every match.
+
+        The page starts at offset, or with after/before it is the page of rows
+        following or preceding a sort_key (keyset paging, as cheap on the last
+        page as on the first). offset is then only the page's position, kept
+        for display. If the ledger shrank and nothing is left there, the last
+        (or first) page is returned instead; the result says which page was
+        loaded and whether there are rows on either side of it.
+        """
+        start_date, end_date, category, search = filters
+
+        def fetch(offset, after, before):
+            # One row beyond the page tells whether another page follows
+            return self.db.get_expenses_with_summary(user_id, start_date, end_date, category,
+                                                     limit=limit + 1, offset=offset,
+                                                     search=search, sort=sort, after=after,
+                                                     before=before)
+
+        keyset = after is not None or before is not None
+        result = fetch(0 if keyset else offset, after, before)
+        if before is not None and len(result['expenses']) <= limit:
+            # Fewer than a page before the key: this is the start of the list
+            offset, before = 0, None
+            result = fetch(0, None, None)
+        elif after is not None and not result['expenses'] and result['count']:
+            offset, after = (result['count'] - 1) // limit * limit, None
+            result = fetch(offset, None, None)
+        elif not keyset and offset and offset >= result['count']:
+            offset = (max(result['count'] - 1, 0) // limit) * limit
+            result = fetch(offset, None, None)
+
+        expenses, count = result['expenses'], result['count']
+        if before is not None:
+            has_previous = True
+            expenses = expenses[len(expenses) - limit:]
+            has_next = offset + len(expenses) < count
+        else:
+            has_next = len(expenses) > limit
+            expenses = expenses[:limit]
+            has_previous = after is not None or offset > 0
+        # Rows added or removed on earlier pages shift positions; resync at the ends
+        if not has_previous:
+            offset = 0
+        elif not has_next:
+            offset = max(count - len(expenses), 0)
+        summary = {'total': result['total'], 'count': count,
+                   'by_category': result['by_category']}
+        return {'filters': filters, 'sort': sort, 'offset': max(offset, 0),
+                'after': after, 'before': before, 'has_previous': has_previous,
+                'has_next': has_next, 'total_rows': count, 'expenses': expenses,
+                'summary': summary}
+
+    def summary(self, user_id, filters):
+        """Total, count, average and per-category breakdown for a filter"""
+        page = self.load_page(user_id, filters, limit=0)
+        summary = page['summary']
+        return dict(summary, average=average(summary['total'], summary['count']))
+
+    def iter_expenses(self, user_id, filters):
+        """Stream every expense matching a filter, newest first"""
+        start_date, end_date, category, search = filters
+        return self.db.iter_expenses(user_id, start_date, end_date, category, search=search)
+
+    def analytics(self, user_id, filters, top_n=5, rolling_days=30):
+        """Category, monthly, rolling and percentile breakdowns for a filter.
+
+        Uses the cache's in-memory columns when the db is an ExpenseCache,
+        otherwise streams the rows once to build them. A QueryCache keeps the
+        result until a write touches the filter. Money is in cents.
+        """
+        import analytics
+
+        def compute():
+            snapshot = getattr(self.db, 'snapshot_columns', None)
+            columns = snapshot(user_id, *filters) if snapshot else None
+            if columns is None:
+                columns = analytics.ExpenseColumns.from_expenses(
+                    self.iter_expenses(user_id, filters))
+            return analytics.analyze(columns, top_n, rolling_days)
+
+        memo = getattr(self.db, 'get_analytics', None)
+        if memo is None:
+            return compute()
+        return memo(user_id, tuple(filters), (top_n, rolling_days), compute)
+
+    def import_file(self, user_id, path, on_progress=None):
+        """Bulk import a CSV or JSON file. Returns an ImportReport"""
+        import importer
+        return importer.import_file(self.db, user_id, path, on_progress=on_progress)
+
+    def export_file(self, user_id, path, filters, fmt=None):
+        """Export the expenses matching a filter. Returns an ExportReport"""
+        import exporter
+        return exporter.export_expenses(self.iter_expenses(user_id, filters), path, fmt)
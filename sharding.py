@@ -0,0 +1,483 @@
+"""Users spread over several SQLite files by a hash of their id.
+
+A sharded store is a directory holding a catalog database, with the user
+accounts and the shard each user's ledger lives in, and one database file per
+shard with the ledgers. ShardedDatabase has the Database methods the caches
+and ExpenseService call and routes each to the user's shard, so writers of
+different users take different write locks instead of queueing on one.
+
+New users are placed by jump consistent hashing of their id: growing from N
+to N+1 shards moves only about 1/(N+1) of them, all to the new shard. The
+catalog records where every user actually is, so rebalance() can move users
+one at a time and pick up where it left off after an interruption.
+
+With processes=N each shard is served by N worker processes of its own, which
+opens the files there and runs the shard's calls on them. Writes to different
+shards then run in parallel without sharing a GIL, and calls that touch every
+shard (rebuilding or verifying rollups, status) fan out to all at once.
+
+Usage: python sharding.py status --dir DIR
+       python sharding.py split SOURCE.db --dir DIR --shards N
+       python sharding.py rebalance --dir DIR --shards N [--dry-run]
+
+Splitting and rebalancing rewrite the files; run them while no app or server
+has the store open. Moved expenses get new ids on their shard, and their
+users' undo history is dropped.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from database import Database
+from dates import parse_day
+
+CATALOG_FILE = 'catalog.db'
+SHARD_FILE = 'shard-{:03d}.db'
+DEFAULT_SHARDS = 4
+# Expenses copied per transaction when moving a user between shards
+MOVE_CHUNK = 50000
+
+
+def shard_key(user_id):
+    """A well-mixed 64-bit key for a user id, the same in every process and run"""
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def jump_hash(key, buckets):
+    """Bucket in range(buckets) of a 64-bit key, by Lamping and Veach's jump consistent hash"""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(user_id, shards):
+    """Shard a user is placed on when there are this many shards"""
+    return jump_hash(shard_key(user_id), shards)
+
+
+def _create_catalog_tables(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS shards (id INTEGER PRIMARY KEY, file TEXT NOT NULL)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def _shard_files(catalog):
+    with catalog.pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT file FROM shards ORDER BY id')]
+
+
+# The Database a shard worker process serves, opened by its initializer
+_worker_db = None
+
+
+def _open_worker_db(path, pool_size):
+    global _worker_db
+    _worker_db = Database(path, pool_size=pool_size)
+
+
+def _call_worker_db(name, args, kwargs):
+    return getattr(_worker_db, name)(*args, **kwargs)
+
+
+class _LocalShard:
+    """A shard database opened in this process"""
+
+    def __init__(self, path, pool_size):
+        self.path = path
+        self.db = Database(path, pool_size=pool_size)
+
+    def call(self, name, *args, **kwargs):
+        return getattr(self.db, name)(*args, **kwargs)
+
+    def close(self):
+        self.db.close()
+
+
+class _ProcessShard:
+    """A shard database served by worker processes of its own"""
+
+    def __init__(self, path, pool_size, processes):
+        self.path = path
+        # Create and migrate the file here once, before the workers open it together
+        Database(path, pool_size=1).close()
+        # Spawned, not forked: a fork would copy this process's open connections
+        self.pool = ProcessPoolExecutor(max_workers=processes,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_open_worker_db, initargs=(path, pool_size))
+
+    def submit(self, name, *args, **kwargs):
+        return self.pool.submit(_call_worker_db, name, args, kwargs)
+
+    def call(self, name, *args, **kwargs):
+        return self.submit(name, *args, **kwargs).result()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class ShardedDatabase:
+    """Database look-alike that keeps each user's ledger on one of several shards.
+
+    Accounts live in the catalog; every expense method goes to the shard of
+    the user_id it is given and takes the same arguments as on Database.
+    Expense and undo batch ids are unique per shard, and so per user, which
+    is all the callers rely on. shards is only needed to create a new store;
+    an existing one keeps its shard count until rebalanced.
+    """
+
+    def __init__(self, directory, shards=None, processes=0, pool_size=4, hasher=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.catalog = Database(os.path.join(directory, CATALOG_FILE), pool_size, hasher)
+        with self.catalog.pool.connection() as conn:
+            _create_catalog_tables(conn)
+            files = [row[0] for row in conn.execute('SELECT file FROM shards ORDER BY id')]
+            if not files:
+                files = [SHARD_FILE.format(index) for index in range(shards or DEFAULT_SHARDS)]
+                conn.executemany('INSERT INTO shards (id, file) VALUES (?, ?)', enumerate(files))
+                conn.commit()
+        if shards is not None and shards != len(files):
+            raise ValueError(f"{directory} has {len(files)} shards; "
+                             f"use 'sharding.py rebalance' to change that")
+        self.processes = processes
+        paths = [os.path.join(directory, name) for name in files]
+        if processes:
+            self.shards = [_ProcessShard(path, pool_size, processes) for path in paths]
+        else:
+            self.shards = [_LocalShard(path, pool_size) for path in paths]
+        # user_id -> shard index, filled from the catalog as users are seen
+        self._placement = {}
+
+    def shard_of(self, user_id):
+        """Index of the shard holding a user's ledger, placing a new user by hash"""
+        shard = self._placement.get(user_id)
+        if shard is None:
+            with self.catalog.pool.connection() as conn:
+                conn.execute('INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)',
+                             (user_id, shard_for(user_id, len(self.shards))))
+                conn.commit()
+                shard = conn.execute('SELECT shard FROM user_shards WHERE user_id = ?',
+                                     (user_id,)).fetchone()[0]
+            self._placement[user_id] = shard
+        return shard
+
+    def _call(self, user_id, name, *args, **kwargs):
+        return self.shards[self.shard_of(user_id)].call(name, *args, **kwargs)
+
+    def _each_shard(self, name, *args, **kwargs):
+        """Run a method on every shard, all at once when they are processes. Returns the results"""
+        if self.processes:
+            futures = [shard.submit(name, *args, **kwargs) for shard in self.shards]
+            return [future.result() for future in futures]
+        return [shard.call(name, *args, **kwargs) for shard in self.shards]
+
+    def close(self):
+        """Close the catalog and every shard, stopping their worker processes"""
+        self.catalog.close()
+        for shard in self.shards:
+            shard.close()
+
+    def pool_stats(self):
+        """Connection pool metrics of the catalog"""
+        return self.catalog.pool_stats()
+
+    # Accounts, from the catalog
+
+    def hash_password(self, password):
+        return self.catalog.hash_password(password)
+
+    def register_user(self, username, password):
+        return self.catalog.register_user(username, password)
+
+    def get_user_id(self, username):
+        return self.catalog.get_user_id(username)
+
+    def authenticate_user(self, username, password):
+        return self.catalog.authenticate_user(username, password)
+
+    # Ledgers, from the user's shard
+
+    def add_expense(self, user_id, amount, category, description, date):
+        return self._call(user_id, 'add_expense', user_id, amount, category, description, date)
+
+    def add_expenses(self, user_id, expenses):
+        return self._call(user_id, 'add_expenses', user_id, list(expenses))
+
+    def get_expense(self, expense_id, user_id):
+        return self._call(user_id, 'get_expense', expense_id, user_id)
+
+    def get_expenses(self, user_id, *args, **kwargs):
+        return self._call(user_id, 'get_expenses', user_id, *args, **kwargs)
+
+    def get_expense_summary(self, user_id, *args, **kwargs):
+        return self._call(user_id, 'get_expense_summary', user_id, *args, **kwargs)
+
+    def get_expenses_with_summary(self, user_id, *args, **kwargs):
+        return self._call(user_id, 'get_expenses_with_summary', user_id, *args, **kwargs)
+
+    def count_expenses(self, user_id, *args, **kwargs):
+        return self._call(user_id, 'count_expenses', user_id, *args, **kwargs)
+
+    def iter_expenses(self, user_id, start_date=None, end_date=None, category=None,
+                      batch_size=1000, search=None):
+        """Yield matching expenses newest first, like Database.iter_expenses.
+
+        A worker process can't hand out a generator, so from one the rows
+        come as keyset pages of batch_size.
+        """
+        shard = self.shards[self.shard_of(user_id)]
+        if not self.processes:
+            yield from shard.db.iter_expenses(user_id, start_date, end_date, category,
+                                              batch_size, search)
+            return
+        after = None
+        while True:
+            rows = shard.call('get_expenses', user_id, start_date, end_date, category,
+                              limit=batch_size, search=search, after=after)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = (parse_day(rows[-1]['date']), rows[-1]['id'])
+
+    def delete_expense(self, expense_id, user_id):
+        return self._call(user_id, 'delete_expense', expense_id, user_id)
+
+    def delete_expenses(self, expense_ids, user_id):
+        return self._call(user_id, 'delete_expenses', list(expense_ids), user_id)
+
+    def last_undo_batch(self, user_id):
+        return self._call(user_id, 'last_undo_batch', user_id)
+
+    def restore_expenses(self, batch_id, user_id):
+        return self._call(user_id, 'restore_expenses', batch_id, user_id)
+
+    # Maintenance, of one user's shard or of all of them
+
+    def rebuild_rollups(self, user_id=None):
+        if user_id is not None:
+            return self._call(user_id, 'rebuild_rollups', user_id)
+        self._each_shard('rebuild_rollups')
+
+    def verify_rollups(self, user_id=None):
+        if user_id is not None:
+            return self._call(user_id, 'verify_rollups', user_id)
+        return [mismatch for mismatches in self._each_shard('verify_rollups')
+                for mismatch in mismatches]
+
+    def rebuild_search_index(self):
+        self._each_shard('rebuild_search_index')
+
+
+def _move_user(catalog, user_id, source, target, shard):
+    """Copy a user's ledger from source to target, point the catalog at it, then drop the original.
+
+    Any copy an interrupted move left on target is dropped first. Returns the
+    number of expenses moved.
+    """
+    target.drop_user_expenses(user_id)
+    moved = 0
+    chunk = []
+    for expense in source.iter_expenses(user_id):
+        chunk.append((expense['amount'], expense['category'], expense['description'],
+                      expense['date']))
+        if len(chunk) >= MOVE_CHUNK:
+            moved += target.add_expenses(user_id, chunk)
+            chunk = []
+    if chunk:
+        moved += target.add_expenses(user_id, chunk)
+    with catalog.pool.connection() as conn:
+        conn.execute('INSERT OR REPLACE INTO user_shards (user_id, shard) VALUES (?, ?)',
+                     (user_id, shard))
+        conn.commit()
+    source.drop_user_expenses(user_id)
+    return moved
+
+
+def _remove_database_files(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def rebalance(directory, shards, dry_run=False, on_move=None):
+    """Change a store's number of shards, moving every user whose hash now points elsewhere.
+
+    Ledgers left behind by an interrupted move are cleaned up, and shards
+    beyond the new count are deleted once empty. on_move, if given, is called
+    with (user_id, from_shard, to_shard, expenses) after each move. Returns
+    (users moved, expenses moved); with dry_run nothing changes and the
+    counts are what would move.
+    """
+    if shards < 1:
+        raise ValueError("A sharded store needs at least one shard")
+    catalog = Database(os.path.join(directory, CATALOG_FILE))
+    databases = []
+    try:
+        with catalog.pool.connection() as conn:
+            _create_catalog_tables(conn)
+            files = [row[0] for row in conn.execute('SELECT file FROM shards ORDER BY id')]
+            placements = conn.execute('SELECT user_id, shard FROM user_shards '
+                                      'ORDER BY user_id').fetchall()
+            if not files:
+                raise ValueError(f"{directory} is not a sharded store")
+            if not dry_run and shards > len(files):
+                added = [(index, SHARD_FILE.format(index)) for index in range(len(files), shards)]
+                conn.executemany('INSERT INTO shards (id, file) VALUES (?, ?)', added)
+                conn.commit()
+                files += [name for _, name in added]
+        paths = [os.path.join(directory, name) for name in files]
+        databases = [Database(path) for path in paths if os.path.exists(path) or not dry_run]
+
+        users = moved_expenses = 0
+        placed = {}
+        for user_id, current in placements:
+            wanted = shard_for(user_id, shards)
+            placed[user_id] = wanted
+            if wanted == current:
+                continue
+            users += 1
+            if dry_run:
+                moved_expenses += databases[current].count_expenses(user_id)
+                continue
+            count = _move_user(catalog, user_id, databases[current], databases[wanted], wanted)
+            moved_expenses += count
+            if on_move:
+                on_move(user_id, current, wanted, count)
+        if dry_run:
+            return users, moved_expenses
+
+        # Copies an interrupted move left on a shard the user isn't placed on
+        for index, db in enumerate(databases):
+            for user_id in db.user_ids_with_expenses():
+                if placed.get(user_id) != index:
+                    db.drop_user_expenses(user_id)
+
+        if shards < len(files):
+            with catalog.pool.connection() as conn:
+                conn.execute('DELETE FROM shards WHERE id >= ?', (shards,))
+                conn.commit()
+            for db, path in zip(databases[shards:], paths[shards:]):
+                db.close()
+                _remove_database_files(path)
+            databases = databases[:shards]
+        return users, moved_expenses
+    finally:
+        for db in databases:
+            db.close()
+        catalog.close()
+
+
+def split(source_path, directory, shards, on_progress=None):
+    """Copy the users and ledgers of a single database file into a new sharded store.
+
+    User ids are kept, so existing logins carry over. on_progress, if given,
+    is called with (users done, total users). Returns (users, expenses) copied.
+    """
+    if not os.path.exists(source_path):
+        raise ValueError(f"{source_path} does not exist")
+    if os.path.exists(os.path.join(directory, CATALOG_FILE)):
+        raise ValueError(f"{directory} already holds a sharded store")
+    source = Database(source_path)
+    store = ShardedDatabase(directory, shards)
+    try:
+        with store.catalog.pool.connection() as conn:
+            conn.execute('ATTACH DATABASE ? AS source', (source_path,))
+            conn.execute('INSERT INTO users (id, username, password, created_at) '
+                         'SELECT id, username, password, created_at FROM source.users')
+            conn.commit()
+            conn.execute('DETACH DATABASE source')
+            user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+        expenses = 0
+        for done, user_id in enumerate(user_ids, start=1):
+            target = store.shards[store.shard_of(user_id)].db
+            chunk = []
+            for expense in source.iter_expenses(user_id):
+                chunk.append((expense['amount'], expense['category'], expense['description'],
+                              expense['date']))
+                if len(chunk) >= MOVE_CHUNK:
+                    expenses += target.add_expenses(user_id, chunk)
+                    chunk = []
+            if chunk:
+                expenses += target.add_expenses(user_id, chunk)
+            if on_progress:
+                on_progress(done, len(user_ids))
+        return len(user_ids), expenses
+    finally:
+        store.close()
+        source.close()
+
+
+def status(directory):
+    """Per shard: (file, users placed on it, expenses it holds, bytes on disk)"""
+    catalog = Database(os.path.join(directory, CATALOG_FILE))
+    try:
+        with catalog.pool.connection() as conn:
+            _create_catalog_tables(conn)
+            users = dict(conn.execute('SELECT shard, COUNT(*) FROM user_shards GROUP BY shard'))
+        rows = []
+        for index, name in enumerate(_shard_files(catalog)):
+            db = Database(os.path.join(directory, name))
+            with db.pool.connection() as conn:
+                expenses = conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+            db.close()
+            paths = [os.path.join(directory, name + suffix) for suffix in ('', '-wal')]
+            size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            rows.append((name, users.get(index, 0), expenses, size))
+        return rows
+    finally:
+        catalog.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sharding.py',
+                                     description="Manage a sharded expense store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    status_cmd = commands.add_parser('status', help="users and expenses on every shard")
+    status_cmd.add_argument('--dir', required=True, help="sharded store directory")
+    split_cmd = commands.add_parser('split', help="create a sharded store from a database file")
+    split_cmd.add_argument('source', help="database file to copy from")
+    split_cmd.add_argument('--dir', required=True, help="new sharded store directory")
+    split_cmd.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    rebalance_cmd = commands.add_parser('rebalance', help="change the number of shards")
+    rebalance_cmd.add_argument('--dir', required=True, help="sharded store directory")
+    rebalance_cmd.add_argument('--shards', type=int, required=True, help="new number of shards")
+    rebalance_cmd.add_argument('--dry-run', action='store_true',
+                               help="only report what would move")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'status':
+            for name, users, expenses, size in status(args.dir):
+                print(f"{name:<16} {users:>8,} users {expenses:>12,} expenses "
+                      f"{size / 1e6:>10.1f} MB")
+        elif args.command == 'split':
+            users, expenses = split(args.source, args.dir, args.shards)
+            print(f"Copied {users:,} users and {expenses:,} expenses into "
+                  f"{args.shards} shards in {args.dir}")
+        elif args.command == 'rebalance':
+            users, expenses = rebalance(
+                args.dir, args.shards, args.dry_run,
+                on_move=lambda user_id, old, new, count: print(
+                    f"Moved user {user_id} from shard {old} to {new} ({count:,} expenses)"))
+            verb = "Would move" if args.dry_run else "Moved"
+            print(f"{verb} {users:,} users and {expenses:,} expenses")
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
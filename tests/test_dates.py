@@ -0,0 +1,61 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from database import Database
+from dates import JULIAN_OFFSET, format_day, month_of, month_sql, month_start, parse_day
+
+
+@pytest.mark.parametrize('text, value', [
+    ('2024-01-06', date(2024, 1, 6)), ('2024-1-6', date(2024, 1, 6)),
+    ('2024-02-29', date(2024, 2, 29)), ('0001-01-01', date(1, 1, 1)),
+    ('9999-12-31', date(9999, 12, 31)),
+])
+def test_parse_day_is_the_ordinal(text, value):
+    assert parse_day(text) == value.toordinal()
+
+
+@pytest.mark.parametrize('text', ['', '2024', '2024-01', '24-01-06', '2024/01/06',
+                                  '2024-01-06 ', '2023-02-29', '2024-13-01', '2024-00-10',
+                                  '2024-01-32', '0000-01-01', '2024-01-06T00:00'])
+def test_parse_day_rejects(text):
+    with pytest.raises(ValueError):
+        parse_day(text)
+
+
+def test_format_day_round_trips():
+    for day in range(parse_day('2023-12-25'), parse_day('2024-03-05')):
+        assert parse_day(format_day(day)) == day
+    assert format_day(parse_day('2024-1-6')) == '2024-01-06'
+
+
+def test_months():
+    assert month_of(parse_day('2024-01-31')) == 2024 * 12
+    assert month_of(parse_day('2024-02-01')) == 2024 * 12 + 1
+    assert month_start(2024 * 12 + 1) == parse_day('2024-02-01')
+    assert month_start(2024 * 12 + 12) == parse_day('2025-01-01')
+
+
+def test_sql_agrees_with_python():
+    conn = sqlite3.connect(':memory:')
+    for text in ['2024-01-01', '2024-02-29', '2024-12-31', '1999-03-15', '0001-01-01']:
+        day = parse_day(text)
+        rendered, month = conn.execute(f'SELECT date(day + {JULIAN_OFFSET}), {month_sql("day")} '
+                                       f'FROM (SELECT ? AS day)', (day,)).fetchone()
+        assert (rendered, month) == (text, month_of(day))
+    conn.close()
+
+
+def test_date_filters_are_inclusive_and_validated(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    for day in ['2024-01-31', '2024-02-01', '2024-02-29', '2024-03-01']:
+        db.add_expense(1, 100, 'Food', day, day)
+    february = db.get_expenses(1, '2024-02-01', '2024-02-29')
+    assert sorted(expense['date'] for expense in february) == ['2024-02-01', '2024-02-29']
+    assert db.count_expenses(1, start_date='2024-02-02') == 2
+    with pytest.raises(ValueError):
+        db.get_expenses(1, '2024-02-30')
+    with pytest.raises(ValueError):
+        db.add_expense(1, 100, 'Food', 'Lunch', 'tomorrow')
+    db.close()
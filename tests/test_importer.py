@@ -0,0 +1,45 @@
+import json
+
+from database import Database
+from importer import import_file, read_json
+
+
+def test_malformed_json_lines_are_rejected_with_their_line(tmp_path):
+    path = tmp_path / 'expenses.jsonl'
+    path.write_text('{"amount": "1.50", "category": "Food", "date": "2024-01-06"}\n'
+                    '\n'
+                    '{"amount": "2.00", "category": "Food", "date": \n'
+                    '{"amount": "3.25", "category": "Bills", "date": "2024-01-08"}\n')
+    db = Database(str(tmp_path / 'expenses.db'))
+    report = import_file(db, 1, str(path))
+    assert (report.imported, report.rejected) == (2, 1)
+    assert report.errors[0][1].startswith("Line 3: Invalid JSON")
+    assert db.get_expense_summary(1)['total'] == 475
+    db.close()
+
+
+def test_malformed_array_elements_are_skipped(tmp_path):
+    good = {'amount': '1.00', 'category': 'Food', 'date': '2024-01-06', 'description': 'a, [b]'}
+    text = ('[\n' + json.dumps(good) + ',\n{"amount": 2, "category": "Food" "date": "x"},\n'
+            + ',\n'.join([json.dumps(good)] * 500) + ',\n[1, }\n]')
+    path = tmp_path / 'expenses.json'
+    path.write_text(text)
+    records = list(read_json(str(path), buffer_size=256))
+    assert len(records) == 503
+    assert (records[1].line, records[-1].line) == (3, 504)
+    assert all(record == good for record in records[:1] + records[2:-1])
+
+
+def test_oversized_array_elements_do_not_grow_the_buffer(tmp_path):
+    good = {'amount': '1.00', 'category': 'Food', 'date': '2024-01-06'}
+    huge = '{"description": "' + 'x' * 10000
+    path = tmp_path / 'expenses.json'
+    path.write_text('[' + huge + '", "amount": }, \n' + json.dumps(good) + ']')
+    records = list(read_json(str(path), buffer_size=256, max_record_size=1024))
+    assert records[0].message == "JSON element longer than 1,024 characters"
+    assert records[1:] == [good]
+
+    path.write_text('[' + json.dumps(good) + ', ' + huge)
+    records = list(read_json(str(path), buffer_size=256, max_record_size=100000))
+    assert records[0] == good
+    assert records[1].message == "Truncated JSON array"
@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import appendlog
+from database import LOG_ID_BLOCK, LoggedDatabase
+
+
+def test_concurrent_adds_get_unique_ids_across_blocks(tmp_path):
+    db = LoggedDatabase(str(tmp_path / 'log.db'), compact_interval=0.01)
+    ids = []
+
+    def add(user_id):
+        for _ in range(LOG_ID_BLOCK // 2):
+            ids.append(db.add_expense(user_id, 100, 'Food', 'Lunch', '2024-01-06'))
+    writers = [threading.Thread(target=add, args=(user_id,)) for user_id in range(1, 7)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert len(set(ids)) == len(ids) == 3 * LOG_ID_BLOCK
+    db.close()
+    db = LoggedDatabase(str(tmp_path / 'log.db'))
+    assert sum(db.count_expenses(user_id) for user_id in range(1, 7)) == len(ids)
+    assert db.verify_rollups() == []
+    db.close()
+
+
+def test_compaction_failures_are_retried_and_reported(tmp_path, monkeypatch):
+    db = LoggedDatabase(str(tmp_path / 'log.db'), compact_interval=0.01)
+    store = db._store_logged
+    failures = []
+
+    def failing_store(records, last_seq):
+        if len(failures) < 2:
+            failures.append(last_seq)
+            raise sqlite3.OperationalError("database is locked")
+        store(records, last_seq)
+    monkeypatch.setattr(db, '_store_logged', failing_store)
+    db.add_expense(1, 100, 'Food', 'Lunch', '2024-01-06')
+    deadline = time.monotonic() + 5
+    stats = db.log_stats()
+    # The error is cleared just after the successful compaction empties the backlog
+    while (stats['pending'] or stats['last_compact_error']) and time.monotonic() < deadline:
+        time.sleep(0.01)
+        stats = db.log_stats()
+    assert stats['pending'] == 0
+    assert stats['compact_errors'] == 2
+    assert stats['last_compact_error'] is None
+    db.close()
+
+
+def test_an_add_the_log_rejects_leaves_no_row(tmp_path, monkeypatch):
+    db = LoggedDatabase(str(tmp_path / 'log.db'), compact_interval=60)
+
+    def broken_append(seq, record):
+        raise UnicodeEncodeError('utf-8', 'x', 0, 1, "surrogates not allowed")
+    monkeypatch.setattr(db.log, 'append', broken_append)
+    with pytest.raises(UnicodeEncodeError):
+        db.add_expense(1, 100, 'Food', 'Lunch', '2024-01-06')
+    monkeypatch.undo()
+    expense_id = db.add_expense(1, 250, 'Food', 'Dinner', '2024-01-06')
+    assert [expense['id'] for expense in db.get_expenses(1)] == [expense_id]
+    db.compact()
+    assert db.get_expense_summary(1) == {'total': 250, 'count': 1}
+    db.close()
+
+
+def test_an_add_whose_log_sync_fails_leaves_no_row(tmp_path, monkeypatch):
+    db = LoggedDatabase(str(tmp_path / 'log.db'), compact_interval=60)
+    db.add_expense(1, 250, 'Food', 'Dinner', '2024-01-05')
+
+    def failing_fsync(fd):
+        raise OSError(5, "Input/output error")
+    monkeypatch.setattr(appendlog.os, 'fsync', failing_fsync)
+    with pytest.raises(OSError):
+        db.add_expense(1, 100, 'Food', 'Lunch', '2024-01-06')
+    assert db.get_expense_summary(1) == {'total': 250, 'count': 1}
+    assert db.log_stats()['pending'] == 1
+    monkeypatch.undo()
+    db.compact()
+    assert db.get_expense_summary(1) == {'total': 250, 'count': 1}
+    db.close()
+    db = LoggedDatabase(str(tmp_path / 'log.db'))
+    assert db.get_expense_summary(1) == {'total': 250, 'count': 1}
+    db.close()
@@ -0,0 +1,75 @@
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from database import MIGRATIONS, Database
+
+
+def make_original_database(path, expenses):
+    """A database file with the schema and data of the first released version"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            category TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany('INSERT INTO expenses (user_id, amount, category, description, date) '
+                     'VALUES (1, ?, ?, ?, ?)', expenses)
+    conn.commit()
+    conn.close()
+
+
+def test_unpadded_dates_are_migrated(tmp_path):
+    path = str(tmp_path / 'old.db')
+    make_original_database(path, [(12.5, 'Food', 'Lunch', '2024-1-6'),
+                                  (3.0, 'Food', 'Coffee', '2024-01-07')])
+    db = Database(path)
+    assert db.get_schema_version() == len(MIGRATIONS)
+    assert [(e['date'], e['amount']) for e in db.get_expenses(1)] == [('2024-01-07', 300),
+                                                                        ('2024-01-06', 1250)]
+    assert db.verify_rollups() == []
+    db.close()
+
+
+def test_unreadable_dates_are_quarantined(tmp_path):
+    path = str(tmp_path / 'old.db')
+    make_original_database(path, [(12.5, 'Food', 'Lunch', '2024-01-06'),
+                                  (9.99, 'Bills', 'Phone', 'yesterday'),
+                                  (1.0, 'Food', 'Snack', '2024-02-30')])
+    db = Database(path)
+    assert db.count_expenses(1) == 1
+    with db.pool.connection() as conn:
+        quarantined = conn.execute('SELECT id, date FROM expense_quarantine ORDER BY id').fetchall()
+    assert [tuple(row) for row in quarantined] == [(2, 'yesterday'), (3, '2024-02-30')]
+    db.close()
+
+
+def _open_database(path):
+    Database(path).close()
+
+
+def test_concurrent_opens_migrate_once(tmp_path):
+    path = str(tmp_path / 'old.db')
+    make_original_database(path, [(12.5, 'Food', 'Lunch', '2024-01-06')] * 50)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=4, mp_context=context) as pool:
+        for future in [pool.submit(_open_database, path) for _ in range(8)]:
+            future.result()
+    db = Database(path)
+    assert db.get_schema_version() == len(MIGRATIONS)
+    assert db.get_expense_summary(1) == {'total': 62500, 'count': 50}
+    db.close()
@@ -0,0 +1,49 @@
+import pytest
+
+from analytics import ExpenseColumns, _analyze_python
+from money import MAX_CENTS, divide, format_cents, parse_cents
+
+
+@pytest.mark.parametrize('value, cents', [
+    ('12', 1200), ('12.5', 1250), ('12.50', 1250), (' 0.07 ', 7), ('-3.25', -325),
+    ('1e2', 10000), (0.1, 10), (12.5, 1250), (12, 1200), ('10000000000000', MAX_CENTS),
+])
+def test_parse_cents(value, cents):
+    assert parse_cents(value) == cents
+
+
+@pytest.mark.parametrize('value, message', [
+    ('abc', 'valid amount'), ('', 'valid amount'), (None, 'valid amount'),
+    ('nan', 'valid amount'), ('inf', 'valid amount'),
+    ('1.234', 'two decimal places'), (0.001, 'two decimal places'),
+    ('10000000000000.01', 'too large'), ('1e20', 'too large'),
+])
+def test_parse_cents_rejects(value, message):
+    with pytest.raises(ValueError, match=message):
+        parse_cents(value)
+
+
+def test_format_cents():
+    assert format_cents(0) == '0.00'
+    assert format_cents(7) == '0.07'
+    assert format_cents(-123456, '$', True) == '-$1,234.56'
+
+
+@pytest.mark.parametrize('cents, count, quotient', [
+    (0, 0, 0), (100, 0, 0), (10, 4, 2), (14, 4, 4), (6, 4, 2), (7, 4, 2), (9, 4, 2),
+    (10, 3, 3), (11, 3, 4), (-10, 4, -2), (-14, 4, -4), (-7, 4, -2),
+    (2 ** 62 + 1, 2, 2 ** 61),
+])
+def test_divide_rounds_half_to_even(cents, count, quotient):
+    assert divide(cents, count) == quotient
+
+
+def test_rolling_average_rounds_like_divide():
+    expenses = [{'date': '2024-01-01', 'amount': 1, 'category': 'Food', 'description': 'a'},
+                {'date': '2024-01-02', 'amount': 2, 'category': 'Food', 'description': 'a'},
+                {'date': '2024-01-03', 'amount': 2, 'category': 'Food', 'description': 'b'}]
+    result = _analyze_python(ExpenseColumns.from_expenses(expenses), 5, 2)
+    # Windows of 3 and 4 cents over two days: 1.5 rounds to 2, 2.0 stays 2
+    assert result[2] == [('2024-01-02', 2), ('2024-01-03', 2)]
+    assert result[0] == {'Food': 5}
+    assert result[4] == [('a', 3, 2), ('b', 2, 1)]
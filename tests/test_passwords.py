@@ -0,0 +1,70 @@
+import cli
+from database import Database
+import passwords
+from passwords import LoginThrottle, PasswordHasher
+
+
+def test_weaker_hashes_are_upgraded():
+    hasher = PasswordHasher('scrypt', n=2 ** 11)
+    assert hasher.needs_rehash(PasswordHasher('scrypt', n=2 ** 10).hash('secret'))
+    assert hasher.needs_rehash(PasswordHasher('pbkdf2_sha256', iterations=1000).hash('secret'))
+    assert hasher.needs_rehash('2bb80d537b1da3e38bd30361aa855686bde0eacd7162fef6a25fe97bf527a25b')
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+
+
+def test_stronger_hashes_are_not_downgraded():
+    hasher = PasswordHasher('pbkdf2_sha256', iterations=1000)
+    assert not hasher.needs_rehash(PasswordHasher('pbkdf2_sha256', iterations=2000).hash('secret'))
+    assert not hasher.needs_rehash(PasswordHasher('scrypt', n=2 ** 10).hash('secret'))
+    assert not PasswordHasher('scrypt', n=2 ** 10).needs_rehash(
+        PasswordHasher('scrypt', n=2 ** 11).hash('secret'))
+
+
+def test_saved_parameters_are_used_when_the_database_is_opened(tmp_path):
+    path = str(tmp_path / 'kdf.db')
+    db = Database(path)
+    db.save_hasher(PasswordHasher('pbkdf2_sha256', iterations=1234))
+    db.close()
+    db = Database(path)
+    assert db.hasher.settings() == 'pbkdf2_sha256$1234'
+    assert db.register_user('alice', 'secret')
+    with db.pool.connection() as conn:
+        stored = conn.execute("SELECT password FROM users WHERE username = 'alice'").fetchone()[0]
+    assert stored.startswith('pbkdf2_sha256$1234$')
+    db.close()
+
+
+def test_calibrate_kdf_saves_its_parameters(tmp_path, capsys):
+    path = str(tmp_path / 'kdf.db')
+    assert cli.main(['--db', path, 'calibrate-kdf', '--target-ms', '5',
+                     '--algorithm', 'pbkdf2_sha256']) == 0
+    printed = capsys.readouterr().out
+    db = Database(path)
+    assert repr(db.hasher) in printed
+    db.close()
+
+
+def test_login_throttle_locks_out_and_forgets_expired_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(passwords.time, 'monotonic', lambda: now[0])
+    throttle = LoginThrottle(max_failures=2, window=60, base_delay=10, max_delay=100)
+    for n in range(100):
+        throttle.record_failure(f'user{n}')
+    now[0] += 30
+    throttle.record_failure('alice')
+    assert throttle.retry_after('alice') == 0
+    throttle.record_failure('alice')
+    assert throttle.retry_after('alice') == 10
+    throttle.record_failure('alice')
+    assert throttle.retry_after('alice') == 20
+
+    now[0] += 31
+    throttle.record_failure('bob')
+    # The early failures are past their window; alice's is not
+    assert set(throttle._failures) == {'alice', 'bob'}
+    assert throttle.retry_after('alice') == 0
+    now[0] += 100
+    throttle.record_success('bob')
+    throttle.record_failure('carol')
+    assert set(throttle._failures) == {'carol'}
+    assert len(throttle._expiries) == 1
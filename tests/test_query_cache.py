@@ -0,0 +1,152 @@
+import random
+import threading
+
+from cache import ExpenseCache, QueryCache, UserLedger
+from database import Database
+from dates import format_day, parse_day
+from service import ExpenseService, normalize_filters
+
+
+def test_analytics_are_memoized_until_a_write_touches_the_filter(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    service = ExpenseService(QueryCache(ExpenseCache(db)))
+    service.db.add_expense(1, 1000, 'Food', 'Lunch', '2024-01-06')
+    service.db.add_expense(1, 2500, 'Transport', 'Train', '2024-02-06')
+    food = normalize_filters('Food', '', '')
+    everything = normalize_filters('', '', '')
+
+    first = service.analytics(1, food)
+    assert service.analytics(1, food) is first
+    overall = service.analytics(1, everything)
+    assert overall['by_category'] == {'Food': 1000, 'Transport': 2500}
+
+    # A write outside the Food filter keeps its result but not the unfiltered one
+    service.db.add_expense(1, 700, 'Transport', 'Bus', '2024-02-07')
+    assert service.analytics(1, food) is first
+    assert service.analytics(1, everything)['by_category'] == {'Food': 1000, 'Transport': 3200}
+
+    service.db.add_expense(1, 300, 'Food', 'Coffee', '2024-02-08')
+    assert service.analytics(1, food)['by_category'] == {'Food': 1300}
+    db.close()
+
+
+class SlowLoads:
+    """Database wrapper whose ledger reads for one user wait for a signal"""
+
+    def __init__(self, db, slow_user):
+        self.db = db
+        self.slow_user = slow_user
+        self.loads = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def iter_expenses(self, user_id, *args, **kwargs):
+        self.loads.append(user_id)
+        if user_id == self.slow_user:
+            self.started.set()
+            self.release.wait(5)
+        return self.db.iter_expenses(user_id, *args, **kwargs)
+
+
+def test_ledger_loads_do_not_block_other_users(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    db.add_expense(1, 1000, 'Food', 'Lunch', '2024-01-06')
+    db.add_expense(2, 2500, 'Transport', 'Train', '2024-02-06')
+    slow = SlowLoads(db, slow_user=2)
+    cache = ExpenseCache(slow)
+    assert cache.get_expense_summary(1)['total'] == 1000
+
+    readers = [threading.Thread(target=cache.get_expense_summary, args=(2,)) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    assert slow.started.wait(5)
+    # User 2's ledger is loading; user 1 is still served, and writes go through
+    totals = []
+
+    def use_other_user():
+        totals.append(cache.get_expense_summary(1)['total'])
+        cache.add_expense(1, 500, 'Food', 'Coffee', '2024-01-07')
+        totals.append(cache.get_expense_summary(1)['total'])
+    other = threading.Thread(target=use_other_user)
+    other.start()
+    other.join(2)
+    blocked = other.is_alive()
+    slow.release.set()
+    other.join()
+    assert not blocked
+    assert totals == [1000, 1500]
+    for reader in readers:
+        reader.join()
+    assert slow.loads.count(2) == 1
+    assert cache.get_expense_summary(2)['total'] == 2500
+    db.close()
+
+
+def test_a_load_overlapping_a_write_is_not_kept(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    db.add_expense(2, 2500, 'Transport', 'Train', '2024-02-06')
+    slow = SlowLoads(db, slow_user=2)
+    cache = ExpenseCache(slow)
+    reader = threading.Thread(target=cache.get_expense_summary, args=(2,))
+    reader.start()
+    assert slow.started.wait(5)
+    cache.add_expense(2, 700, 'Transport', 'Bus', '2024-02-07')
+    slow.release.set()
+    reader.join()
+    assert cache.stats()['users'] == 0
+    assert cache.get_expense_summary(2)['total'] == 3200
+    assert cache.stats()['users'] == 1
+    db.close()
+
+
+def test_ledger_totals_stay_exact_across_writes():
+    ledger = UserLedger()
+    rng = random.Random(12)
+    first = parse_day('2024-01-01')
+    expenses = {}
+    for expense_id in range(1, 400):
+        expense = {'id': expense_id, 'amount': rng.randrange(1, 10000),
+                   'category': rng.choice(['Food', 'Transport']), 'description': 'x',
+                   'date': format_day(first + rng.randrange(60))}
+        if expense_id < 200:
+            expenses[expense_id] = expense
+            continue
+        if expense_id == 200:
+            ledger.load(sorted(expenses.values(), key=lambda e: (e['date'], e['id']),
+                               reverse=True))
+        if rng.random() < 0.4:
+            removed = expenses.pop(rng.choice(list(expenses)))
+            assert ledger.remove(removed)
+            assert not ledger.remove(removed)
+        else:
+            expenses[expense_id] = expense
+            ledger.add(expense)
+        start, end = sorted(rng.randrange(first, first + 60) for _ in range(2))
+        category = rng.choice([None, 'Food'])
+        chosen = [e['amount'] for e in expenses.values()
+                  if start <= parse_day(e['date']) <= end
+                  and category in (None, e['category'])]
+        result = ledger.query(start, end, category, limit=3)
+        assert (result['total'], result['count']) == (sum(chosen), len(chosen))
+    everything = ledger.query(None, None, None)
+    assert [e['id'] for e in everything['expenses']] == [
+        e['id'] for e in sorted(expenses.values(), key=lambda e: (e['date'], e['id']),
+                                reverse=True)]
+    assert everything['total'] == sum(e['amount'] for e in expenses.values())
+
+
+def test_single_deletes_update_a_cached_ledger(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    cache = ExpenseCache(db)
+    ids = [db.add_expense(1, 100 * n, 'Food', 'Meal', f'2024-01-{n:02d}') for n in range(1, 6)]
+    assert cache.get_expense_summary(1) == {'total': 1500, 'count': 5}
+    assert cache.delete_expense(ids[2], 1)
+    assert not cache.delete_expense(ids[2], 1)
+    assert cache.get_expense_summary(1) == {'total': 1200, 'count': 4}
+    assert cache.get_expense_summary(1, category='Food', start_date='2024-01-02') == {
+        'total': 1100, 'count': 3}
+    assert cache.stats()['users'] == 1 and cache.misses == 1
+    db.close()
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from query_executor import QueryExecutor
+
+
+class FakeRoot:
+    """Stands in for the Tk root: after() callbacks run from run_until()"""
+
+    def __init__(self):
+        self.pending = {}
+        self.reported = []
+        self.next_id = 0
+
+    def after(self, ms, callback):
+        self.next_id += 1
+        self.pending[self.next_id] = callback
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    def report_callback_exception(self, exc_type, value, tb):
+        self.reported.append(value)
+
+    def run_until(self, condition, timeout=5):
+        """Run after() callbacks as they come due until condition() holds"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline
+            callbacks, self.pending = list(self.pending.values()), {}
+            for callback in callbacks:
+                callback()
+
+
+def test_callback_errors_are_reported_and_polling_continues():
+    root = FakeRoot()
+    executor = QueryExecutor(root, max_workers=1)
+    gate = threading.Event()
+    delivered = []
+
+    def broken(result):
+        raise RuntimeError("bad callback")
+    executor.submit(lambda: 1, on_success=broken)
+    executor.submit(lambda: 1 / 0)
+    executor.submit(gate.wait, 5, on_success=delivered.append)
+    root.run_until(lambda: len(root.reported) == 2)
+    assert [type(error) for error in root.reported] == [RuntimeError, ZeroDivisionError]
+    # The third job is still running, so the poll was rescheduled
+    assert root.pending
+    gate.set()
+    root.run_until(lambda: delivered)
+    assert delivered == [True]
+    assert not root.pending
+    executor.shutdown()
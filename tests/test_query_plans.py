@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from database import DEFAULT_SORT, Database, _filter_days
+
+CATEGORIES = ['Food', 'Transport', 'Shopping', 'Bills']
+
+
+@pytest.fixture(scope='module')
+def db(tmp_path_factory):
+    """A database with a few users and a seeded mix of expenses, analyzed"""
+    rng = random.Random(1)
+    db = Database(str(tmp_path_factory.mktemp('plans') / 'plans.db'))
+    for user_id in range(1, 6):
+        db.add_expenses(user_id, [(rng.randint(100, 20000), rng.choice(CATEGORIES),
+                                   f'item {rng.randint(0, 999)}',
+                                   f'{rng.randint(2020, 2024)}-{rng.randint(1, 12):02d}-'
+                                   f'{rng.randint(1, 28):02d}')
+                                  for _ in range(2000)])
+    with db.pool.connection() as conn:
+        conn.execute('ANALYZE')
+        conn.commit()
+    yield db
+    db.close()
+
+
+def page_plan(db, start_date, end_date, category):
+    """EXPLAIN QUERY PLAN of the first page of a listing, newest first"""
+    start_day, end_day = _filter_days(start_date, end_date)
+    with db.pool.connection() as conn:
+        query, params, _ = db._page_query(conn, 1, start_day, end_day, category, None, 50, 0,
+                                          DEFAULT_SORT, None, None)
+    return ' '.join(db.explain(query, params))
+
+
+def test_no_filter_query_scans_the_table(db):
+    assert db.check_query_plans() == []
+
+
+@pytest.mark.parametrize('start_date, end_date', [(None, None), ('2023-01-01', '2023-12-31')])
+def test_date_filters_use_user_day_index(db, start_date, end_date):
+    detail = page_plan(db, start_date, end_date, None)
+    assert 'INDEX idx_expenses_user_day ' in detail
+    assert 'TEMP B-TREE' not in detail
+
+
+@pytest.mark.parametrize('start_date, end_date', [(None, None), ('2023-01-01', '2023-12-31')])
+def test_category_filters_use_user_category_day_index(db, start_date, end_date):
+    detail = page_plan(db, start_date, end_date, 'Food')
+    assert 'INDEX idx_expenses_user_category_day ' in detail
+    assert 'TEMP B-TREE' not in detail
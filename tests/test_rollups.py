@@ -0,0 +1,112 @@
+import operator
+import random
+
+from database import Database, _rollup_segments
+from dates import format_day, month_of, parse_day
+
+FIRST_DAY = parse_day('2023-12-20')
+LAST_DAY = parse_day('2024-04-10')
+
+COMPARISONS = {'>=': operator.ge, '>': operator.gt, '<=': operator.le, '<': operator.lt}
+
+
+def covered_days(segments, low=FIRST_DAY - 40, high=LAST_DAY + 40):
+    """Every day in [low, high] the segments read, with how many segments read it"""
+    counts = {}
+    for day in range(low, high + 1):
+        for table, conditions in segments:
+            value = day if table == 'expense_daily_rollup' else month_of(day)
+            if all(COMPARISONS[clause.split()[1]](value, bound) for clause, bound in conditions):
+                counts[day] = counts.get(day, 0) + 1
+    return counts
+
+
+def test_segments_cover_each_day_once():
+    edges = [None, '2023-12-01', '2023-12-31', '2024-01-01', '2024-01-15', '2024-01-31',
+             '2024-02-01', '2024-02-29', '2024-03-01', '2024-03-02']
+    for start in edges:
+        for end in edges:
+            start_day = parse_day(start) if start else None
+            end_day = parse_day(end) if end else None
+            counts = covered_days(_rollup_segments(start_day, end_day))
+            expected = {day for day in range(FIRST_DAY - 40, LAST_DAY + 41)
+                        if (start_day is None or day >= start_day)
+                        and (end_day is None or day <= end_day)}
+            assert set(counts) == expected, (start, end)
+            assert set(counts.values()) <= {1}, (start, end)
+
+
+def test_segments_use_months_where_whole():
+    january = _rollup_segments(parse_day('2024-01-01'), parse_day('2024-01-31'))
+    assert january == [('expense_monthly_rollup', [('month >= ?', 2024 * 12),
+                                                   ('month <= ?', 2024 * 12)])]
+    inside = _rollup_segments(parse_day('2024-01-02'), parse_day('2024-01-30'))
+    assert [table for table, _ in inside] == ['expense_daily_rollup']
+    across = _rollup_segments(parse_day('2023-12-31'), parse_day('2024-02-01'))
+    assert [table for table, _ in across] == ['expense_monthly_rollup', 'expense_daily_rollup',
+                                              'expense_daily_rollup']
+
+
+def test_summaries_match_the_raw_rows(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    rng = random.Random(6)
+    expenses = []
+    for _ in range(300):
+        expense = {'amount': rng.randrange(1, 10000), 'description': 'x',
+                   'category': rng.choice(['Food', 'Transport', 'Other']),
+                   'date': format_day(rng.randint(FIRST_DAY, LAST_DAY))}
+        expenses.append(expense)
+    db.add_expenses(1, [(expense['amount'], expense['category'], expense['description'],
+                         expense['date']) for expense in expenses])
+    db.add_expense(2, 999, 'Food', 'x', '2024-01-15')
+
+    edges = [None, '2023-12-20', '2023-12-31', '2024-01-01', '2024-01-17', '2024-02-29',
+             '2024-03-01', '2024-04-10']
+    for start in edges:
+        for end in edges:
+            for category in [None, 'Food']:
+                chosen = [expense['amount'] for expense in expenses
+                          if (start is None or expense['date'] >= start)
+                          and (end is None or expense['date'] <= end)
+                          and (category is None or expense['category'] == category)]
+                summary = db.get_expense_summary(1, start, end, category)
+                assert summary == {'total': sum(chosen), 'count': len(chosen)}, (start, end)
+    db.close()
+
+
+def test_rollups_follow_writes_and_verify_reports_drift(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    first = db.add_expense(1, 1000, 'Food', 'Lunch', '2024-01-31')
+    db.add_expense(1, 250, 'Food', 'Coffee', '2024-01-31')
+    db.add_expense(1, 400, 'Transport', 'Bus', '2024-02-01')
+    db.add_expense(2, 700, 'Food', 'Lunch', '2024-01-31')
+    assert db.verify_rollups() == []
+
+    db.delete_expense(first, 1)
+    batch = db.delete_expenses([first + 1, first + 2], 1)['batch_id']
+    assert db.verify_rollups() == []
+    assert db.get_expense_summary(1) == {'total': 0, 'count': 0}
+    with db.pool.connection() as conn:
+        # Emptied groups leave no zero rows behind
+        assert conn.execute('SELECT COUNT(*) FROM expense_daily_rollup WHERE user_id = 1'
+                            ).fetchone()[0] == 0
+    db.restore_expenses(batch, 1)
+    assert db.verify_rollups() == []
+    assert db.get_expense_summary(1) == {'total': 650, 'count': 2}
+
+    day = parse_day('2024-01-31')
+    with db.pool.connection() as conn:
+        conn.execute('UPDATE expense_daily_rollup SET total = total + 1 WHERE user_id = 1')
+        conn.execute('DELETE FROM expense_monthly_rollup WHERE user_id = 2')
+        conn.commit()
+    assert db.verify_rollups(1) == [('expense_daily_rollup', 1, day, 'Food', (250, 1), (251, 1)),
+                                    ('expense_daily_rollup', 1, day + 1, 'Transport',
+                                     (400, 1), (401, 1))]
+    assert db.verify_rollups(2) == [('expense_monthly_rollup', 2, 2024 * 12, 'Food',
+                                     (700, 1), None)]
+    db.rebuild_rollups(1)
+    assert db.verify_rollups() == [('expense_monthly_rollup', 2, 2024 * 12, 'Food',
+                                    (700, 1), None)]
+    db.rebuild_rollups()
+    assert db.verify_rollups() == []
+    db.close()
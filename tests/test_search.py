@@ -0,0 +1,52 @@
+import pytest
+
+from database import Database, LoggedDatabase
+from search import match_expression, matches, normalize_search, tokenize
+
+DESCRIPTIONS = [
+    'Coffee at Starbucks', 'coffee beans', 'Café au lait', 'CAFE_LATTE', 'Crème brûlée',
+    'Uber to airport', 'uber-eats dinner', 'Rent 2024-01', 'rent', 'Train: Zürich → Bern',
+    'Dinner & drinks', 'ﬁsh and chips', '', 'Straße parking', 'Coffee', 'ΟΔΟΣ', 'Ⅻ ｆｕｌｌ',
+]
+
+SEARCHES = ['cof', 'cof sta', 'CAFE', 'cafe lait', 'creme', 'brulee', 'uber', 'uber eats',
+            'eats uber', '2024', '2024 01', 'zurich bern', 'rent', 'r', '&', 'fish', 'strasse',
+            'straße', 'οδοσ', 'οδος', 'xii', 'full', 'ｆｕ', 'coffee at starbucks', 'coffees',
+            'nothing here']
+
+
+def test_tokenize():
+    assert tokenize('Café au lait') == ['cafe', 'au', 'lait']
+    assert tokenize('CAFE_LATTE uber-eats') == ['cafe', 'latte', 'uber', 'eats']
+    assert normalize_search('  Cof,  STA ') == 'cof sta'
+    assert normalize_search('&!') is None
+    assert match_expression('cof sta') == '"cof"* AND "sta"*'
+
+
+@pytest.mark.parametrize('database', [Database, LoggedDatabase])
+def test_index_and_matches_agree(tmp_path, database):
+    db = database(str(tmp_path / 'expenses.db'))
+    ids = {db.add_expense(1, 100, 'Food', description, '2024-01-06'): description
+           for description in DESCRIPTIONS}
+    db.add_expense(2, 100, 'Food', 'Coffee', '2024-01-06')
+    for search in SEARCHES:
+        if normalize_search(search) is None:
+            continue
+        expected = {id for id, description in ids.items() if matches(description, search)}
+        found = {expense['id'] for expense in db.get_expenses(1, search=search)}
+        assert found == expected, search
+        assert db.count_expenses(1, search=search) == len(expected), search
+    db.close()
+
+
+def test_index_follows_deletes_and_restores(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    coffee = db.add_expense(1, 100, 'Food', 'Coffee', '2024-01-06')
+    beans = db.add_expense(1, 100, 'Food', 'coffee beans', '2024-01-06')
+    batch = db.delete_expenses([coffee], 1)['batch_id']
+    assert [expense['id'] for expense in db.get_expenses(1, search='cof')] == [beans]
+    db.restore_expenses(batch, 1)
+    assert {expense['id'] for expense in db.get_expenses(1, search='cof')} == {coffee, beans}
+    db.delete_expense(beans, 1)
+    assert [expense['id'] for expense in db.get_expenses(1, search='beans')] == []
+    db.close()
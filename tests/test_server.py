@@ -0,0 +1,205 @@
+import asyncio
+import http.client
+import json
+import socket
+import threading
+from urllib.parse import quote
+
+import pytest
+
+from cache import ExpenseCache, QueryCache
+from database import Database
+from dates import parse_day
+from passwords import PasswordHasher
+from server import MAX_BATCH_REQUESTS, MAX_BODY_BYTES, MAX_HEADER_BYTES, ExpenseServer
+from service import ExpenseService
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.token = None
+
+    def request(self, method, path, body=None, token=None):
+        """(status, JSON body, headers) of one request on a new connection"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        headers = {}
+        if token or self.token:
+            headers['Authorization'] = f'Bearer {token or self.token}'
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        payload = json.loads(response.read())
+        conn.close()
+        return response.status, payload, dict(response.getheaders())
+
+    def login(self, username='alice', password='secret'):
+        self.request('POST', '/register', {'username': username, 'password': password})
+        status, payload, _ = self.request('POST', '/login',
+                                          {'username': username, 'password': password})
+        assert status == 200
+        self.token = payload['token']
+
+    def raw(self, head):
+        """Send a raw request head and return the status line of the reply"""
+        with socket.create_connection(('127.0.0.1', self.port), timeout=10) as sock:
+            sock.sendall(head)
+            return sock.makefile('rb').readline().decode('latin-1').strip()
+
+
+def start_server(tmp_path, **options):
+    db = Database(str(tmp_path / 'expenses.db'),
+                  hasher=PasswordHasher('pbkdf2_sha256', iterations=1000))
+    server = ExpenseServer(ExpenseService(QueryCache(ExpenseCache(db))), workers=2, **options)
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(asyncio.start_server(
+        server.handle_connection, '127.0.0.1', 0, limit=MAX_HEADER_BYTES))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def close_connections():
+        listener.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(close_connections(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        server.executor.shutdown(wait=True)
+        db.close()
+    return Client(listener.sockets[0].getsockname()[1]), stop
+
+
+@pytest.fixture
+def client(tmp_path):
+    client, stop = start_server(tmp_path, rate=0, login_rate=0)
+    yield client
+    stop()
+
+
+def test_expense_endpoints(client):
+    assert client.request('GET', '/expenses')[0] == 401
+    client.login()
+    for day in (5, 6, 7):
+        status, stored, _ = client.request('POST', '/expenses', {
+            'amount': 100 * day, 'category': 'Food', 'description': f'Meal {day}',
+            'date': f'2024-01-0{day}'})
+        assert status == 201 and stored['date'] == f'2024-01-0{day}'
+    status, imported, _ = client.request('POST', '/expenses/bulk', {
+        'expenses': [[250, 'Bills', 'Power', '2024-02-01']]})
+    assert (status, imported) == (200, {'imported': 1})
+
+    status, page, _ = client.request('GET', '/expenses?limit=2&sort=-date')
+    assert status == 200
+    assert [e['description'] for e in page['expenses']] == ['Power', 'Meal 7']
+    assert page['has_next'] and page['total_rows'] == 4
+    status, summary, _ = client.request('GET', '/summary?category=Food')
+    assert (summary['total'], summary['count']) == (1800, 3)
+    status, analytics, _ = client.request('GET', '/analytics')
+    assert analytics['by_category'] == {'Food': 1800, 'Bills': 250}
+
+    status, deleted, _ = client.request('POST', '/expenses/delete',
+                                        {'filters': {'category': 'Food'}})
+    assert status == 200 and len(deleted['expenses']) == 3
+    assert client.request('GET', '/summary')[1]['count'] == 1
+    status, restored, _ = client.request('POST', '/undo', {})
+    assert status == 200 and len(restored['expenses']) == 3
+    assert client.request('GET', '/summary')[1]['count'] == 4
+
+
+def test_error_codes(client):
+    assert client.request('GET', '/nowhere')[0] == 404
+    assert client.request('DELETE', '/expenses')[0] == 405
+    assert client.request('POST', '/login', {'username': 'x', 'password': 'nope'})[0] == 401
+    client.login()
+    assert client.request('POST', '/register', {'username': 'alice',
+                                                'password': 'secret'})[0] == 409
+    assert client.request('POST', '/expenses', {'amount': 1.5, 'category': 'Food',
+                                                'date': '2024-01-05'})[0] == 400
+    assert client.request('POST', '/expenses', ['not', 'an', 'object'])[0] == 400
+    assert client.request('GET', '/expenses?limit=5000')[0] == 400
+    assert client.request('GET', '/expenses?sort=colour')[0] == 400
+    assert client.request('POST', '/expenses/delete', {'ids': ['1']})[0] == 400
+    assert client.request('GET', '/summary', token='expired')[0] == 401
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('-date', '[1]'), ('-date', '[[1], 2]'), ('-date', '["2024-01-05", 2]'),
+    ('-date', '[1, 2, 3]'), ('-date', '[true, 2]'), ('-date', '[1, 1e3]'),
+    ('-date', '{"day": 1}'), ('-date', '[1, 99999999999999999999]'),
+    ('category', '[1, "Food", 2]'), ('description', '[null, 2]'),
+])
+def test_malformed_sort_keys_are_rejected(client, sort, key):
+    client.login()
+    for name in ('after', 'before'):
+        status, payload, _ = client.request('GET', f'/expenses?sort={sort}&{name}={quote(key)}')
+        assert status == 400, payload
+        assert payload['error'].startswith(f"{name} must be a sort key")
+
+
+def test_well_formed_sort_keys_page_on(client):
+    client.login()
+    for day in (5, 6, 7):
+        client.request('POST', '/expenses', {'amount': 100, 'category': 'Food',
+                                             'date': f'2024-01-0{day}'})
+    page = client.request('GET', '/expenses?limit=1&sort=category')[1]
+    expense = page['expenses'][0]
+    key = json.dumps(['Food', parse_day(expense['date']), expense['id']])
+    status, following, _ = client.request('GET', f'/expenses?limit=5&sort=category&after={quote(key)}')
+    assert status == 200 and [e['date'] for e in following['expenses']] == ['2024-01-06',
+                                                                             '2024-01-07']
+
+
+def test_batch_runs_requests_in_order(client):
+    client.login()
+    status, payload, _ = client.request('POST', '/batch', {'requests': [
+        {'method': 'POST', 'path': '/expenses',
+         'body': {'amount': 300, 'category': 'Food', 'date': '2024-03-01'}},
+        {'method': 'GET', 'path': '/summary'},
+        {'method': 'GET', 'path': '/nowhere'},
+        {'method': 'POST', 'path': '/batch', 'body': {'requests': []}},
+        {'method': 'GET', 'path': '/expenses', 'query': {'after': '[1]'}},
+    ]})
+    assert status == 200
+    statuses = [response['status'] for response in payload['responses']]
+    assert statuses == [201, 200, 404, 400, 400]
+    assert payload['responses'][1]['body']['total'] == 300
+
+    too_many = [{'method': 'GET', 'path': '/summary'}] * (MAX_BATCH_REQUESTS + 1)
+    assert client.request('POST', '/batch', {'requests': too_many})[0] == 400
+    assert client.request('POST', '/batch', {'requests': 'all'})[0] == 400
+
+
+def test_rate_limits(tmp_path):
+    client, stop = start_server(tmp_path, rate=0.01, burst=5, login_rate=0.01, login_burst=4)
+    try:
+        client.login()
+        for _ in range(5):
+            assert client.request('GET', '/summary')[0] == 200
+        status, payload, headers = client.request('GET', '/summary')
+        assert status == 429 and int(headers['Retry-After']) >= 1
+        # Another user has a bucket of their own, but logins share the address's bucket
+        other = Client(client.port)
+        other.login('bob', 'secret')
+        assert other.request('GET', '/summary')[0] == 200
+        assert other.request('POST', '/batch', {'requests': [
+            {'method': 'GET', 'path': '/summary'}] * 5})[0] == 429
+        assert other.request('POST', '/login', {'username': 'bob',
+                                                'password': 'secret'})[0] == 429
+    finally:
+        stop()
+
+
+def test_content_length_is_checked(client):
+    def head(length):
+        return (f'POST /login HTTP/1.1\r\nHost: x\r\nContent-Length: {length}\r\n\r\n'
+                .encode('latin-1'))
+    assert client.raw(head('abc')).startswith('HTTP/1.1 400')
+    assert client.raw(head('-5')).startswith('HTTP/1.1 400')
+    assert client.raw(head('+5')).startswith('HTTP/1.1 400')
+    assert client.raw(head(MAX_BODY_BYTES + 1)).startswith('HTTP/1.1 413')
+    assert client.raw(b'POST /logout HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}').startswith(
+        'HTTP/1.1 401')
@@ -0,0 +1,45 @@
+from database import Database, DEFAULT_SORT, sort_key
+from service import ExpenseService, PageMemo, normalize_filters
+
+
+def make_service(tmp_path, rows):
+    db = Database(str(tmp_path / 'expenses.db'))
+    service = ExpenseService(db)
+    for day in range(1, rows + 1):
+        db.add_expense(1, 100 * day, 'Food', f'Meal {day}', f'2024-01-{day:02d}')
+    return db, service
+
+
+def test_page_memo_keeps_the_first_page_apart_from_a_fallback_page(tmp_path):
+    db, service = make_service(tmp_path, 25)
+    filters = normalize_filters()
+    memo = PageMemo(16)
+    first = service.load_page(1, filters, 0, 10)
+    memo.put(first)
+    second = service.load_page(1, filters, 10, 10, DEFAULT_SORT,
+                               after=sort_key(first['expenses'][-1], DEFAULT_SORT[0]))
+    # The rows from mid second page on go away, so its cursor runs off the end
+    db.delete_expenses(list(range(1, 13)), 1)
+    cursor = sort_key(second['expenses'][-1], DEFAULT_SORT[0])
+    page = service.load_page(1, filters, 20, 10, DEFAULT_SORT, after=cursor)
+    assert (page['after'], page['before'], page['offset']) == (None, None, 10)
+    assert [e['description'] for e in page['expenses']] == ['Meal 15', 'Meal 14', 'Meal 13']
+    memo.put(page)
+
+    assert memo.get(filters, DEFAULT_SORT, 0, None, None) is first
+    assert memo.get(filters, DEFAULT_SORT, 10, None, None) is page
+    db.close()
+
+
+def test_page_memo_evicts_the_least_recently_used_page(tmp_path):
+    db, service = make_service(tmp_path, 5)
+    memo = PageMemo(2)
+    pages = [service.load_page(1, normalize_filters(category), 0, 10)
+             for category in ('Food', 'Bills', 'Other')]
+    memo.put(pages[0])
+    memo.put(pages[1])
+    assert memo.get(pages[0]['filters'], DEFAULT_SORT, 0, None, None) is pages[0]
+    memo.put(pages[2])
+    assert memo.get(pages[1]['filters'], DEFAULT_SORT, 0, None, None) is None
+    assert memo.get(pages[0]['filters'], DEFAULT_SORT, 0, None, None) is pages[0]
+    db.close()
@@ -0,0 +1,93 @@
+import os
+import random
+from collections import Counter
+
+from database import Database
+from passwords import PasswordHasher
+from sharding import (CATALOG_FILE, SHARD_FILE, ShardedDatabase, rebalance, shard_for, split,
+                      status)
+
+
+def ledgers(store, user_ids):
+    """Each user's expenses, without ids, as a multiset"""
+    return {user_id: Counter((expense['amount'], expense['category'], expense['description'],
+                              expense['date'])
+                             for expense in store.iter_expenses(user_id))
+            for user_id in user_ids}
+
+
+def make_source(path, users=40):
+    db = Database(path, hasher=PasswordHasher('scrypt', n=2 ** 10))
+    rng = random.Random(24)
+    user_ids = []
+    for n in range(users):
+        db.register_user(f'user{n}', f'secret{n}')
+        user_id = db.get_user_id(f'user{n}')
+        user_ids.append(user_id)
+        db.add_expenses(user_id, [(rng.randrange(1, 5000), rng.choice(['Food', 'Other']),
+                                   f'Item {rng.randrange(5)}', f'2024-0{rng.randint(1, 9)}-15')
+                                  for _ in range(rng.randrange(0, 30))])
+    expected = ledgers(db, user_ids)
+    db.close()
+    return user_ids, expected
+
+
+def test_jump_hash_moves_users_only_to_the_new_shard():
+    for shards in range(1, 8):
+        for user_id in range(1, 500):
+            before, after = shard_for(user_id, shards), shard_for(user_id, shards + 1)
+            assert 0 <= before < shards
+            assert after in (before, shards)
+
+
+def test_split_keeps_every_user_and_row(tmp_path):
+    source = str(tmp_path / 'expenses.db')
+    user_ids, expected = make_source(source)
+    directory = str(tmp_path / 'store')
+    progress = []
+    users, expenses = split(source, directory, 3, lambda done, total: progress.append(done))
+    assert users == len(user_ids) and progress[-1] == users
+    assert expenses == sum(sum(ledger.values()) for ledger in expected.values())
+
+    store = ShardedDatabase(directory)
+    assert ledgers(store, user_ids) == expected
+    assert store.authenticate_user('user7', 'secret7')
+    assert store.verify_rollups() == []
+    assert {store.shard_of(user_id) for user_id in user_ids} == {0, 1, 2}
+    store.close()
+    assert sum(row[2] for row in status(directory)) == expenses
+
+
+def test_rebalance_keeps_every_row(tmp_path):
+    source = str(tmp_path / 'expenses.db')
+    user_ids, expected = make_source(source)
+    directory = str(tmp_path / 'store')
+    split(source, directory, 2)
+    total = sum(sum(ledger.values()) for ledger in expected.values())
+
+    would_move = rebalance(directory, 5, dry_run=True)
+    moves = []
+    assert rebalance(directory, 5, on_move=lambda *move: moves.append(move)) == would_move
+    assert all(to == shard_for(user_id, 5) and frm != to for user_id, frm, to, _ in moves)
+    assert rebalance(directory, 5) == (0, 0)
+
+    # A copy left on the wrong shard by an interrupted move is cleaned up
+    stray = Database(os.path.join(directory, SHARD_FILE.format(0)))
+    misplaced = next(user_id for user_id in user_ids if shard_for(user_id, 5) != 0)
+    stray.add_expense(misplaced, 1, 'Food', 'Stray', '2024-01-01')
+    stray.close()
+    rebalance(directory, 5)
+
+    store = ShardedDatabase(directory)
+    assert len(store.shards) == 5
+    assert ledgers(store, user_ids) == expected
+    store.close()
+    assert sum(row[2] for row in status(directory)) == total
+
+    rebalance(directory, 1)
+    assert sorted(name for name in os.listdir(directory)
+                  if name.endswith('.db')) == [CATALOG_FILE, SHARD_FILE.format(0)]
+    store = ShardedDatabase(directory)
+    assert ledgers(store, user_ids) == expected
+    assert store.verify_rollups() == []
+    store.close()
@@ -0,0 +1,68 @@
+from cache import ExpenseCache, QueryCache
+from database import UNDO_BATCHES, Database
+from service import ExpenseService, normalize_filters
+
+
+def test_delete_and_restore_a_batch(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    ids = [db.add_expense(1, 100 * (n + 1), 'Food', f'Meal {n}', '2024-01-06') for n in range(5)]
+    other = db.add_expense(2, 999, 'Food', 'Meal', '2024-01-06')
+
+    result = db.delete_expenses([ids[3], ids[1], ids[1], other, 12345], 1)
+    assert [expense['id'] for expense in result['expenses']] == [ids[1], ids[3]]
+    assert db.last_undo_batch(1) == result['batch_id']
+    assert db.get_expense(other, 2) is not None
+    assert db.count_expenses(1) == 3
+
+    restored = db.restore_expenses(result['batch_id'], 2)
+    assert restored == []
+    restored = db.restore_expenses(result['batch_id'], 1)
+    assert restored == result['expenses']
+    assert db.get_expense(ids[1], 1) == result['expenses'][0]
+    assert db.get_expense_summary(1) == {'total': 1500, 'count': 5}
+    assert db.last_undo_batch(1) is None
+    assert db.restore_expenses(result['batch_id'], 1) == []
+    assert db.verify_rollups() == []
+
+    assert db.delete_expenses([other, 12345], 1) == {'batch_id': None, 'expenses': []}
+    assert db.last_undo_batch(1) is None
+    db.close()
+
+
+def test_only_the_latest_batches_are_kept(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    ids = [db.add_expense(1, 100, 'Food', 'Meal', '2024-01-06') for _ in range(UNDO_BATCHES + 3)]
+    other = db.delete_expenses([db.add_expense(2, 100, 'Food', 'Meal', '2024-01-06')], 2)
+    batches = [db.delete_expenses([expense_id], 1)['batch_id'] for expense_id in ids]
+
+    with db.pool.connection() as conn:
+        kept = [row[0] for row in conn.execute('SELECT id FROM expense_undo_batches '
+                                               'WHERE user_id = 1 ORDER BY id')]
+        rows = conn.execute('SELECT COUNT(*) FROM expense_undo_rows WHERE user_id = 1').fetchone()[0]
+    assert kept == batches[-UNDO_BATCHES:]
+    assert rows == UNDO_BATCHES
+    assert db.restore_expenses(batches[0], 1) == []
+    assert [expense['id'] for expense in db.restore_expenses(batches[-1], 1)] == [ids[-1]]
+    # Another user's journal is pruned separately
+    assert db.restore_expenses(other['batch_id'], 2) == other['expenses']
+    db.close()
+
+
+def test_undo_through_the_caches(tmp_path):
+    db = Database(str(tmp_path / 'expenses.db'))
+    service = ExpenseService(QueryCache(ExpenseCache(db)))
+    everything = normalize_filters()
+    ids = [service.db.add_expense(1, 100, 'Food', f'Meal {n}', '2024-01-06') for n in range(4)]
+    assert service.load_page(1, everything)['summary']['count'] == 4
+
+    deleted = service.delete_matching(1, normalize_filters(search='meal'))
+    assert sorted(expense['id'] for expense in deleted['expenses']) == ids
+    page = service.load_page(1, everything)
+    assert page['expenses'] == [] and page['summary']['count'] == 0
+
+    assert len(service.undo_delete(1)) == 4
+    page = service.load_page(1, everything)
+    assert sorted(expense['id'] for expense in page['expenses']) == ids
+    assert page['summary']['total'] == 400
+    assert service.undo_delete(1) == []
+    db.close()
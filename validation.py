@@ -0,0 +1,46 @@
+from dates import format_day, parse_day
+from money import parse_cents
+
+CATEGORIES = ['Food', 'Transport', 'Shopping', 'Bills', 'Entertainment',
+              'Healthcare', 'Education', 'Other']
+
+DEFAULT_DESCRIPTION = "No description"
+
+_CATEGORY_LOOKUP = {category.lower(): category for category in CATEGORIES}
+
+
+def parse_amount(value):
+    """Parse an expense amount into integer cents, raising ValueError with a user-facing message"""
+    cents = parse_cents(value)
+    if cents <= 0:
+        raise ValueError("Amount must be greater than 0")
+    return cents
+
+
+def parse_date(value, field="date"):
+    """Validate a YYYY-MM-DD date and return it in canonical form"""
+    try:
+        return format_day(parse_day(str(value).strip()))
+    except ValueError:
+        raise ValueError(f"Please enter {field} in YYYY-MM-DD format") from None
+
+
+def parse_category(value):
+    """Match a category name case-insensitively against CATEGORIES"""
+    category = _CATEGORY_LOOKUP.get(str(value or '').strip().lower())
+    if category is None:
+        raise ValueError(f"Unknown category: {value}")
+    return category
+
+
+def clean_description(value):
+    """Strip a description, falling back to the default text"""
+    return str(value or '').strip() or DEFAULT_DESCRIPTION
+
+
+def validate_credentials(username, password, new_account=False):
+    """Check login/registration input, raising ValueError with a user-facing message"""
+    if not (username or '').strip() or not password:
+        raise ValueError("Please enter both username and password")
+    if new_account and len(password) < 4:
+        raise ValueError("Password must be at least 4 characters")